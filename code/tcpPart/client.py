@@ -2,9 +2,19 @@ import socket
 import os
 import struct
 import time
+import sys
+# The manifest is the one of MADP, imported from udpPart next to this folder. Appended,
+# so the modules of this folder, e.g. utils, come first.
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'udpPart'))
+from madpManifest import Manifest
 from utils import FileReassembler
 
-fileReassembler = FileReassembler()
+# The received files are written under this folder, at the paths of the manifest
+OUTPUT_FOLDER = 'received'
+# Header of every chunk: fileId, chunkNum, chunkSize, isLastChunk
+CHUNK_HEADER = struct.Struct('!IIH?')
+
+fileReassembler = FileReassembler(OUTPUT_FOLDER)
 
 def receiveFile(conn):
     global fileReassembler
@@ -17,20 +27,19 @@ def receiveFile(conn):
         temp += data
 
 
+    # The manifest comes first, prefixed with its length
+    manifestSize = struct.unpack('!I', temp[0:4])[0]
+    fileReassembler.set_manifest(Manifest.decode(temp[4:4 + manifestSize]))
+
     # Reassemble the file
-    offset = 0
+    offset = 4 + manifestSize
     while offset < len(temp):
-        header = temp[offset:offset + 8]
-        packedFileId = struct.unpack('!H', header[0:2])[0]
-        packedChunkNum = struct.unpack('!H', header[2:4])[0]
-        packedChunkSize = struct.unpack('!H', header[4:6])[0]
-        isLastChunk = struct.unpack('!?', header[6:7])[0]
-        isLarge = struct.unpack('!?', header[7:8])[0]
-        offset += 8
+        packedFileId, packedChunkNum, packedChunkSize, isLastChunk = CHUNK_HEADER.unpack_from(temp, offset)
+        offset += CHUNK_HEADER.size
         packet = temp[offset:offset + packedChunkSize]
         offset += packedChunkSize
-        # print(f"Received chunk {packedChunkNum} of file {packedFileId}, isLastChunk: {isLastChunk}, isLarge: {isLarge}")
-        fileReassembler.add_chunk(packedFileId, packedChunkNum, packet, isLastChunk, isLarge)
+        # print(f"Received chunk {packedChunkNum} of file {packedFileId}, isLastChunk: {isLastChunk}")
+        fileReassembler.add_chunk(packedFileId, packedChunkNum, packet, isLastChunk)
 
 
 def client():
@@ -2,72 +2,44 @@ import socket
 import os
 import struct
 import hashlib
+import sys
+# The manifest is the one of MADP, imported from udpPart next to this folder. Appended,
+# so the modules of this folder, e.g. utils, come first.
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'udpPart'))
+from madpManifest import Manifest
 
+# Every file under DATA_FOLDER is sent, with its path relative to it
 DATA_FOLDER = "../app/objects"
 PACKET_SIZE = 1400
+# Header of every chunk: fileId, chunkNum, chunkSize, isLastChunk
+CHUNK_HEADER = struct.Struct('!IIH?')
 
 
-def readData():
-    data = {}
-    for i in range(10):
-        with open(DATA_FOLDER + f'/small-{i}.obj', 'rb') as f:
-            data[f'small-{i}.obj'] = f.read()
-    for i in range(10):
-        with open(DATA_FOLDER + f'/large-{i}.obj', 'rb') as f:
-            data[f'large-{i}.obj'] = f.read()        
-    return data
-
-def chunks(data):
-    chunked = []
-    for i in range(10):
-        fileData = data[f'small-{i}.obj']
-        for i in range(0, len(fileData), PACKET_SIZE):
-            chunk = fileData[i:i + PACKET_SIZE]
-            chunked.append(chunk)
-        data[f'small-{i}.obj'] = chunked
-    for i in range(10):
-        fileData = data[f'large-{i}.obj']
-        for i in range(0, len(fileData), PACKET_SIZE):
-            chunk = fileData[i:i + PACKET_SIZE]
-            chunked.append(chunk)
-        data[f'large-{i}.obj'] = chunked
-    return chunked, len(chunked)   
-
-def interleaved_chunks(data):
-    chunked = []
-    for j in range(10):
-        for size in ['small', 'large']:
-            tempchunked = []
-            fileData = data[f'{size}-{j}.obj']
-            file_id = j
-            is_large = size == 'large'
-            for i in range(0, len(fileData), PACKET_SIZE):
-                chunk = fileData[i:i + PACKET_SIZE]
-                chunk_num = i // PACKET_SIZE
-                # #print(f"Chunk {chunk_num} of file {size}-{j}.obj is {len(chunk)} bytes long")
-                tempchunked.append((file_id, chunk_num, chunk, 0, is_large)) # 0 means not last chunk
-            tempchunked[-1] = (file_id, chunk_num, chunk, 1, is_large)
-            #print(tempchunked[-1])
-            chunked += tempchunked
-            #print(f"File {size}-{j}.obj has {len(tempchunked)} chunks. Total chunks: {len(chunked)}")
-            # data[f'{size}-{j}.obj'] = chunked
-    return chunked, len(chunked)   
+def manifest_chunks(manifest):
+    """
+    Yields the chunks of the files of the manifest, file by file in manifest order,
+    as (file_id, chunk_num, chunk, flag) tuples. flag is 1 for the last chunk of a file.
+    """
+    for file_id, path, size in manifest:
+        with open(os.path.join(DATA_FOLDER, *path.split('/')), 'rb') as f:
+            fileData = f.read()
+        count = manifest.chunk_count(file_id)
+        for chunk_num in range(count):
+            chunk = fileData[chunk_num * PACKET_SIZE:(chunk_num + 1) * PACKET_SIZE]
+            yield file_id, chunk_num, chunk, int(chunk_num == count - 1)
 
 
 def sendFile( conn):
-    data = readData()
-    allchunks, total_chunks = interleaved_chunks(data) 
-    print(total_chunks)
-    for chunk in allchunks:
-         packedFileId = struct.pack('!H', chunk[0])  # 2 bytes
-         packedChunkNum = struct.pack('!H', chunk[1]) # 2 bytes
-         packedChunkSize = struct.pack('!H', len(chunk[2])) # 2 bytes
-         packedFlag = struct.pack('!?', chunk[3])  # 1 byte
-         packedIsLarge = struct.pack('!?', chunk[4]) # 1 byte
-         packet = chunk[2]
-         packet = packedFileId + packedChunkNum + packedChunkSize + packedFlag + packedIsLarge + packet
-         #print(f"Sending chunk {chunk[1]} of file {chunk[0]}, isLastChunk: {chunk[3]}, isLarge: {chunk[4]}")
-         conn.send(packet)
+    # The manifest goes first, prefixed with its length, and tells the client the path and size of every file id
+    manifest = Manifest.from_directory(DATA_FOLDER, PACKET_SIZE)
+    encoded = manifest.encode()
+    conn.sendall(struct.pack('!I', len(encoded)) + encoded)
+    print(manifest.total_chunks())
+    for chunk in manifest_chunks(manifest):
+         packedHeader = CHUNK_HEADER.pack(chunk[0], chunk[1], len(chunk[2]), chunk[3]) # fileId, chunkNum, chunkSize, flag
+         packet = packedHeader + chunk[2]
+         #print(f"Sending chunk {chunk[1]} of file {chunk[0]}, isLastChunk: {chunk[3]}")
+         conn.sendall(packet)
 
 # rest of the server code remains the same
 
@@ -21,10 +21,23 @@ def read_objects_from_file(path, size:str, file_id:int):
     
 
 class FileReassembler:
-    def __init__(self):
+    def __init__(self, directory='.'):
+        self.directory = directory
+        self.manifest = None # Paths and sizes of the files, see madpManifest
         self.files = {}  # Dictionary to hold file data
 
-    def add_chunk(self, file_id, chunk_number, data, flags, is_large):
+    def set_manifest(self, manifest):
+        """
+        Name the files after the manifest of the transfer, called before their first chunk.
+        """
+        self.manifest = manifest
+
+    def path(self, file_id):
+        if self.manifest is None:
+            return os.path.join(self.directory, f"reconstructed_{file_id}.obj")
+        return os.path.join(self.directory, *self.manifest.paths[file_id].split('/'))
+
+    def add_chunk(self, file_id, chunk_number, data, flags):
         """
         Add a chunk to the file assembly.
 
@@ -32,8 +45,8 @@ class FileReassembler:
             file_id (int): Identifier for the file.
             chunk_number (int): Sequence number of the chunk in the file.
             data (bytes): The actual data chunk.
+            flags (int): 1 if this is the last chunk of the file.
         """
-        file_id = f"l{file_id}" if is_large else f"s{file_id}"
         if file_id not in self.files:
             self.files[file_id] = {}
 
@@ -43,7 +56,9 @@ class FileReassembler:
         if flags == 1 and self.is_file_complete(file_id):
             file = self.assemble_file(file_id)
             # Write the file to disk
-            with open(f"reconstructed_{file_id}.obj", "wb") as f:
+            path = self.path(file_id)
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            with open(path, "wb") as f:
                 f.write(file)
             # Remove the file from the dictionary
             del self.files[file_id]
@@ -62,6 +77,8 @@ class FileReassembler:
         """
         if file_id not in self.files:
             return False
+        if self.manifest is not None:
+            return len(self.files[file_id]) == self.manifest.chunk_count(file_id)
 
         total_chunks = max(self.files[file_id].keys())
         # Sort the keys
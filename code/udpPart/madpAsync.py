@@ -0,0 +1,402 @@
+import asyncio
+import os
+import shutil
+import socket
+import sys
+import time
+from madpCodec import PacketEncoder, decode_handshake, is_handshake, is_probe
+from madpConnection import ReceiverConnection, SenderConnection
+from madpHandshake import ACCEPT, HELLO, HandshakeAcceptor, Session, SessionCache, load_key, new_connection_id, reject_reason
+from madpIntegrity import get_checksum
+from madpPmtu import answer_probe, discover_chunk_size
+from utils import StreamingReassembler
+
+# asyncio engine of MADP. The event loop owns the connection state of every transfer
+# and is the only one touching it, so nothing needs a lock: ACKs and data packets are
+# handled in datagram_received, and the retransmission and pacing deadlines are
+# loop.call_at callbacks. One process runs as many transfers as it has endpoints for,
+# e.g. with asyncio.gather over send_transfer or receive_transfer.
+
+# Packets handed to the kernel in one call, sent as one GSO buffer on Linux
+SEND_BATCH = 32
+
+
+class SenderProtocol(asyncio.DatagramProtocol):
+    """
+    Drives a SenderConnection from the event loop.
+
+    The protocol is the endpoint the ACKs arrive on. Data packets are sent from a
+    separate non-blocking socket with the packet encoder, so batches still go out
+    with sendmsg and UDP GSO. The HELLO of the connection goes out from the same socket.
+    When the socket buffer is full, the packets and repairs that did not go out are kept
+    and pumping stops until the socket is writable again, so nothing taken from the
+    connection is lost to the local buffer.
+    """
+    def __init__(self, connection, sock, address, batch=SEND_BATCH):
+        """
+        Args:
+            connection (SenderConnection): The transfer.
+            sock (socket.socket): Non-blocking UDP socket the data packets are sent from.
+            address (tuple): Address of the receiver.
+            batch (int): Maximum number of packets per send call.
+        """
+        self.connection = connection
+        self.sock = sock
+        self.address = address
+        self.batch = batch
+        self.encoder = PacketEncoder(connection.checksum, connection.ack_frequency, connection.ack_delay,
+                                     connection.connection_id)
+        self.loop = asyncio.get_running_loop()
+        self.finished = self.loop.create_future()
+        self.timer = None # Handle of the retransmission deadline
+        self.pending = None # Batch waiting for the pacer
+        self.blocked = None # (packets, repairs) waiting for the socket to be writable
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.pump()
+
+    def datagram_received(self, data, addr):
+        connection = self.connection
+        if connection.on_ack(data):
+            self.arm(connection.retransmit_delay())
+        self.pump()
+
+    def error_received(self, exc):
+        pass # ICMP errors of a UDP socket, lost packets are recovered by the protocol
+
+    def connection_lost(self, exc):
+        self.finish(exc)
+
+    def arm(self, delay):
+        """
+        Arm or re-arm the retransmission timer.
+        """
+        if self.timer is not None:
+            self.timer.cancel()
+        self.timer = self.loop.call_at(self.loop.time() + delay, self.on_timer)
+
+    def on_timer(self):
+        self.timer = None
+        delay = self.connection.on_timer()
+        if delay is not None:
+            self.arm(delay)
+        self.pump()
+
+    def pump(self):
+        """
+        Send batches for as long as the connection has packets that are due.
+        """
+        connection = self.connection
+        while self.pending is None and self.blocked is None and not connection.finished:
+            hello = connection.take_hello()
+            if hello is not None:
+                try:
+                    self.encoder.send_handshake(self.sock, self.address, *hello)
+                except BlockingIOError:
+                    pass # Sent again when the timer expires
+                self.arm(connection.retransmit_delay())
+            packets, delay, arm = connection.next_batch(self.batch)
+            if arm:
+                self.arm(connection.retransmit_delay())
+            if not packets:
+                return # Woken up again by an ACK or the timer
+            if delay > 0:
+                self.pending = packets
+                self.loop.call_at(self.loop.time() + delay, self.send_pending)
+                return
+            self.send(packets)
+        if connection.finished:
+            self.finish()
+
+    def send_pending(self):
+        packets, self.pending = self.pending, None
+        if not self.connection.finished:
+            self.send(packets)
+        self.pump()
+
+    def send(self, packets, repairs=None):
+        """
+        Send a batch and the repairs of the blocks it completed, the repairs taken from the
+        connection if None.
+        """
+        connection = self.connection
+        encoder = self.encoder
+        # The checksum and the connection id the receiver granted
+        if encoder.checksum is not connection.checksum:
+            encoder.use(connection.checksum)
+        encoder.connection_id = connection.connection_id
+        if repairs is None:
+            repairs = connection.take_repairs()
+        try:
+            if packets:
+                encoder.send_data_batch(self.sock, self.address, packets)
+            packets = []
+            while repairs:
+                encoder.send_repair(self.sock, self.address, *repairs[0])
+                repairs = repairs[1:]
+        except BlockingIOError:
+            # The socket buffer is full: keep what did not go out and wait until it drains
+            if packets:
+                packets = packets[encoder.batch_sent:]
+            self.blocked = (packets, repairs)
+            self.loop.add_writer(self.sock, self.on_writable)
+
+    def on_writable(self):
+        self.loop.remove_writer(self.sock)
+        packets, repairs = self.blocked
+        self.blocked = None
+        if not self.connection.finished:
+            self.send(packets, repairs)
+        self.pump()
+
+    def finish(self, exc=None):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        if self.blocked is not None:
+            self.loop.remove_writer(self.sock)
+            self.blocked = None
+        if not self.finished.done():
+            if exc is None:
+                self.finished.set_result(self.connection)
+            else:
+                self.finished.set_exception(exc)
+
+
+class ReceiverProtocol(asyncio.DatagramProtocol):
+    """
+    Drives a ReceiverConnection from the event loop.
+
+    The protocol is the endpoint the data packets arrive on, the ACKs are sent
+    from a separate non-blocking socket with the packet encoder. The connection is
+    opened by the first HELLO the acceptor accepts, and the ACKs go to the port the
+    HELLO tells; a HELLO of another sender is rejected as busy.
+    """
+    def __init__(self, acceptor, reassembler, sock):
+        """
+        Args:
+            acceptor (HandshakeAcceptor): Decides on the HELLO of the sender.
+            reassembler (FileReassembler): Receives the chunks, a new one by default.
+            sock (socket.socket): Non-blocking UDP socket the ACKs are sent from.
+        """
+        self.acceptor = acceptor
+        self.reassembler = reassembler
+        self.connection = None
+        self.sock = sock
+        self.address = None # Address the sender receives ACKs on
+        self.hello_reply = None # (connection id of the HELLO, send_handshake arguments) of the ACCEPT
+        self.encoder = PacketEncoder()
+        self.loop = asyncio.get_running_loop()
+        self.finished = self.loop.create_future()
+        self.ack_timer = None # Handle of the delayed ACK deadline
+        self.time_start = None
+        self.time_end = None
+
+    def datagram_received(self, data, addr):
+        if self.finished.done():
+            return
+        if is_probe(data): # Path MTU discovery of the sender, before the transfer
+            try:
+                answer_probe(self.encoder, self.sock, addr, data)
+            except BlockingIOError:
+                pass
+            return
+        if self.time_start is None:
+            self.time_start = time.time()
+        if is_handshake(data):
+            self.on_hello(data, addr)
+            return
+        connection = self.connection
+        if connection is None: # Before the handshake
+            return
+        ack = connection.on_data(data)
+        if ack is not None:
+            self.send_ack(ack)
+        elif connection.pending_ack is not None and self.ack_timer is None:
+            # Held back by the delayed ACK policy
+            self.ack_timer = self.loop.call_later(max(connection.ack_deadline - time.monotonic(), 0), self.on_ack_timer)
+        if connection.complete:
+            self.time_end = time.time()
+            self.terminate()
+            self.finished.set_result(connection)
+
+    def on_hello(self, data, addr):
+        valid, checksum, sendTime, kind, helloId, payload = decode_handshake(data)
+        if not valid or kind != HELLO:
+            return
+        if self.hello_reply is not None and self.hello_reply[0] == helloId: # The ACCEPT was lost
+            self.send_handshake(self.address, *self.hello_reply[1:], sendTime)
+            return
+        kind, connectionId, reply, hello, accept = self.acceptor.on_hello(
+            checksum, helloId, payload, addr[0], 0 if self.connection is not None else None)
+        if kind is None:
+            return
+        address = (addr[0], hello.ack_port)
+        if kind == ACCEPT:
+            checksum = accept.checksum
+            self.connection = ReceiverConnection(hello.initial_seq_num, self.reassembler, accept.window,
+                                                 hello.total_chunks, connectionId, checksum)
+            self.address = address
+            self.hello_reply = (helloId, checksum, (kind, connectionId, reply))
+        self.send_handshake(address, checksum, (kind, connectionId, reply), sendTime)
+
+    def send_handshake(self, address, checksum, reply, echo_time):
+        if self.encoder.checksum is not checksum:
+            self.encoder.use(checksum)
+        try:
+            self.encoder.send_handshake(self.sock, address, *reply, echo_time=echo_time)
+        except BlockingIOError:
+            pass
+
+    def send_ack(self, ack):
+        if self.ack_timer is not None:
+            self.ack_timer.cancel()
+            self.ack_timer = None
+        # ACKs are protected with the algorithm the sender picked
+        if self.encoder.checksum is not self.connection.checksum:
+            self.encoder.use(self.connection.checksum)
+        try:
+            self.encoder.send_ack(self.sock, self.address, *ack)
+        except BlockingIOError:
+            pass
+
+    def on_ack_timer(self):
+        self.ack_timer = None
+        ack = self.connection.take_ack()
+        if ack is not None:
+            self.send_ack(ack)
+
+    def error_received(self, exc):
+        pass
+
+    def connection_lost(self, exc):
+        if not self.finished.done():
+            self.finished.set_exception(exc or ConnectionError("Endpoint closed before the transfer completed"))
+
+    def terminate(self):
+        # The empty packet tells the sender that the transfer is over, sent twice in case one is lost
+        for _ in range(2):
+            try:
+                self.sock.sendto(b'', self.address)
+            except BlockingIOError:
+                pass
+
+
+async def send_transfer(chunks, receiver_address, ack_address, checksum='crc32', initial_seq_num=0,
+                        window_size=64000, congestion_control='newreno', pacing_gain=1.2,
+                        pace_retransmissions=False, ack_frequency=2, ack_delay=0.005, batch=SEND_BATCH,
+                        scheduler=None, fec=None, hello=None):
+    """
+    Send the chunks of one transfer.
+
+    Args:
+        chunks (list): (file_id, chunk_num, payload, flag) tuples in sending order, the
+            manifest first, or a ChunkIndex.
+        receiver_address (tuple): Address the receiver listens on.
+        ack_address (tuple): Local address the ACKs of this transfer arrive on.
+        checksum (str or Checksum): Integrity algorithm, by name or the one of a cached session.
+        hello (Hello): Parameters proposed in the handshake, the connection id is drawn here.
+        The other arguments are the settings of SenderConnection.
+
+    Returns:
+        SenderConnection: The finished connection, rejected holds the reason if the receiver refused it.
+    """
+    loop = asyncio.get_running_loop()
+    if isinstance(checksum, str):
+        checksum = get_checksum(checksum)
+    connection = SenderConnection(chunks, checksum, initial_seq_num, window_size,
+                                  congestion_control, pacing_gain, pace_retransmissions,
+                                  ack_frequency=ack_frequency, ack_delay=ack_delay, scheduler=scheduler, fec=fec,
+                                  hello=hello, connection_id=new_connection_id())
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setblocking(False)
+    transport, protocol = await loop.create_datagram_endpoint(
+        lambda: SenderProtocol(connection, sock, receiver_address, batch), local_addr=ack_address)
+    try:
+        return await protocol.finished
+    finally:
+        transport.close()
+        sock.close()
+
+
+async def receive_transfer(address, acceptor, reassembler=None):
+    """
+    Receive one transfer.
+
+    Args:
+        address (tuple): Local address the data packets arrive on.
+        acceptor (HandshakeAcceptor): Decides on the HELLO of the sender, which tells the address
+            the ACKs go to and the parameters of the transfer.
+        reassembler (FileReassembler): Receives the chunks, a new one by default.
+
+    Returns:
+        ReceiverProtocol: The protocol, with the connection and the start and end times of the transfer.
+    """
+    loop = asyncio.get_running_loop()
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setblocking(False)
+    transport, protocol = await loop.create_datagram_endpoint(
+        lambda: ReceiverProtocol(acceptor, reassembler, sock), local_addr=address)
+    try:
+        await protocol.finished
+        return protocol
+    finally:
+        transport.close()
+        sock.close()
+
+
+if __name__ == "__main__":
+    # python3 madpAsync.py send|receive runs the transfer of madpSender.py / madpReceiver.py
+    # with the same settings and addresses on the asyncio engine
+    if len(sys.argv) != 2 or sys.argv[1] not in ('send', 'receive'):
+        print("Usage: python3 madpAsync.py send|receive")
+        sys.exit(1)
+
+    if sys.argv[1] == 'send':
+        import madpSender
+        receiverAddress = ('172.17.0.2', 65432)
+        sessionCache = SessionCache(madpSender.SESSION_CACHE)
+        session = madpSender.cached_session(sessionCache, receiverAddress)
+        while True:
+            # A cached session gives the chunk size and the data goes out in the first flight
+            chunkSize = madpSender.PACKET_SIZE
+            if session is not None:
+                chunkSize = session.chunk_size
+            elif madpSender.PMTU_DISCOVERY:
+                chunkSize = discover_chunk_size(receiverAddress, get_checksum(madpSender.CHECKSUM_ALGORITHM),
+                                                madpSender.PACKET_SIZE, madpSender.MIN_DATAGRAM_SIZE,
+                                                madpSender.MAX_DATAGRAM_SIZE)
+            (chunkedData, totalChunks, scheduler, manifest) = madpSender.mapped_chunks(chunkSize)
+            hello = madpSender.new_hello(chunkSize, totalChunks, manifest, 64000, 65433, session)
+            connection = asyncio.run(send_transfer(chunkedData, receiverAddress, ('0.0.0.0', 65433),
+                                                   madpSender.CHECKSUM_ALGORITHM if session is None else session.checksum,
+                                                   madpSender.INITIAL_SEQ_NUM, hello.window,
+                                                   congestion_control=madpSender.CONGESTION_CONTROL,
+                                                   pacing_gain=madpSender.PACING_GAIN,
+                                                   pace_retransmissions=madpSender.PACE_RETRANSMISSIONS,
+                                                   ack_frequency=madpSender.ACK_FREQUENCY, ack_delay=madpSender.ACK_DELAY,
+                                                   batch=madpSender.SEND_BATCH, scheduler=scheduler,
+                                                   fec=madpSender.fec_encoder(), hello=hello))
+            if connection.rejected and session is not None:
+                # The receiver no longer accepts the cached parameters, start over with a full handshake
+                sessionCache.forget(receiverAddress)
+                session = None
+                continue
+            break
+        if connection.accept is not None:
+            sessionCache.store(receiverAddress, Session.from_accept(chunkSize, connection.accept))
+        elif connection.rejected:
+            print("Transfer rejected by the receiver:", reject_reason(connection.rejected))
+    else:
+        import madpReceiver
+        os.makedirs(madpReceiver.OUTPUT_FOLDER, exist_ok=True)
+        acceptor = HandshakeAcceptor(load_key(madpReceiver.TOKEN_KEY_FILE), madpReceiver.PACKET_SIZE,
+                                     madpReceiver.WINDOW,
+                                     [get_checksum(name) for name in madpReceiver.CHECKSUM_ALGORITHMS],
+                                     shutil.disk_usage(madpReceiver.OUTPUT_FOLDER).free)
+        receiver = asyncio.run(receive_transfer(('0.0.0.0', 65432), acceptor,
+                                                StreamingReassembler(madpReceiver.CHUNK_SIZE, madpReceiver.OUTPUT_FOLDER)))
+        print("-----------------------")
+        print("Total Time: ", receiver.time_end - receiver.time_start)
+        print("-----------------------")
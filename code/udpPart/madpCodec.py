@@ -0,0 +1,614 @@
+import errno
+import select
+import socket
+import struct
+import sys
+import time
+from madpIntegrity import CHECKSUMS_BY_ID, MAX_CHECKSUM_SIZE, MD5
+from madpSack import MAX_SACK_BLOCKS
+
+# Wire formats of the MADP packets. The structs are compiled once at import time
+# so that encoding and decoding a packet is a single C call instead of one
+# struct.pack/unpack per field.
+#
+# Sequence numbers, file ids, chunk numbers and chunk counts are 32-bit. What a file id
+# stands for is told by the manifest of the transfer, see madpManifest.
+#
+# Every packet starts with the checksum type and ends its header with the checksum
+# itself, whose length depends on the type. The checksum covers the header fields
+# in front of it and the payload.
+#
+# Data packet: checksumType, send time, connectionId, seqNum, fileId, chunkNum, flags, ackFrequency,
+# ackDelay, checksum, payload. The connection id is the one the handshake established, see
+# madpHandshake. The last two fields carry the ACK policy the sender asks for: acknowledge every
+# ackFrequency in order packets, or ackDelay milliseconds after the first unacknowledged one.
+DATA_FIELDS = struct.Struct('!BdIIIIBBB')
+# Flags of a data packet. The chunk flags describe the chunk and travel with it to the
+# receiver's streams, FEC_PROTECTED only concerns the packet.
+LAST_CHUNK = 0x01 # The last chunk of its file
+FEC_PROTECTED = 0x02 # The packet belongs to an FEC block, see madpFec
+COMPRESSED = 0x04 # The payload is deflated, see madpCompress
+DICTIONARY = 0x08 # The chunk is the compression dictionary of other chunks of its file
+CHUNK_FLAGS = LAST_CHUNK | COMPRESSED | DICTIONARY
+# Repair packet: checksumType | REPAIR_TYPE, send time, connectionId, base seqNum, count, row, repairs,
+# checksum, payload. It is repair row of the FEC block of the count packets starting at base seqNum,
+# which has repairs repair packets.
+REPAIR_TYPE = 0x80
+REPAIR_FIELDS = struct.Struct('!BdIIBBB')
+# Path MTU probe: checksumType | PROBE_TYPE, send time, size, checksum, zero padding up to size bytes.
+# Probe ACK: checksumType | PROBE_TYPE, echoed send time, size of the probe, largest datagram the
+# receiver accepts, checksum. See madpPmtu.
+PROBE_TYPE = 0x40
+PROBE_FIELDS = struct.Struct('!BdI')
+PROBE_ACK_FIELDS = struct.Struct('!BdII')
+# Handshake packet: checksumType | HANDSHAKE_TYPE, send time (echoed by the replies), kind,
+# connectionId, checksum, payload. The kinds and their payloads are defined in madpHandshake.
+HANDSHAKE_TYPE = REPAIR_TYPE | PROBE_TYPE
+HANDSHAKE_FIELDS = struct.Struct('!BdBI')
+PACKET_TYPES = REPAIR_TYPE | PROBE_TYPE
+# Data and repair packets carry the connection id at the same offset, behind the checksum type
+# and the send time, so a packet is routed to its connection before it is decoded
+CONNECTION_ID_FIELD = struct.Struct('!9xI')
+# ACK packet: checksumType, echoed send time, ackNum, recovered, number of SACK blocks, checksum,
+# SACK blocks. recovered counts the packets the receiver rebuilt from repair packets so far.
+ACK_FIELDS = struct.Struct('!BdIIB')
+# SACK block: first and one past the last sequence number of a range held by the receiver
+SACK_BLOCK = struct.Struct('!II')
+
+MAX_DATA_HEADER_SIZE = DATA_FIELDS.size + MAX_CHECKSUM_SIZE
+MAX_DATAGRAM_SIZE = 65507 # Largest UDP payload over IPv4
+
+# Generic segmentation offload for UDP on Linux. A sendmsg carrying a UDP_SEGMENT
+# control message with a segment size is split by the kernel (or the NIC) into
+# datagrams of that size, only the last one may be shorter.
+SOL_UDP = getattr(socket, 'SOL_UDP', 17)
+UDP_SEGMENT = getattr(socket, 'UDP_SEGMENT', 103)
+GSO_MAX_SEGMENTS = 64
+GSO_MAX_BYTES = 65000 # Below the 65507 byte limit of a UDP payload over IPv4
+# Errors of a sendmsg with UDP_SEGMENT that mean segmentation is not available
+GSO_ERRORS = (errno.EIO, errno.EINVAL, errno.ENOPROTOOPT, errno.EOPNOTSUPP)
+# Generic receive offload, the receiving counterpart. With UDP_GRO enabled the kernel may
+# deliver several datagrams of one flow as one buffer, with the segment size in a control message.
+UDP_GRO = getattr(socket, 'UDP_GRO', 104)
+GRO_BUFFER_SIZE = 65535
+# Datagrams are received into slabs of this size instead of a new bytes object each
+SLAB_SIZE = 1 << 20
+MSG_DONTWAIT = getattr(socket, 'MSG_DONTWAIT', 0)
+
+
+class PacketEncoder:
+    """
+    Encodes MADP packets into preallocated header buffers and sends them.
+
+    Headers are written with pack_into into a buffer owned by the encoder, and the
+    payload is handed to the kernel as a separate memoryview with sendmsg, so the
+    header and the payload are never concatenated into a new bytes object.
+
+    Batches of data packets are sent with a single sendmsg per run of equally
+    sized packets when UDP generic segmentation offload is available (Linux), and
+    with one sendmsg per packet otherwise.
+
+    An encoder reuses its buffers between calls, therefore each thread that sends
+    packets should own its own encoder.
+    """
+    def __init__(self, checksum=MD5, ack_frequency=1, ack_delay=0.0, connection_id=0):
+        """
+        Args:
+            checksum (Checksum): The integrity algorithm, see madpIntegrity.
+            ack_frequency (int): Data packets the receiver may acknowledge with one ACK, at most 255.
+            ack_delay (float): Seconds the receiver may hold an ACK back, at most 0.255.
+            connection_id (int): Connection id of the data and repair packets, may be changed between sends.
+        """
+        self.gso = sys.platform.startswith('linux') # Cleared when the kernel refuses UDP_SEGMENT
+        self.batch_sent = 0 # Packets of the last send_data_batch handed to the kernel
+        self.connection_id = connection_id
+        self.ack_frequency = min(max(int(ack_frequency), 1), 255)
+        self.ack_delay = min(max(int(round(ack_delay * 1000)), 0), 255) # Milliseconds on the wire
+        self.use(checksum)
+
+    def use(self, checksum):
+        """
+        Switch the integrity algorithm of the encoded packets.
+
+        Args:
+            checksum (Checksum): The algorithm, see madpIntegrity.
+        """
+        self.checksum = checksum
+        self.data_header = bytearray(DATA_FIELDS.size + checksum.size)
+        self.data_fields = memoryview(self.data_header)[:DATA_FIELDS.size]
+        self.repair_header = bytearray(REPAIR_FIELDS.size + checksum.size)
+        self.repair_fields = memoryview(self.repair_header)[:REPAIR_FIELDS.size]
+        self.probe_ack_packet = bytearray(PROBE_ACK_FIELDS.size + checksum.size)
+        self.handshake_header = bytearray(HANDSHAKE_FIELDS.size + checksum.size)
+        self.ack_packet = bytearray(ACK_FIELDS.size + checksum.size)
+        self.ack_fields = memoryview(self.ack_packet)[:ACK_FIELDS.size]
+        self.sack_blocks = bytearray(MAX_SACK_BLOCKS * SACK_BLOCK.size)
+        self.sack_view = memoryview(self.sack_blocks)
+        # One header per packet of a batch
+        self.header_size = DATA_FIELDS.size + checksum.size
+        self.batch_headers = bytearray(GSO_MAX_SEGMENTS * self.header_size)
+        self.batch_view = memoryview(self.batch_headers)
+
+    def send_data(self, sock, address, seq_num, file_id, chunk_num, flag, payload):
+        """
+        Encode a data packet and send it to the given address.
+
+        Args:
+            sock (socket.socket): The UDP socket to send from.
+            address (tuple): Destination address of the packet.
+            seq_num (int): Sequence number of the packet.
+            file_id (int): Identifier for the file.
+            chunk_num (int): Sequence number of the chunk in the file.
+            flag (int): The flags of the packet, LAST_CHUNK if this is the last chunk of the file.
+            payload (bytes-like): The chunk data.
+
+        Returns:
+            int: The number of bytes sent.
+        """
+        DATA_FIELDS.pack_into(self.data_header, 0, self.checksum.type_id, time.time(), self.connection_id,
+                              seq_num, file_id, chunk_num, flag, self.ack_frequency, self.ack_delay)
+        self.data_header[DATA_FIELDS.size:] = self.checksum.compute(self.data_fields, payload)
+        return sock.sendmsg([self.data_header, memoryview(payload)], (), 0, address)
+
+    def send_data_batch(self, sock, address, packets):
+        """
+        Encode a batch of data packets and send them to the given address.
+
+        Consecutive packets of the same size go out as one GSO send, a shorter packet
+        ends its run. Without GSO, each packet is sent with its own sendmsg.
+
+        Args:
+            sock (socket.socket): The UDP socket to send from.
+            address (tuple): Destination address of the packets.
+            packets (list): Up to GSO_MAX_SEGMENTS tuples of the send_data arguments
+                (seq_num, file_id, chunk_num, flag, payload).
+
+        Returns:
+            int: The number of bytes sent.
+
+        Raises:
+            BlockingIOError: If the socket buffer is full, batch_sent tells how many packets
+                of the batch were sent before.
+        """
+        self.batch_sent = 0
+        headerSize = self.header_size
+        fieldsSize = DATA_FIELDS.size
+        checksum = self.checksum
+        buffers = []
+        connectionId = self.connection_id
+        for i, (seq_num, file_id, chunk_num, flag, payload) in enumerate(packets):
+            offset = i * headerSize
+            header = self.batch_view[offset:offset + headerSize]
+            DATA_FIELDS.pack_into(self.batch_headers, offset, checksum.type_id, time.time(), connectionId,
+                                  seq_num, file_id, chunk_num, flag, self.ack_frequency, self.ack_delay)
+            header[fieldsSize:] = checksum.compute(header[:fieldsSize], payload)
+            buffers.append((header, memoryview(payload)))
+
+        if not self.gso:
+            return self._send_each(sock, address, buffers)
+
+        sent = 0
+        start = 0
+        while start < len(buffers):
+            # Extend the run while the packets have the size of its first packet
+            segmentSize = headerSize + len(buffers[start][1])
+            end = start + 1
+            total = segmentSize
+            while end < len(buffers):
+                size = headerSize + len(buffers[end][1])
+                if size > segmentSize or total + size > GSO_MAX_BYTES:
+                    break
+                total += size
+                end += 1
+                if size < segmentSize:
+                    break # Only the last segment may be shorter
+            sent += self._send_run(sock, address, buffers[start:end], segmentSize)
+            start = end
+        return sent
+
+    def _send_run(self, sock, address, buffers, segment_size):
+        """
+        Send a run of packets with one GSO sendmsg, falling back to one sendmsg per packet.
+        """
+        if len(buffers) > 1 and self.gso:
+            iov = [buffer for packet in buffers for buffer in packet]
+            try:
+                sent = sock.sendmsg(iov, [(SOL_UDP, UDP_SEGMENT, struct.pack('=H', segment_size))], 0, address)
+                self.batch_sent += len(buffers)
+                return sent
+            except OSError as e:
+                if e.errno not in GSO_ERRORS:
+                    raise
+                self.gso = False
+        return self._send_each(sock, address, buffers)
+
+    def _send_each(self, sock, address, buffers):
+        sent = 0
+        for packet in buffers:
+            sent += sock.sendmsg(packet, (), 0, address)
+            self.batch_sent += 1
+        return sent
+
+    def send_repair(self, sock, address, base_seq, count, row, repairs, payload):
+        """
+        Encode a repair packet and send it to the given address.
+
+        Args:
+            sock (socket.socket): The UDP socket to send from.
+            address (tuple): Destination address of the packet.
+            base_seq (int): Sequence number of the first packet of the FEC block.
+            count (int): Number of packets of the block.
+            row (int): Index of the repair in the block.
+            repairs (int): Number of repairs of the block.
+            payload (bytes-like): The repair symbol, see madpFec.
+
+        Returns:
+            int: The number of bytes sent.
+        """
+        REPAIR_FIELDS.pack_into(self.repair_header, 0, self.checksum.type_id | REPAIR_TYPE, time.time(),
+                                self.connection_id, base_seq, count, row, repairs)
+        self.repair_header[REPAIR_FIELDS.size:] = self.checksum.compute(self.repair_fields, payload)
+        return sock.sendmsg([self.repair_header, memoryview(payload)], (), 0, address)
+
+    def send_probe(self, sock, address, size):
+        """
+        Encode a path MTU probe of size bytes and send it to the given address.
+
+        Returns:
+            int: The number of bytes sent.
+
+        Raises:
+            OSError: EMSGSIZE if the probe is larger than the local interface allows.
+        """
+        header = bytearray(PROBE_FIELDS.size + self.checksum.size)
+        PROBE_FIELDS.pack_into(header, 0, self.checksum.type_id | PROBE_TYPE, time.time(), size)
+        padding = bytes(max(size - len(header), 0))
+        header[PROBE_FIELDS.size:] = self.checksum.compute(memoryview(header)[:PROBE_FIELDS.size], padding)
+        return sock.sendmsg([header, padding], (), 0, address)
+
+    def send_probe_ack(self, sock, address, echo_time, size, max_size):
+        """
+        Encode the ACK of a path MTU probe and send it to the given address.
+
+        Args:
+            echo_time (float): Send time of the probe.
+            size (int): Size of the probe.
+            max_size (int): Largest datagram the receiver accepts.
+
+        Returns:
+            int: The number of bytes sent.
+        """
+        PROBE_ACK_FIELDS.pack_into(self.probe_ack_packet, 0, self.checksum.type_id | PROBE_TYPE, echo_time, size, max_size)
+        self.probe_ack_packet[PROBE_ACK_FIELDS.size:] = self.checksum.compute(
+            memoryview(self.probe_ack_packet)[:PROBE_ACK_FIELDS.size], b'')
+        return sock.sendto(self.probe_ack_packet, address)
+
+    def send_handshake(self, sock, address, kind, connection_id, payload, echo_time=None):
+        """
+        Encode a handshake packet and send it to the given address.
+
+        Args:
+            kind (int): Kind of the packet, see madpHandshake.
+            connection_id (int): Connection id the packet is about.
+            payload (bytes-like): The encoded parameters.
+            echo_time (float): Send time of the packet answered, None to send the current time.
+
+        Returns:
+            int: The number of bytes sent.
+        """
+        HANDSHAKE_FIELDS.pack_into(self.handshake_header, 0, self.checksum.type_id | HANDSHAKE_TYPE,
+                                   time.time() if echo_time is None else echo_time, kind, connection_id)
+        self.handshake_header[HANDSHAKE_FIELDS.size:] = self.checksum.compute(
+            memoryview(self.handshake_header)[:HANDSHAKE_FIELDS.size], payload)
+        return sock.sendmsg([self.handshake_header, memoryview(payload)], (), 0, address)
+
+    def send_ack(self, sock, address, echo_time, ack_num, sack_blocks=(), recovered=0):
+        """
+        Encode an ACK packet and send it to the given address.
+
+        Args:
+            sock (socket.socket): The UDP socket to send from.
+            address (tuple): Destination address of the packet.
+            echo_time (float): Send time of the packet that triggered the ACK.
+            ack_num (int): Cumulative acknowledgement number.
+            sack_blocks (list): Up to MAX_SACK_BLOCKS (start, end) sequence number ranges
+                that the receiver holds beyond ack_num.
+            recovered (int): Packets the receiver rebuilt from repair packets so far.
+
+        Returns:
+            int: The number of bytes sent.
+        """
+        count = 0
+        for start, end in sack_blocks[:MAX_SACK_BLOCKS]:
+            SACK_BLOCK.pack_into(self.sack_blocks, count * SACK_BLOCK.size, start, end)
+            count += 1
+        blocks = self.sack_view[:count * SACK_BLOCK.size]
+        ACK_FIELDS.pack_into(self.ack_packet, 0, self.checksum.type_id, echo_time, ack_num,
+                             recovered & 0xFFFFFFFF, count)
+        self.ack_packet[ACK_FIELDS.size:] = self.checksum.compute(self.ack_fields, blocks)
+        return sock.sendmsg([self.ack_packet, blocks], (), 0, address)
+
+
+class DatagramReceiver:
+    """
+    Receives the datagrams of a UDP socket in batches.
+
+    receive blocks for the first datagram and then drains whatever else is
+    already queued on the socket without blocking, so the caller handles a
+    batch per wakeup instead of one datagram per blocking call.
+
+    Datagrams are received with recv_into back to back into a pooled slab, and are
+    returned as memoryviews of it. When the slab has no room left for another
+    receive a new one is started; a slab is freed by Python once no datagram (or
+    payload slice) of it is referenced anymore, so buffered packets stay valid.
+
+    On Linux UDP_GRO is enabled on the socket, and a coalesced buffer is split
+    into its datagrams with memoryview slices, without copying.
+
+    The source address of every datagram of the last batch is kept in sources.
+    """
+    def __init__(self, sock, max_size, batch=64):
+        """
+        Args:
+            sock (socket.socket): A bound UDP socket in blocking mode.
+            max_size (int): Largest datagram expected when GRO is not available.
+            batch (int): Maximum number of receive calls per batch.
+        """
+        self.sock = sock
+        self.max_size = max_size
+        self.batch = batch if MSG_DONTWAIT else 1
+        self.gro = False
+        if sys.platform.startswith('linux'):
+            try:
+                sock.setsockopt(SOL_UDP, UDP_GRO, 1)
+                self.gro = True
+            except OSError:
+                pass
+        self.receive_size = max_size
+        if self.gro:
+            self.receive_size = GRO_BUFFER_SIZE
+            self.ancillary_size = socket.CMSG_SPACE(struct.calcsize('=i'))
+        self.slab_size = max(SLAB_SIZE, self.receive_size)
+        self.sources = []
+        self.new_slab()
+
+    def new_slab(self):
+        self.slab = memoryview(bytearray(self.slab_size))
+        self.position = 0
+
+    def receive(self, timeout=None):
+        """
+        Wait for datagrams.
+
+        Args:
+            timeout (float): Seconds to wait for the first datagram, None to wait indefinitely.
+
+        Returns:
+            list: The received datagrams, bytes or memoryviews of a coalesced buffer, in arrival
+            order. Empty if the timeout expired.
+        """
+        self.sources = sources = []
+        if timeout is not None and not select.select([self.sock], [], [], timeout)[0]:
+            return []
+        datagrams = []
+        flags = 0 # Only the first call blocks
+        for _ in range(self.batch):
+            if self.slab_size - self.position < self.receive_size:
+                self.new_slab()
+            start = self.position
+            space = self.slab[start:start + self.receive_size]
+            try:
+                if self.gro:
+                    size, segmentSize, source = self._receive_coalesced(space, flags)
+                else:
+                    (size, source), segmentSize = self.sock.recvfrom_into(space, 0, flags), 0
+            except BlockingIOError:
+                break
+            self.position += size
+            if segmentSize <= 0 or segmentSize >= size:
+                datagrams.append(self.slab[start:start + size])
+                sources.append(source)
+            else:
+                end = start + size # The last datagram may be shorter than the segment size
+                datagrams.extend(self.slab[i:min(i + segmentSize, end)] for i in range(start, end, segmentSize))
+                sources.extend([source] * (len(datagrams) - len(sources)))
+            flags = MSG_DONTWAIT
+        return datagrams
+
+    def _receive_coalesced(self, space, flags):
+        """
+        Returns:
+            tuple: (received bytes, segment size or 0 if the buffer holds a single datagram, source address)
+        """
+        size, ancdata, _, source = self.sock.recvmsg_into([space], self.ancillary_size, flags)
+        segmentSize = 0
+        for level, kind, value in ancdata:
+            if level == SOL_UDP and kind == UDP_GRO:
+                segmentSize = struct.unpack('=i', value[:4])[0]
+        return size, segmentSize, source
+
+
+def _split(packet, fields, verify=True):
+    """
+    Unpack the fixed fields of a packet and verify its checksum.
+
+    Args:
+        verify (bool): Compute the checksum, False if the packet was verified already.
+
+    Returns:
+        tuple: (valid, checksum algorithm or None, unpacked fields, payload memoryview)
+    """
+    if len(packet) < fields.size:
+        return False, None, None, None
+    values = fields.unpack_from(packet)
+    checksum = CHECKSUMS_BY_ID.get(values[0] & ~PACKET_TYPES)
+    if checksum is None:
+        return False, None, None, None
+    view = memoryview(packet)
+    headerSize = fields.size + checksum.size
+    payload = view[headerSize:]
+    valid = len(packet) >= headerSize
+    if valid and verify:
+        valid = checksum.compute(view[:fields.size], payload) == view[fields.size:headerSize]
+    return valid, checksum, values, payload
+
+
+def packet_type(packet):
+    """
+    Returns:
+        int: REPAIR_TYPE, PROBE_TYPE, HANDSHAKE_TYPE or 0 for the other packets.
+    """
+    return packet[0] & PACKET_TYPES if len(packet) > 0 else 0
+
+
+def packet_checksum(packet):
+    """
+    Returns:
+        Checksum: The algorithm the packet is protected with, None if the type is unknown.
+    """
+    return CHECKSUMS_BY_ID.get(packet[0] & ~PACKET_TYPES) if len(packet) > 0 else None
+
+
+def is_repair(packet):
+    return packet_type(packet) == REPAIR_TYPE
+
+
+def is_probe(packet):
+    return packet_type(packet) == PROBE_TYPE
+
+
+def is_handshake(packet):
+    return packet_type(packet) == HANDSHAKE_TYPE
+
+
+def peek_connection_id(packet):
+    """
+    Read the connection id of a data or repair packet without verifying it.
+
+    The id is only good for routing: the connection it names still verifies the packet.
+
+    Returns:
+        int: The connection id, None for a probe, a handshake or a packet too short to carry one.
+    """
+    if len(packet) < CONNECTION_ID_FIELD.size or packet_type(packet) & PROBE_TYPE:
+        return None
+    return CONNECTION_ID_FIELD.unpack_from(packet)[0]
+
+
+_FIELDS_BY_TYPE = {0: DATA_FIELDS, REPAIR_TYPE: REPAIR_FIELDS, PROBE_TYPE: PROBE_FIELDS, HANDSHAKE_TYPE: HANDSHAKE_FIELDS}
+
+
+def verify_data(packet):
+    """
+    Verify the checksum of a data, repair, probe or handshake packet without decoding it.
+
+    The checksum is computed outside the GIL for larger packets, so a pool of
+    threads may verify batches of packets in parallel with the receive loop.
+
+    Returns:
+        bool: True if the packet is intact.
+    """
+    return _split(packet, _FIELDS_BY_TYPE.get(packet_type(packet), DATA_FIELDS))[0]
+
+
+def decode_data(packet, verified=False):
+    """
+    Decode and verify a data packet with a single unpack.
+
+    Args:
+        packet (bytes): The received datagram.
+        verified (bool): The packet passed verify_data already, its checksum is not computed again.
+
+    Returns:
+        tuple: (valid, checksum, sendTime, connectionId, seqNum, fileId, chunkNum, flags,
+        ackFrequency, ackDelay, payload) where checksum is the algorithm the sender used, ackDelay is in
+        milliseconds and payload is a memoryview into the datagram. Only valid is meaningful if the
+        packet is corrupted.
+    """
+    valid, checksum, values, payload = _split(packet, DATA_FIELDS, not verified)
+    if not valid or values[0] & PACKET_TYPES:
+        return (False,) + (None,) * 10
+    return (True, checksum) + values[1:] + (payload,)
+
+
+def decode_repair(packet, verified=False):
+    """
+    Decode and verify a repair packet with a single unpack.
+
+    Args:
+        packet (bytes): The received datagram.
+        verified (bool): The packet passed verify_data already, its checksum is not computed again.
+
+    Returns:
+        tuple: (valid, checksum, sendTime, connectionId, baseSeq, count, row, repairs, payload). Only
+        valid is meaningful if the packet is corrupted.
+    """
+    valid, checksum, values, payload = _split(packet, REPAIR_FIELDS, not verified)
+    if not valid or values[0] & PACKET_TYPES != REPAIR_TYPE:
+        return (False,) + (None,) * 8
+    return (True, checksum) + values[1:] + (payload,)
+
+
+def decode_handshake(packet, verified=False):
+    """
+    Decode and verify a handshake packet.
+
+    Args:
+        packet (bytes): The received datagram.
+        verified (bool): The packet passed verify_data already, its checksum is not computed again.
+
+    Returns:
+        tuple: (valid, checksum, time, kind, connectionId, payload) where time is the send time of a
+        HELLO and the echoed one of a reply. Only valid is meaningful if the packet is corrupted.
+    """
+    valid, checksum, values, payload = _split(packet, HANDSHAKE_FIELDS, not verified)
+    if not valid or values[0] & PACKET_TYPES != HANDSHAKE_TYPE:
+        return (False,) + (None,) * 5
+    return (True, checksum) + values[1:] + (payload,)
+
+
+def decode_ack(packet):
+    """
+    Decode and verify an ACK packet with a single unpack.
+
+    Args:
+        packet (bytes): The received datagram.
+
+    Returns:
+        tuple: (valid, echoTime, ackNum, recovered, sackBlocks) where sackBlocks is a list of
+        (start, end) sequence number ranges.
+    """
+    valid, _, values, blocks = _split(packet, ACK_FIELDS)
+    if not valid or values[0] & PACKET_TYPES or len(blocks) != values[4] * SACK_BLOCK.size:
+        return False, None, None, None, None
+    return True, values[1], values[2], values[3], list(SACK_BLOCK.iter_unpack(blocks))
+
+
+def decode_probe(packet, verified=False):
+    """
+    Decode and verify a path MTU probe.
+
+    Args:
+        packet (bytes): The received datagram.
+        verified (bool): The packet passed verify_data already, its checksum is not computed again.
+
+    Returns:
+        tuple: (valid, checksum, sendTime, size). A probe that was truncated is not valid.
+    """
+    valid, checksum, values, _ = _split(packet, PROBE_FIELDS, not verified)
+    if not valid or values[0] & PACKET_TYPES != PROBE_TYPE or values[2] != len(packet):
+        return False, None, None, None
+    return True, checksum, values[1], values[2]
+
+
+def decode_probe_ack(packet):
+    """
+    Decode and verify the ACK of a path MTU probe.
+
+    Returns:
+        tuple: (valid, echoTime, size, maxSize) where maxSize is the largest datagram the receiver accepts.
+    """
+    valid, _, values, payload = _split(packet, PROBE_ACK_FIELDS)
+    if not valid or values[0] & PACKET_TYPES != PROBE_TYPE or len(payload):
+        return False, None, None, None
+    return True, values[1], values[2], values[3]
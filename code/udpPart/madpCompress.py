@@ -0,0 +1,164 @@
+import struct
+import zlib
+from madpCodec import COMPRESSED, DICTIONARY
+from madpManifest import MANIFEST_FILE_ID
+
+# Compression stage of MADP, between the chunk index and the packet encoder.
+#
+# Every chunk is deflated on its own, so a lost packet only costs its own chunk, and the
+# receiver inflates a chunk as soon as it arrives. A chunk compresses far better with some
+# context than alone, so with a dictionary the first chunk of a file in the transfer is the
+# dictionary of the other chunks of the file: it is flagged DICTIONARY, and the receiver
+# keeps its content until the file is complete.
+#
+# A compressed payload is DICTIONARY_REF, the chunk number of the dictionary chunk or
+# NO_DICTIONARY, followed by a raw deflate stream. The COMPRESSED flag of a packet tells the
+# receiver to inflate it, so chunks of the same transfer may be sent compressed or raw and
+# the receiver needs no configuration.
+
+DICTIONARY_REF = struct.Struct('!I')
+NO_DICTIONARY = 0xFFFFFFFF
+WBITS = -15 # Raw deflate, the checksum of the packet protects the payload already
+
+
+class CompressedChunks:
+    """
+    Compresses the chunks of a ChunkIndex as they are sent.
+
+    A file is sampled the first time one of its chunks is sent: sample chunks spread over
+    the file are deflated, and unless they shrink to max_ratio of their size together,
+    the whole file is sent raw. A chunk of a compressible file that does not shrink is
+    sent raw as well. Nothing is cached: deflate is deterministic, so a retransmission
+    compresses its chunk again to the same payload.
+
+    Indexing returns (file_id, chunk_num, payload, flag) tuples like the ChunkIndex, with
+    COMPRESSED and DICTIONARY in the flag.
+    """
+    def __init__(self, chunks, level=6, dictionary=True, sample=4, max_ratio=0.9):
+        """
+        Args:
+            chunks (ChunkIndex): The chunks of the transfer.
+            level (int): zlib compression level, 1 (fastest) to 9 (smallest).
+            dictionary (bool): Compress the chunks of a file with its first chunk as dictionary.
+            sample (int): Chunks of a file deflated to decide whether it is compressible.
+            max_ratio (float): Compressed size of the sample relative to its size, above which
+                the file is sent raw.
+        """
+        self.chunks = chunks
+        self.level = level
+        self.dictionary = dictionary
+        self.sample = sample
+        self.max_ratio = max_ratio
+        self.compressible = {} # file_id -> whether the sample of the file shrank
+
+    def __len__(self):
+        return len(self.chunks)
+
+    def __getitem__(self, seq):
+        chunk = self.chunks[seq]
+        file_id, chunk_num, payload, flag = chunk
+        if file_id == MANIFEST_FILE_ID or not payload:
+            return chunk
+        if not self.is_compressible(file_id):
+            return chunk
+        first = self.chunks.file_range(file_id)[0]
+        if self.dictionary and seq == first:
+            flag |= DICTIONARY
+        deflated = self.deflate(seq, first, payload)
+        if len(deflated) < len(payload):
+            return file_id, chunk_num, deflated, flag | COMPRESSED
+        return file_id, chunk_num, payload, flag
+
+    def deflate(self, seq, first, payload):
+        """
+        The compressed payload of chunk seq, whose file starts at chunk first of the index.
+        """
+        if self.dictionary and seq != first:
+            _, dictionaryChunkNum, dictionaryPayload, _ = self.chunks[first]
+            compressor = zlib.compressobj(self.level, zlib.DEFLATED, WBITS, zdict=dictionaryPayload)
+            reference = dictionaryChunkNum
+        else:
+            compressor = zlib.compressobj(self.level, zlib.DEFLATED, WBITS)
+            reference = NO_DICTIONARY
+        return DICTIONARY_REF.pack(reference) + compressor.compress(payload) + compressor.flush()
+
+    def is_compressible(self, file_id):
+        compressible = self.compressible.get(file_id)
+        if compressible is None:
+            first, count = self.chunks.file_range(file_id)
+            samples = min(self.sample, count)
+            size = deflated = 0
+            for seq in sorted({first + i * count // samples for i in range(samples)}):
+                payload = self.chunks[seq][2]
+                size += len(payload)
+                deflated += min(len(self.deflate(seq, first, payload)), len(payload))
+            compressible = self.compressible[file_id] = size > 0 and deflated <= size * self.max_ratio
+        return compressible
+
+    def close(self):
+        self.chunks.close()
+
+
+class ChunkInflater:
+    """
+    Inflates the compressed chunks of a transfer on the receiver.
+
+    The content of every DICTIONARY chunk is kept until forget is called for its file.
+    A chunk that arrives before its dictionary waits for it.
+    """
+    def __init__(self, max_size=None):
+        """
+        Args:
+            max_size (int): Largest inflated chunk, the chunk size of the transfer.
+        """
+        self.max_size = max_size
+        self.dictionaries = {} # (file_id, chunk_num) -> content of a dictionary chunk
+        self.waiting = {} # (file_id, chunk_num) of a missing dictionary -> [(chunk_num, payload, flags)]
+
+    def inflate(self, file_id, chunk_num, payload, flags):
+        """
+        Inflate a chunk.
+
+        Args:
+            flags (int): Chunk flags, see madpCodec.
+
+        Returns:
+            list: (chunk_num, data, flags) of the chunks of the file that can be handed on now:
+            none if the dictionary of the chunk is missing, more than one if it is a
+            dictionary that other chunks were waiting for.
+
+        Raises:
+            ValueError: If the payload is not a valid compressed chunk.
+        """
+        data = payload
+        if flags & COMPRESSED:
+            if len(payload) < DICTIONARY_REF.size:
+                raise ValueError("Compressed chunk without dictionary reference")
+            reference, = DICTIONARY_REF.unpack_from(payload)
+            if reference == NO_DICTIONARY:
+                decompressor = zlib.decompressobj(WBITS)
+            else:
+                zdict = self.dictionaries.get((file_id, reference))
+                if zdict is None:
+                    self.waiting.setdefault((file_id, reference), []).append((chunk_num, bytes(payload), flags))
+                    return []
+                decompressor = zlib.decompressobj(WBITS, zdict=zdict)
+            try:
+                data = decompressor.decompress(payload[DICTIONARY_REF.size:], self.max_size or 0)
+            except zlib.error as e:
+                raise ValueError(f"Corrupted compressed chunk: {e}") from None
+            if decompressor.unconsumed_tail or not decompressor.eof:
+                raise ValueError("Compressed chunk larger than the chunk size or truncated")
+        ready = [(chunk_num, data, flags)]
+        if flags & DICTIONARY:
+            self.dictionaries[(file_id, chunk_num)] = bytes(data)
+            for waiting in self.waiting.pop((file_id, chunk_num), ()):
+                ready.extend(self.inflate(file_id, *waiting))
+        return ready
+
+    def forget(self, file_id):
+        """
+        Drop the dictionaries of a complete file.
+        """
+        for key in [key for key in self.dictionaries if key[0] == file_id]:
+            del self.dictionaries[key]
@@ -0,0 +1,176 @@
+import time
+
+
+class CongestionController:
+    """
+    Interface of the congestion controllers of the MADP sender.
+
+    The window is measured in packets. The sender feeds the controller with the
+    events its ACK handling already detects: acknowledged packets, losses found
+    by duplicate ACKs and retransmission timeouts. A loss only reduces the window
+    once per window of data; further losses are ignored until the packets that
+    were outstanding at the first one are acknowledged (fast recovery).
+
+    Subclasses implement increase, decrease and timeout.
+    """
+    name = None
+
+    def __init__(self, initial_window=10, max_window=64000):
+        self.cwnd = float(initial_window)
+        self.ssthresh = float(max_window)
+        self.max_window = max_window
+        self.recover = None # Highest packet outstanding when the current recovery started
+
+    @property
+    def window(self):
+        """
+        Number of packets the controller allows in flight.
+        """
+        return max(int(self.cwnd), 1)
+
+    @property
+    def in_slow_start(self):
+        return self.cwnd < self.ssthresh
+
+    def on_ack(self, acked, rtt, base, now=None):
+        """
+        Called for every valid ACK.
+
+        Args:
+            acked (int): Packets newly acknowledged, cumulatively or by SACK.
+            rtt (float): RTT sample of the ACK in seconds.
+            base (int): The base after the ACK was processed.
+            now (float): Monotonic time of the ACK.
+        """
+        if self.recover is not None:
+            if base <= self.recover:
+                return # Still recovering, the window does not grow
+            self.recover = None
+        if acked > 0:
+            self.increase(acked, rtt, time.monotonic() if now is None else now)
+            self.cwnd = min(self.cwnd, self.max_window)
+
+    def on_loss(self, sent, now=None):
+        """
+        Called when duplicate ACKs reveal a loss.
+
+        Args:
+            sent (int): Sequence counter of the next new packet, the end of the recovery.
+        """
+        if self.recover is not None:
+            return
+        self.recover = sent - 1
+        self.decrease(time.monotonic() if now is None else now)
+
+    def on_timeout(self, sent, now=None):
+        """
+        Called when the retransmission timer expires.
+        """
+        self.recover = sent - 1
+        self.timeout(time.monotonic() if now is None else now)
+
+    def increase(self, acked, rtt, now):
+        raise NotImplementedError
+
+    def decrease(self, now):
+        raise NotImplementedError
+
+    def timeout(self, now):
+        raise NotImplementedError
+
+    def __repr__(self):
+        return f"{type(self).__name__}(cwnd={self.cwnd:.1f}, ssthresh={self.ssthresh:.1f})"
+
+
+class NewReno(CongestionController):
+    """
+    Slow start, additive increase and multiplicative decrease as in RFC 5681 and RFC 6582.
+    """
+    name = 'newreno'
+
+    def increase(self, acked, rtt, now):
+        if self.cwnd < self.ssthresh:
+            # Slow start phase
+            self.cwnd += acked
+        else:
+            # Congestion avoidance phase
+            self.cwnd += acked / self.cwnd
+
+    def decrease(self, now):
+        self.ssthresh = max(self.cwnd / 2, 2)
+        self.cwnd = self.ssthresh
+
+    def timeout(self, now):
+        self.ssthresh = max(self.cwnd / 2, 2)
+        self.cwnd = 1
+
+
+class Cubic(CongestionController):
+    """
+    CUBIC congestion control as in RFC 8312.
+
+    After a loss the window grows along a cubic function of the time since the
+    loss, which flattens around the window at which the loss happened, and never
+    grows slower than NewReno would (the TCP friendly region).
+    """
+    name = 'cubic'
+    C = 0.4
+    BETA = 0.7
+
+    def __init__(self, initial_window=10, max_window=64000):
+        super().__init__(initial_window, max_window)
+        self.w_max = 0.0
+        self.k = 0.0
+        self.epoch_start = None
+
+    def increase(self, acked, rtt, now):
+        if self.cwnd < self.ssthresh:
+            self.cwnd += acked
+            return
+        if self.epoch_start is None:
+            # First congestion avoidance ACK without a preceding loss
+            self.epoch_start = now
+            self.w_max = self.cwnd
+            self.k = 0.0
+        t = now - self.epoch_start + rtt
+        target = self.C * (t - self.k) ** 3 + self.w_max
+        # Window NewReno would have reached in the same time
+        friendly = self.w_max * self.BETA + 3 * (1 - self.BETA) / (1 + self.BETA) * (t / max(rtt, 1e-6))
+        target = max(target, friendly)
+        if target > self.cwnd:
+            self.cwnd += (target - self.cwnd) / self.cwnd * acked
+        else:
+            self.cwnd += 0.01 * acked / self.cwnd
+
+    def decrease(self, now):
+        self.epoch_start = now
+        self.w_max = self.cwnd
+        self.cwnd = max(self.cwnd * self.BETA, 2)
+        self.ssthresh = self.cwnd
+        self.k = (self.w_max * (1 - self.BETA) / self.C) ** (1 / 3)
+
+    def timeout(self, now):
+        self.decrease(now)
+        self.epoch_start = None
+        self.cwnd = 1
+
+
+CONGESTION_CONTROLLERS = {controller.name: controller for controller in (NewReno, Cubic)}
+
+
+def get_congestion_controller(name, **kwargs):
+    """
+    Create a congestion controller by name.
+
+    Args:
+        name (str): 'newreno' or 'cubic'.
+        **kwargs: Passed to the controller, e.g. initial_window and max_window.
+
+    Returns:
+        CongestionController: The controller.
+    """
+    try:
+        controller = CONGESTION_CONTROLLERS[name]
+    except KeyError:
+        raise ValueError(f"Unknown congestion controller {name!r}, expected one of {sorted(CONGESTION_CONTROLLERS)}") from None
+    return controller(**kwargs)
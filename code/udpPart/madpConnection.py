@@ -0,0 +1,677 @@
+import time
+from array import array
+from collections import deque
+from madpCodec import (CHUNK_FLAGS, COMPRESSED, DICTIONARY, FEC_PROTECTED, LAST_CHUNK, decode_ack, decode_data,
+                       decode_handshake, decode_repair, is_handshake, is_repair)
+from madpCompress import ChunkInflater
+from madpCongestion import get_congestion_controller
+from madpFec import FecDecoder
+from madpHandshake import ACCEPT, HELLO, REJECT, Accept, decode_reject
+from madpIntegrity import MD5
+from madpManifest import MANIFEST_FILE_ID, Manifest
+from madpPacing import Pacer
+from madpReorder import ReorderBuffer
+from madpSack import SackRanges, Scoreboard
+from madpStream import ReceiveStreams
+from utils import FileReassembler, SEQ_MASK, seq_add, seq_diff, seq_lt, seq_unwrap
+
+# The connection classes hold the protocol state of one transfer and perform no I/O.
+# They are fed with received datagrams and timer expiries, and tell the caller what to
+# send and when to expire next. The threaded scripts drive them from their threads under
+# a single condition, the asyncio engine drives them from the event loop without locks.
+
+
+class SenderConnection:
+    """
+    Sender side of a MADP transfer.
+
+    Sequence numbers are unbounded counters, one per chunk. Without a scheduler they
+    index the chunks, with one the chunk of every new sequence number is chosen by
+    the scheduler when it is first sent. On the wire they are 32-bit numbers starting
+    at initial_seq_num, and ACKs are unwrapped back relative to the base.
+
+    With a HELLO, the connection opens with the handshake of madpHandshake. No data
+    is sent before the ACCEPT arrives, unless the HELLO carries a resumption token:
+    then the data follows the HELLO in the first flight, and if the receiver assigns
+    another connection id than the one proposed, everything sent before the ACCEPT
+    is sent again under it. The HELLO is resent whenever the retransmission timer
+    expires before the ACCEPT.
+
+    The caller:
+    - sends the HELLO returned by take_hello, before the packets of next_batch,
+      and arms the retransmission timer with retransmit_delay() when it does,
+    - passes every datagram received on the ACK socket to on_ack, and re-arms
+      the retransmission timer with retransmit_delay() if it returns True,
+    - calls next_batch to get the packets to send, and sends them after the
+      returned delay with the checksum and connection id of the connection,
+      followed by the repair packets returned by take_repairs,
+    - calls on_timer when the retransmission timer expires, and re-arms it with
+      the returned delay,
+    - stops once finished is True.
+    """
+    def __init__(self, chunks, checksum=MD5, initial_seq_num=0, window_size=64000,
+                 congestion_control='newreno', pacing_gain=1.2, pace_retransmissions=False,
+                 min_timeout=0.2, min_probe_timeout=0.01, ack_frequency=2, ack_delay=0.005, scheduler=None,
+                 fec=None, hello=None, connection_id=0):
+        """
+        Args:
+            chunks (list): (file_id, chunk_num, payload, flag) tuples in sending order, or a
+                ChunkIndex or CompressedChunks that returns them. The chunks of the manifest come first.
+            checksum (Checksum): Integrity algorithm of the data packets, see madpIntegrity.
+            initial_seq_num (int): Sequence number of the first packet on the wire.
+            window_size (int): Receiver window in packets.
+            congestion_control (str): Name of the congestion controller, see madpCongestion.
+            pacing_gain (float): Pacing rate as a multiple of the estimated delivery rate, 0 disables pacing.
+            pace_retransmissions (bool): Whether retransmissions wait for the pacer.
+            min_timeout (float): Lower bound of the retransmission timeout in seconds.
+            min_probe_timeout (float): Lower bound of the tail loss probe timeout in seconds.
+            ack_frequency (int): Number of in order packets the receiver acknowledges with one ACK.
+            ack_delay (float): Seconds the receiver may hold an ACK back.
+            scheduler (Scheduler): Chooses the chunk sent with every new sequence number, see
+                madpScheduler. Without one, the chunks are sent in the order of the list.
+            fec (FecEncoder): Protects the new packets with repair packets, see madpFec. None disables FEC.
+            hello (Hello): Parameters proposed in the handshake, see madpHandshake. None if the
+                receiver was set up with them beforehand.
+            connection_id (int): Connection id proposed in the HELLO, or the one of the connection without a handshake.
+        """
+        self.chunks = chunks
+        self.scheduler = scheduler
+        # Chunk sent with every sequence counter, kept for the retransmissions when a scheduler picks them
+        self.schedule = array('I') if scheduler is not None else None
+        self.total_chunks = len(chunks)
+        self.checksum = checksum
+        self.initial_seq_num = initial_seq_num
+        self.window_size = window_size
+        # Delayed ACK policy the receiver is asked to follow, carried in every data packet.
+        # An encoder for the connection is created with PacketEncoder(checksum, ack_frequency, ack_delay).
+        self.ack_frequency = ack_frequency
+        self.ack_delay = ack_delay
+        self.base = 0 # Oldest packet that is not acknowledged
+        self.seq_num = 0 # Next new packet
+        self.done = False # The receiver reported the end of the transfer
+
+        # Selective acknowledgements. The scoreboard records the packets the receiver holds
+        # beyond the cumulative ACK, and the retransmission queue holds the holes that are
+        # waiting to be resent, ahead of new data.
+        self.scoreboard = Scoreboard(self.total_chunks)
+        self.retransmit_queue = deque()
+        self.dup_ack_count = 0
+        self.last_ack = 0
+
+        # The congestion controller limits the packets in flight below the receiver window,
+        # and the pacer spreads them over the smoothed RTT
+        self.congestion_control = get_congestion_controller(congestion_control, max_window=window_size)
+        self.pacer = Pacer(pacing_gain) if pacing_gain > 0 else None
+        self.pace_retransmissions = pace_retransmissions
+
+        # Retransmission timeout as in RFC 6298, kept above min_timeout since a spurious
+        # timeout collapses the congestion window
+        self.min_timeout = min_timeout
+        self.timeout_interval = 1.0
+        self.estimated_rtt = self.timeout_interval
+        self.dev_rtt = 0.0
+        self.rtt_sampled = False
+
+        # Tail loss probe. When the ACKs stop for two RTTs, one packet is sent beyond the
+        # congestion window before the retransmission timer expires, so that its ACK reveals
+        # a lost tail or a lost retransmission through the SACK blocks instead of a timeout.
+        self.min_probe_timeout = min_probe_timeout
+        self.probe_sent = False # A probe went out and no ACK has acknowledged anything since
+        self.probe_credit = 0 # Packets that may be sent beyond the congestion window
+
+        # Forward error correction. The new packets are grouped into blocks whose repair
+        # packets are queued for take_repairs. Repairs are sent on top of the congestion
+        # window: their number follows the loss rate, estimated from the packets found lost
+        # and the packets the receiver reports to have recovered.
+        self.fec = fec
+        self.repairs = []
+        self.lost_packets = 0
+
+        # Handshake. Until the ACCEPT, the HELLO is due at start and after every expiry of the timer.
+        self.connection_id = connection_id
+        self.hello_id = connection_id
+        self.hello = hello
+        self.hello_due = hello is not None
+        self.zero_rtt = hello is not None and hello.zero_rtt
+        self.accepted = hello is None
+        self.accept = None # The ACCEPT of the receiver
+        self.rejected = 0 # Reason of the REJECT of the receiver
+
+    @property
+    def finished(self):
+        """
+        True once every chunk is acknowledged or the receiver ended the transfer.
+        """
+        return self.base >= self.total_chunks or self.done
+
+    def wire_seq(self, seq):
+        """
+        32-bit sequence number of the unbounded counter seq.
+        """
+        return (self.initial_seq_num + seq) & SEQ_MASK
+
+    def on_ack(self, packet, now=None):
+        """
+        Process a datagram received on the ACK socket.
+
+        Verifies the ACK, records its SACK blocks, advances the base, detects lost
+        packets with the scoreboard and duplicate ACKs, and feeds the congestion
+        controller, the pacer and the RTT estimate.
+
+        Args:
+            packet (bytes): The datagram. An empty datagram means the receiver is done.
+            now (float): Wall clock time of the reception, used for the RTT sample.
+
+        Returns:
+            bool: True if the ACK was valid and the retransmission timer should be re-armed.
+        """
+        if not packet:
+            self.done = True
+            return False
+        if is_handshake(packet):
+            return self.on_handshake(packet, now)
+        # extract time, seqNum and SACK blocks with a single unpack and verify the checksum
+        valid, echoTime, ackNum, recovered, sackBlocks = decode_ack(packet)
+        if not valid:
+            return False
+        sampleRTT = (time.time() if now is None else now) - echoTime
+        scoreboard = self.scoreboard
+        # Map the 32-bit ACK number to the counter closest to the last acknowledged packet
+        ackNum = seq_unwrap((ackNum - self.initial_seq_num) & SEQ_MASK, self.base - 1)
+        # SACK blocks are unwrapped the same way and recorded on the scoreboard, before
+        # the duplicate ACK logic below decides which holes are lost
+        ackedPackets = 0
+        fastRetransmit = False
+        for start, end in sackBlocks:
+            sackStart = seq_unwrap((start - self.initial_seq_num) & SEQ_MASK, self.base)
+            ackedPackets += scoreboard.mark(sackStart, sackStart + ((end - start) & SEQ_MASK))
+        if ackNum + 1 > self.base:
+            # The receiver has everything up to ackNum and requires ackNum + 1 now
+            self.base = ackNum + 1
+            ackedPackets += scoreboard.advance(self.base)
+        elif self.last_ack == ackNum:
+            # A duplicate ACK, after three of them the base is retransmitted even without SACK information
+            self.dup_ack_count += 1
+            if self.dup_ack_count == 3:
+                fastRetransmit = True
+                self.dup_ack_count = 0
+        else:
+            # An out of order ACK
+            self.dup_ack_count = 0
+        self.last_ack = ackNum
+
+        # Holes overtaken by enough SACKed packets are lost, they go out ahead of new data
+        lostPackets = scoreboard.lost(self.seq_num, fastRetransmit)
+        if lostPackets:
+            self.retransmit_queue.extend(lostPackets)
+            self.congestion_control.on_loss(self.seq_num)
+            self.lost_packets += len(lostPackets)
+        if self.fec is not None:
+            self.fec.on_feedback(self.seq_num, self.lost_packets, recovered)
+
+        self.congestion_control.on_ack(ackedPackets, sampleRTT, self.base)
+        self.update_timeout_interval(sampleRTT)
+        if self.pacer is not None:
+            self.pacer.update(self.congestion_control.window, self.estimated_rtt, self.congestion_control.in_slow_start)
+        if ackedPackets > 0:
+            self.probe_sent = False
+        return True
+
+    def on_handshake(self, packet, now=None):
+        """
+        Process the reply of the receiver to the HELLO.
+
+        An ACCEPT switches the connection to the checksum, window and connection id the
+        receiver granted, a REJECT ends the connection with the reason in rejected.
+
+        Returns:
+            bool: True on the first valid ACCEPT.
+        """
+        valid, _, echoTime, kind, connectionId, payload = decode_handshake(packet)
+        if not valid or self.hello is None or self.accepted:
+            return False
+        if kind == REJECT:
+            self.rejected = decode_reject(payload)
+            self.done = True
+            return False
+        if kind != ACCEPT:
+            return False
+        try:
+            accept = Accept.decode(payload)
+        except ValueError:
+            return False
+        if accept.hello_id != self.hello_id:
+            return False # The reply to another HELLO
+        self.accepted = True
+        self.accept = accept
+        self.checksum = accept.checksum
+        self.window_size = min(self.window_size, accept.window)
+        self.congestion_control.max_window = min(self.congestion_control.max_window, self.window_size)
+        if connectionId != self.connection_id:
+            # The receiver refused the first flight, it is sent again under the connection id it assigned
+            self.connection_id = connectionId
+            self.retransmit_queue.clear()
+            self.retransmit_queue.extend(range(self.base, self.seq_num))
+        self.update_timeout_interval((time.time() if now is None else now) - echoTime)
+        return True
+
+    def take_hello(self):
+        """
+        Take the HELLO if it is due.
+
+        Returns:
+            tuple: send_handshake argument tuple (kind, connection_id, payload), None if it is not due.
+        """
+        if not self.hello_due:
+            return None
+        self.hello_due = False
+        return HELLO, self.hello_id, self.hello.encode()
+
+    def in_flight(self):
+        """
+        Packets sent and neither acknowledged, SACKed nor waiting in the
+        retransmission queue because they are known to be lost.
+        """
+        return self.seq_num - self.base - self.scoreboard.sacked_in_window - len(self.retransmit_queue)
+
+    def next_batch(self, limit):
+        """
+        Collect the packets to send next.
+
+        Queued retransmissions come first, then new data, as long as the packets in
+        flight stay below min(cwnd, window_size). Every packet takes a token from the
+        pacer, and the batch ends at the first packet that is not due yet.
+
+        Args:
+            limit (int): Maximum number of packets.
+
+        Returns:
+            tuple: (packets, delay, arm) where packets is a list of send_data argument tuples
+            (seq_num, file_id, chunk_num, flag, payload), delay is the
+            time in seconds to wait before sending them, and arm is True if the retransmission
+            timer must be armed because nothing was in flight.
+        """
+        if not self.accepted and not self.zero_rtt:
+            return [], 0.0, False # Waiting for the ACCEPT
+        scoreboard = self.scoreboard
+        queue = self.retransmit_queue
+        window = min(self.congestion_control.window, self.window_size)
+        batch = []
+        delay = 0.0
+        arm = False
+        while len(batch) < limit:
+            if self.in_flight() >= window and not self.probe_credit:
+                break
+            isNew = False
+            if queue:
+                seq = queue.popleft()
+                if seq < self.base or scoreboard.is_sacked(seq):
+                    continue # Acknowledged while it was waiting in the queue
+            elif self.seq_num < self.total_chunks and self.seq_num - self.base < self.window_size:
+                seq = self.seq_num
+                isNew = True
+                arm = arm or self.base == self.seq_num
+                self.seq_num += 1
+            elif self.probe_credit:
+                # No new data to probe with, resend the highest packet still missing
+                self.probe_credit = 0
+                seq = scoreboard.last_hole(self.seq_num)
+                if seq == -1:
+                    break
+            else:
+                break
+            self.probe_credit = 0
+            if self.schedule is None:
+                chunk = seq
+            elif isNew:
+                chunk = self.scheduler.next_chunk()
+                self.schedule.append(chunk)
+            else:
+                chunk = self.schedule[seq]
+            file_id, chunk_num, payload, flag = self.chunks[chunk]
+            if self.fec is not None:
+                if isNew:
+                    self.repairs.extend(self.fec.add(seq, file_id, chunk_num, flag, payload))
+                    if self.seq_num == self.total_chunks:
+                        self.repairs.extend(self.fec.flush()) # The last block may be shorter
+                flag |= FEC_PROTECTED
+            batch.append((self.wire_seq(seq), file_id, chunk_num, flag, payload))
+            # Retransmissions bypass the pacer unless pace_retransmissions is set
+            if self.pacer is not None and (isNew or self.pace_retransmissions):
+                delay = self.pacer.reserve()
+                if delay > 0:
+                    break
+        return batch, delay, arm
+
+    def take_repairs(self):
+        """
+        Take the repair packets of the blocks completed by the packets sent so far.
+
+        Returns:
+            list: send_repair argument tuples (base_seq, count, row, repairs, payload).
+        """
+        repairs = self.repairs
+        if not repairs:
+            return repairs
+        self.repairs = []
+        return [(self.wire_seq(base), count, row, total, payload) for base, count, row, total, payload in repairs]
+
+    def on_timer(self):
+        """
+        Handle the expiry of the retransmission timer.
+
+        The first expiry after the last progress only allows a tail loss probe. When
+        the timer expires again without progress, every hole is queued for
+        retransmission and the congestion controller is told about the timeout.
+        Before the ACCEPT, the HELLO is due again and the timeout backs off.
+
+        Returns:
+            float: Seconds until the timer should expire next, None once finished.
+        """
+        if self.finished:
+            return None
+        if not self.accepted:
+            self.hello_due = True
+            self.timeout_interval = min(self.timeout_interval * 2, 2)
+            if self.seq_num == 0:
+                return self.timeout_interval
+        if not self.probe_sent:
+            # Let one packet out beyond the congestion window and wait for the rest of the timeout
+            self.probe_sent = True
+            self.probe_credit = 1
+            return max(self.timeout_interval - self.probe_timeout(), 0)
+        # Queue every hole between base and seqNum, replacing whatever was queued before
+        self.retransmit_queue.clear()
+        self.retransmit_queue.extend(self.scoreboard.holes(self.seq_num))
+        self.congestion_control.on_timeout(self.seq_num)
+        return self.timeout_interval
+
+    def update_timeout_interval(self, sampleRTT):
+        if not self.rtt_sampled:
+            # The pacer needs a realistic RTT from the first ACK on
+            self.rtt_sampled = True
+            self.estimated_rtt = sampleRTT
+            self.dev_rtt = sampleRTT / 2
+        else:
+            self.estimated_rtt = 0.875 * self.estimated_rtt + 0.125 * sampleRTT
+            self.dev_rtt = 0.75 * self.dev_rtt + 0.25 * abs(sampleRTT - self.estimated_rtt)
+        self.timeout_interval = min(max(self.estimated_rtt + 4 * self.dev_rtt, self.min_timeout), 2)
+
+    def probe_timeout(self):
+        # A single probe may wait for the delayed ACK timer of the receiver
+        return min(max(2 * self.estimated_rtt + self.ack_delay, self.min_probe_timeout), self.timeout_interval)
+
+    def retransmit_delay(self):
+        """
+        Seconds until the retransmission timer should expire, first for the tail loss probe, then for the timeout.
+        """
+        return self.timeout_interval if self.probe_sent else self.probe_timeout()
+
+
+class ReceiverConnection:
+    """
+    Receiver side of a MADP transfer.
+
+    The first chunks of a transfer carry its manifest, which is decoded here and
+    handed to the reassembler before any chunk of a file, so the reassembler knows
+    the path and size of every file. Until then, packets that arrive out of order are
+    buffered until the hole before them is filled.
+
+    Afterwards every file is a stream of its own, see madpStream: a chunk is handed
+    to the reassembler as soon as it arrives, so a file completes once its own chunks
+    are in, whatever was lost before it in the sequence space. The connection still
+    orders the packets to acknowledge them: an out of order packet only keeps its
+    place in the reorder buffer, without its payload, until the hole before it is
+    filled. ACKs acknowledge the last in order packet and carry SACK blocks of the buffer.
+
+    Compressed chunks are inflated before they are handed to the reassembler, see madpCompress.
+
+    In order packets are acknowledged with delayed ACKs, following the policy the
+    sender puts in every data packet: one ACK per ack_frequency packets, or when
+    ack_delay has passed since the first unacknowledged one. The caller sends the
+    held ACK returned by take_ack once ack_deadline has passed. Out of order and
+    duplicate packets, packets that fill a gap and the last packet of the
+    transfer are acknowledged immediately, so loss detection is not delayed.
+
+    Packets of FEC blocks are kept by an FecDecoder along with the repair packets of
+    the blocks, see madpFec. A lost packet that the decoder rebuilds is processed like
+    a received one and acknowledged immediately, so the sender never retransmits it.
+    ACKs carry the number of packets recovered so far, from which the sender adapts
+    the redundancy.
+
+    The connection is opened with the parameters of the handshake, see madpHandshake.
+    Packets of another connection id, or protected with another checksum than the
+    negotiated one, are dropped.
+
+    Sequence numbers are 32-bit and wrap around, so they are only ever advanced with
+    seq_add and ordered with seq_lt. Completion is decided by counting delivered chunks.
+    """
+    def __init__(self, initial_seq_num=0, reassembler=None, window=65536, total_chunks=None, connection_id=0,
+                 checksum=None):
+        """
+        Args:
+            initial_seq_num (int): Sequence number of the first packet on the wire.
+            reassembler (FileReassembler): Receives the chunks of every file, a new one by default.
+            window (int): Capacity of the reorder buffer in packets, at least the window of the sender.
+            total_chunks (int): Chunks of the transfer, from the Hello. None if unknown, the
+                connection is then never complete.
+            connection_id (int): Connection id of the packets.
+            checksum (Checksum): Algorithm of the packets, None to take the one of the first packet.
+        """
+        self.connection_id = connection_id
+        self.expected_seq_num = initial_seq_num # Expected sequence number of the next packet
+        self.delivered_chunks = 0 # Number of packets received in order
+        self.total_chunks = total_chunks
+        self.buffer = ReorderBuffer(window) # Out of order packets, indexed by their unbounded counter
+        # Ranges of the buffered packets, reported to the sender as SACK blocks. They are kept
+        # as unbounded counters, where delivered_chunks is the counter of expected_seq_num.
+        self.sack_ranges = SackRanges()
+        self.reassembler = FileReassembler() if reassembler is None else reassembler
+        self.streams = ReceiveStreams(self.deliver) # One stream per file, the manifest included
+        self.manifest = None # Decoded once all of its chunks were delivered
+        self.manifest_chunks = {}
+        # Whether out of order chunks are delivered right away. They are held back until the
+        # manifest is known, or until the first packet shows that the transfer has none.
+        self.streaming = False
+        self.inflater = ChunkInflater()
+        self.checksum = checksum # Algorithm of the connection, the ACKs use it as well
+        self.ack_frequency = 1
+        self.ack_delay = 0.0
+        self.unacked = 0 # In order packets received since the last ACK
+        self.pending_ack = None # ACK held back by the delayed ACK policy
+        self.ack_deadline = None # Monotonic time at which the held ACK must be sent
+        self.fec = FecDecoder()
+        self.fec_prune = self.fec.horizon # Delivered count at which the decoder is pruned next
+
+    @property
+    def complete(self):
+        """
+        True once every packet of the transfer was received, never while the number of chunks is unknown.
+        """
+        return self.total_chunks is not None and self.delivered_chunks == self.total_chunks
+
+    def on_data(self, packet, verified=False):
+        """
+        Process a received data or repair packet.
+
+        Args:
+            packet (bytes-like): The datagram.
+            verified (bool): The checksum was verified already, see madpCodec.verify_data.
+
+        Returns:
+            tuple: (echo_time, ack_num, sack_blocks, recovered) of the ACK to send now with the
+            checksum algorithm in self.checksum, or None if the packet is corrupted or
+            its ACK is held back.
+        """
+        if is_repair(packet):
+            return self.on_repair(packet, verified)
+        # The checksum covers the header as well, so a corrupted header is never trusted
+        (valid, checksum, sendTime, connectionId, seqNum, fileId, chunkNum,
+         flags, ackFrequency, ackDelay, payload) = decode_data(packet, verified)
+        if not valid or connectionId != self.connection_id:
+            return None
+        if checksum is not self.checksum:
+            if self.checksum is not None:
+                return None # Not the negotiated algorithm
+            self.checksum = checksum
+        self.ack_frequency = ackFrequency
+        self.ack_delay = ackDelay / 1000
+        chunkFlags = flags & CHUNK_FLAGS
+        distance = seq_diff(seqNum, self.expected_seq_num)
+        if flags & FEC_PROTECTED and 0 <= distance < self.buffer.capacity:
+            recovered = self.fec.add_packet(self.delivered_chunks + distance, fileId, chunkNum, chunkFlags, payload)
+            ack = self.accept(distance, sendTime, fileId, chunkNum, payload, chunkFlags)
+            if self.delivered_chunks >= self.fec_prune:
+                self.fec.discard_below(self.delivered_chunks)
+                self.fec_prune = self.delivered_chunks + self.fec.horizon
+            return self.recover(recovered, sendTime) if recovered else ack
+        return self.accept(distance, sendTime, fileId, chunkNum, payload, chunkFlags)
+
+    def accept(self, distance, send_time, file_id, chunk_num, payload, flags):
+        """
+        Process a received or recovered packet.
+
+        Args:
+            distance (int): Distance of its sequence number from the expected one.
+            flags (int): Chunk flags of the packet.
+
+        Returns:
+            tuple: The ACK to send now, see on_data.
+        """
+        if distance == 0:
+            # Deliver it and whatever was waiting behind it
+            if self.delivered_chunks == 0 and file_id != MANIFEST_FILE_ID:
+                self.streaming = True # A transfer without a manifest
+            self.streams.add(file_id, chunk_num, payload, flags)
+            self.delivered_chunks += 1
+            self.expected_seq_num = seq_add(self.expected_seq_num, 1)
+            filledGap = len(self.buffer) > 0
+            if filledGap:
+                self.advance_buffer()
+            ack = self.ack(send_time)
+            self.unacked += 1
+            if filledGap or self.unacked >= self.ack_frequency or self.ack_delay <= 0 or self.complete:
+                return self.acknowledge(ack)
+            # Hold the ACK back, a later packet or the timer sends it
+            if self.pending_ack is None:
+                self.ack_deadline = time.monotonic() + self.ack_delay
+            self.pending_ack = ack
+            return None
+        self.unacked = 0
+        self.pending_ack = None
+        if distance > 0:
+            # Buffer it instead of dropping it, so the sender does not send it again. The ACK
+            # carries SACK blocks of the buffer, starting with the block of this packet, so the
+            # sender only retransmits the holes. Once streaming, the chunk is delivered to the
+            # stream of its file right away and the buffer only keeps its place.
+            if distance >= self.buffer.capacity:
+                return self.ack(send_time) # Beyond the window
+            received = self.delivered_chunks + distance
+            streaming = self.streaming
+            if self.buffer.put(received, file_id, chunk_num, None if streaming else payload, flags):
+                self.sack_ranges.add(received)
+                if streaming:
+                    self.streams.add(file_id, chunk_num, payload, flags)
+            return self.ack(send_time, received)
+        # An old packet is not processed again, but it is acknowledged: the sender retransmits
+        # it only because the ACK that covered it was lost.
+        return self.ack(send_time)
+
+    def on_repair(self, packet, verified=False):
+        """
+        Process a received repair packet.
+
+        Returns:
+            tuple: The ACK of the packets it recovered, see on_data, or None if it recovered none.
+        """
+        valid, _, sendTime, connectionId, baseSeq, count, row, repairs, payload = decode_repair(packet, verified)
+        if not valid or connectionId != self.connection_id:
+            return None
+        distance = seq_diff(baseSeq, self.expected_seq_num)
+        if distance + count <= 0 or distance >= self.buffer.capacity:
+            return None # Every packet of the block is in, or the block is beyond the window
+        recovered = self.fec.add_repair(self.delivered_chunks + distance, count, row, repairs, payload)
+        return self.recover(recovered, sendTime) if recovered else None
+
+    def recover(self, packets, send_time):
+        """
+        Process the packets rebuilt by the FEC decoder and acknowledge them immediately.
+
+        Args:
+            packets (list): (counter, file_id, chunk_num, flags, payload) tuples, see FecDecoder.recover.
+        """
+        for counter, fileId, chunkNum, chunkFlags, payload in packets:
+            distance = counter - self.delivered_chunks
+            if distance >= 0:
+                self.accept(distance, send_time, fileId, chunkNum, payload, chunkFlags)
+        return self.acknowledge(self.ack(send_time))
+
+    def deliver(self, file_id, chunk_num, payload, flags):
+        """
+        Hand a new chunk of a stream to the reassembler, inflated if it is compressed, or
+        collect it if it belongs to the manifest.
+
+        Raises:
+            ValueError: If the manifest or a compressed chunk is not valid, see Manifest.decode
+                and ChunkInflater.inflate.
+        """
+        if file_id != MANIFEST_FILE_ID:
+            if not flags & (COMPRESSED | DICTIONARY):
+                self.reassembler.add_chunk(file_id, chunk_num, payload, flags & LAST_CHUNK)
+                return
+            for chunkNum, data, chunkFlags in self.inflater.inflate(file_id, chunk_num, payload, flags):
+                self.reassembler.add_chunk(file_id, chunkNum, data, chunkFlags & LAST_CHUNK)
+            if self.streams[file_id].complete:
+                self.inflater.forget(file_id)
+            return
+        self.manifest_chunks[chunk_num] = bytes(payload) # The payload is a view of a receive buffer
+        if self.streams[MANIFEST_FILE_ID].complete:
+            chunks = self.manifest_chunks
+            self.manifest = Manifest.decode(b''.join(chunks[i] for i in range(len(chunks))))
+            self.manifest_chunks = {}
+            self.reassembler.set_manifest(self.manifest)
+            self.inflater.max_size = self.manifest.chunk_size
+            self.streaming = True
+
+    def ack(self, send_time, recent=None):
+        """
+        ACK of the current state, see on_data.
+
+        Args:
+            recent (int): Counter of the packet that triggered the ACK, its SACK block is reported first.
+        """
+        return send_time, seq_add(self.expected_seq_num, -1), self.sack_blocks(recent), self.fec.recovered
+
+    def acknowledge(self, ack):
+        self.unacked = 0
+        self.pending_ack = None
+        return ack
+
+    def take_ack(self):
+        """
+        The held ACK, called once ack_deadline has passed.
+
+        Returns:
+            tuple: (echo_time, ack_num, sack_blocks, recovered) or None if no ACK is held.
+        """
+        return self.acknowledge(self.pending_ack)
+
+    def advance_buffer(self):
+        """
+        Deliver the buffered packets that follow the expected one without a gap.
+        """
+        delivered = self.buffer.drain(self.delivered_chunks, self.streams.add)
+        self.delivered_chunks += delivered
+        self.expected_seq_num = seq_add(self.expected_seq_num, delivered)
+        self.sack_ranges.discard_below(self.delivered_chunks)
+
+    def sack_blocks(self, recent=None):
+        """
+        SACK blocks of the buffered packets as 32-bit sequence number ranges.
+
+        Args:
+            recent (int): Counter of the packet that triggered the ACK, reported first.
+        """
+        expected, delivered = self.expected_seq_num, self.delivered_chunks
+        return [(seq_add(expected, start - delivered), seq_add(expected, end - delivered))
+                for start, end in self.sack_ranges.blocks(recent)]
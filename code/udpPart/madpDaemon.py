@@ -0,0 +1,319 @@
+import asyncio
+import os
+import shutil
+import socket
+import sys
+import time
+from madpCodec import PacketEncoder, decode_handshake, is_handshake, is_probe, peek_connection_id
+from madpConnection import ReceiverConnection
+from madpHandshake import ACCEPT, HELLO, Hello, HandshakeAcceptor, load_key
+from madpIntegrity import get_checksum
+from madpPmtu import answer_probe
+from utils import StreamingReassembler
+
+# Multi-tenant receiver daemon. One socket on the asyncio engine receives the transfers of
+# any number of senders at once: every data and repair packet is routed by the connection
+# id in its header to the ReceiverConnection of its transfer, which the HELLO of the sender
+# opened. The connections share nothing but the socket, so a sender never sees the state,
+# the files or the ACKs of another one. The checksum of a packet is no MAC, so a connection
+# only takes the packets that come from the host its HELLO came from: another host that
+# learns or guesses the connection id cannot write into its files.
+#
+# Every connection writes its files under a namespace of its own in the output folder,
+# <host of the sender>/<connection id> by default, so two senders may send the same paths.
+#
+# Admission: the reorder buffer of a connection holds up to its window of chunks, so every
+# accepted connection reserves window * chunk size bytes of MAX_BUFFER_MEMORY until it is
+# closed. A HELLO is granted the window that fits in what is left, and it is rejected as busy
+# when not even MIN_WINDOW packets fit or MAX_CONNECTIONS connections are open. Transfers larger
+# than the free disk space, less what the open connections still have to write, are refused.
+# A connection that received nothing for IDLE_TIMEOUT seconds is closed and gives its
+# reservation back; its incomplete files are left as .part files.
+
+# Reorder buffer memory shared by every connection, in bytes
+MAX_BUFFER_MEMORY = 1 << 30
+MAX_CONNECTIONS = 64
+# Smallest window a connection is accepted with, in packets
+MIN_WINDOW = 64
+IDLE_TIMEOUT = 30
+
+
+def default_namespace(host, connection_id):
+    """
+    Output directory of a connection, relative to the output folder.
+    """
+    return os.path.join(host, f"{connection_id:08x}")
+
+
+class Tenant:
+    """
+    The state of one connection of the daemon.
+    """
+    def __init__(self, connection, address, directory, reserved, size, hello_key, reply):
+        """
+        Args:
+            connection (ReceiverConnection): The transfer.
+            address (tuple): Address the sender receives ACKs on.
+            directory (str): Directory the files of the transfer are written to.
+            reserved (int): Bytes of reorder buffer memory reserved for the connection.
+            size (int): Bytes of the transfer, as announced in the HELLO.
+            hello_key (tuple): (host, connection id of the HELLO), to answer a repeated HELLO.
+            reply (tuple): (checksum, send_handshake arguments) of the ACCEPT.
+        """
+        self.connection = connection
+        self.address = address
+        self.directory = directory
+        self.reserved = reserved
+        self.size = size
+        self.hello_key = hello_key
+        self.reply = reply
+        self.encoder = PacketEncoder(connection.checksum)
+        self.ack_timer = None # Handle of the delayed ACK deadline
+        self.time_start = time.time()
+        self.last_seen = time.monotonic()
+
+
+class ReceiverDaemon(asyncio.DatagramProtocol):
+    """
+    Receives the transfers of many senders on one endpoint.
+
+    The protocol is the endpoint the data packets of every connection arrive on, the
+    ACKs and handshake replies are sent from a separate non-blocking socket with the
+    packet encoders, one per connection so every one keeps the checksum it negotiated.
+    """
+    def __init__(self, acceptor, sock, directory, max_buffer_memory=MAX_BUFFER_MEMORY,
+                 max_connections=MAX_CONNECTIONS, min_window=MIN_WINDOW, idle_timeout=IDLE_TIMEOUT,
+                 namespace=default_namespace):
+        """
+        Args:
+            acceptor (HandshakeAcceptor): Decides on the HELLOs, its window is the largest one granted.
+            sock (socket.socket): Non-blocking UDP socket the ACKs are sent from.
+            directory (str): Output folder, the connections write under namespaces of it.
+            max_buffer_memory (int): Reorder buffer memory shared by every connection, in bytes.
+            max_connections (int): Connections open at once.
+            min_window (int): Smallest window a connection is accepted with, in packets.
+            idle_timeout (float): Seconds without a packet after which a connection is closed.
+            namespace (callable): (host, connection_id) -> output directory of the connection,
+                relative to directory.
+        """
+        self.acceptor = acceptor
+        self.sock = sock
+        self.directory = directory
+        self.max_buffer_memory = max_buffer_memory
+        self.max_connections = max_connections
+        self.min_window = min_window
+        self.idle_timeout = idle_timeout
+        self.namespace = namespace
+        self.tenants = {} # connection id -> Tenant
+        self.hellos = {} # (host, connection id of the HELLO) -> Tenant
+        # Connections that completed: connection id -> (address, monotonic time), their late
+        # packets get the termination packet again in case it was lost
+        self.finished = {}
+        self.reserved = 0 # Reorder buffer memory reserved by the open connections
+        self.completed = 0 # Transfers completed so far
+        self.encoder = PacketEncoder() # Handshake replies and probe ACKs
+        self.loop = asyncio.get_running_loop()
+        self.closed = self.loop.create_future()
+        self.sweeper = self.loop.call_later(idle_timeout, self.sweep)
+
+    def datagram_received(self, data, addr):
+        if is_probe(data): # Path MTU discovery of a sender, before its handshake
+            try:
+                answer_probe(self.encoder, self.sock, addr, data)
+            except BlockingIOError:
+                pass
+            return
+        if is_handshake(data):
+            self.on_hello(data, addr)
+            return
+        connectionId = peek_connection_id(data)
+        tenant = self.tenants.get(connectionId)
+        if tenant is None:
+            finished = self.finished.get(connectionId)
+            if finished is not None and finished[0][0] == addr[0]:
+                self.terminate(finished[0])
+            return # Before the handshake, or of a connection that was closed
+        if addr[0] != tenant.address[0]:
+            return # Not from the sender of the connection
+        tenant.last_seen = time.monotonic()
+        connection = tenant.connection
+        try:
+            ack = connection.on_data(data)
+        except (ValueError, OSError) as e:
+            # An invalid manifest or chunk, or the files cannot be written: only this transfer fails
+            print(f"Connection {connectionId:08x} of {tenant.address[0]} failed: {e}")
+            self.close(tenant)
+            return
+        if ack is not None:
+            self.send_ack(tenant, ack)
+        elif connection.pending_ack is not None and tenant.ack_timer is None:
+            # Held back by the delayed ACK policy
+            tenant.ack_timer = self.loop.call_later(max(connection.ack_deadline - time.monotonic(), 0),
+                                                    self.on_ack_timer, tenant)
+        if connection.complete:
+            self.complete(tenant)
+
+    def on_hello(self, data, addr):
+        valid, checksum, sendTime, kind, helloId, payload = decode_handshake(data)
+        if not valid or kind != HELLO:
+            return
+        host = addr[0]
+        tenant = self.hellos.get((host, helloId))
+        if tenant is not None: # The ACCEPT was lost
+            self.send_handshake(tenant.address, *tenant.reply, sendTime)
+            return
+        try:
+            hello = Hello.decode(payload)
+        except ValueError:
+            return
+        window = self.admissible_window(hello)
+        self.acceptor.max_size = max(shutil.disk_usage(self.directory).free
+                                     - sum(tenant.size for tenant in self.tenants.values()), 0)
+        kind, connectionId, reply, hello, accept = self.acceptor.on_hello(checksum, helloId, payload, host,
+                                                                          window, self.tenants)
+        if kind is None:
+            return
+        address = (host, hello.ack_port)
+        reply = (kind, connectionId, reply)
+        if kind == ACCEPT:
+            checksum = accept.checksum
+            directory = os.path.join(self.directory, self.namespace(host, connectionId))
+            os.makedirs(directory, exist_ok=True)
+            connection = ReceiverConnection(hello.initial_seq_num, StreamingReassembler(hello.chunk_size, directory),
+                                            accept.window, hello.total_chunks, connectionId, checksum)
+            tenant = Tenant(connection, address, directory, accept.window * hello.chunk_size, hello.size,
+                            (host, helloId), (checksum, reply))
+            self.tenants[connectionId] = tenant
+            self.hellos[tenant.hello_key] = tenant
+            self.reserved += tenant.reserved
+        self.send_handshake(address, checksum, reply, sendTime)
+
+    def admissible_window(self, hello):
+        """
+        Largest window the memory left and the connection limit allow for a HELLO, 0 if it must
+        be rejected as busy.
+        """
+        if len(self.tenants) >= self.max_connections or hello.chunk_size == 0:
+            return 0
+        window = min(self.acceptor.window, (self.max_buffer_memory - self.reserved) // hello.chunk_size)
+        if window < min(self.min_window, hello.window):
+            return 0
+        return window
+
+    def send_handshake(self, address, checksum, reply, echo_time):
+        if self.encoder.checksum is not checksum:
+            self.encoder.use(checksum)
+        try:
+            self.encoder.send_handshake(self.sock, address, *reply, echo_time=echo_time)
+        except BlockingIOError:
+            pass
+
+    def send_ack(self, tenant, ack):
+        if tenant.ack_timer is not None:
+            tenant.ack_timer.cancel()
+            tenant.ack_timer = None
+        try:
+            tenant.encoder.send_ack(self.sock, tenant.address, *ack)
+        except BlockingIOError:
+            pass
+
+    def on_ack_timer(self, tenant):
+        tenant.ack_timer = None
+        if self.tenants.get(tenant.connection.connection_id) is not tenant:
+            return # Closed in the meantime
+        ack = tenant.connection.take_ack()
+        if ack is not None:
+            self.send_ack(tenant, ack)
+
+    def complete(self, tenant):
+        connection = tenant.connection
+        self.close(tenant)
+        self.terminate(tenant.address)
+        self.finished[connection.connection_id] = (tenant.address, time.monotonic())
+        self.completed += 1
+        print(f"Received {len(connection.manifest) if connection.manifest is not None else 0} files from "
+              f"{tenant.address[0]} into {tenant.directory} in {time.time() - tenant.time_start:.3f} s")
+
+    def close(self, tenant):
+        """
+        Close a connection and give its reservation back. The files it did not complete are
+        left as .part files.
+        """
+        if tenant.ack_timer is not None:
+            tenant.ack_timer.cancel()
+            tenant.ack_timer = None
+        del self.tenants[tenant.connection.connection_id]
+        del self.hellos[tenant.hello_key]
+        self.reserved -= tenant.reserved
+        tenant.connection.reassembler.close()
+
+    def terminate(self, address):
+        # The empty packet tells the sender that the transfer is over, sent twice in case one is lost
+        for _ in range(2):
+            try:
+                self.sock.sendto(b'', address)
+            except BlockingIOError:
+                pass
+
+    def sweep(self):
+        """
+        Close the connections that went idle and forget the old completed ones.
+        """
+        deadline = time.monotonic() - self.idle_timeout
+        for tenant in [tenant for tenant in self.tenants.values() if tenant.last_seen < deadline]:
+            print(f"Connection {tenant.connection.connection_id:08x} of {tenant.address[0]} timed out")
+            self.close(tenant)
+        self.finished = {connectionId: entry for connectionId, entry in self.finished.items() if entry[1] >= deadline}
+        self.sweeper = self.loop.call_later(self.idle_timeout, self.sweep)
+
+    def error_received(self, exc):
+        pass
+
+    def connection_lost(self, exc):
+        self.sweeper.cancel()
+        for tenant in list(self.tenants.values()):
+            self.close(tenant)
+        if not self.closed.done():
+            self.closed.set_result(exc)
+
+
+async def serve(address, acceptor, directory, reuse_port=False, **settings):
+    """
+    Run the daemon until its endpoint is closed.
+
+    Args:
+        address (tuple): Local address the data packets of every sender arrive on.
+        acceptor (HandshakeAcceptor): Decides on the HELLOs.
+        directory (str): Output folder.
+        reuse_port (bool): Bind with SO_REUSEPORT, to run several daemon processes on one port.
+        **settings: The settings of ReceiverDaemon.
+    """
+    loop = asyncio.get_running_loop()
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setblocking(False)
+    transport, daemon = await loop.create_datagram_endpoint(
+        lambda: ReceiverDaemon(acceptor, sock, directory, **settings), local_addr=address,
+        reuse_port=reuse_port or None)
+    try:
+        await daemon.closed
+    finally:
+        transport.close()
+        sock.close()
+
+
+if __name__ == "__main__":
+    # python3 madpDaemon.py [port] receives the transfers of every sender with the handshake settings of
+    # madpReceiver.py, until it is interrupted
+    if len(sys.argv) > 2:
+        print("Usage: python3 madpDaemon.py [port]")
+        sys.exit(1)
+    import madpReceiver
+    port = int(sys.argv[1]) if len(sys.argv) == 2 else 65432
+    os.makedirs(madpReceiver.OUTPUT_FOLDER, exist_ok=True)
+    acceptor = HandshakeAcceptor(load_key(madpReceiver.TOKEN_KEY_FILE), madpReceiver.PACKET_SIZE,
+                                 madpReceiver.WINDOW,
+                                 [get_checksum(name) for name in madpReceiver.CHECKSUM_ALGORITHMS])
+    try:
+        asyncio.run(serve(('0.0.0.0', port), acceptor, madpReceiver.OUTPUT_FOLDER))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,313 @@
+import math
+import struct
+
+# Forward error correction. The sender groups consecutive new packets into blocks and
+# sends repair packets after every block, from which the receiver rebuilds up to as many
+# lost packets of the block as it received repairs, without waiting for a retransmission.
+#
+# A repair protects the symbols of the packets of its block: the chunk fields a packet
+# carries (file id, chunk number, chunk flags and payload length) followed by the
+# payload. A block with one repair carries their XOR parity. With more repairs, repair j
+# is the sum of the symbols weighted by row j of a Cauchy matrix over GF(256), a
+# Reed-Solomon style erasure code of which any r repairs rebuild any r lost packets.
+# Multiplying a symbol by a constant is a bytes.translate with the table of the constant,
+# and symbols are added (XOR) as big integers, so coding runs at C speed.
+
+SYMBOL_HEADER = struct.Struct('!IIBH')
+MAX_BLOCK_SIZE = 128 # Data packets and repairs of a block must fit the 256 elements of GF(256)
+MAX_REPAIRS = 64
+
+# GF(256) with the polynomial x^8 + x^4 + x^3 + x^2 + 1
+GF_EXP = bytearray(512)
+GF_LOG = bytearray(256)
+_x = 1
+for _i in range(255):
+    GF_EXP[_i] = _x
+    GF_LOG[_x] = _i
+    _x <<= 1
+    if _x & 0x100:
+        _x ^= 0x11d
+for _i in range(255, 512):
+    GF_EXP[_i] = GF_EXP[_i - 255]
+_MUL_TABLES = {}
+
+
+def gf_mul(a, b):
+    if a == 0 or b == 0:
+        return 0
+    return GF_EXP[GF_LOG[a] + GF_LOG[b]]
+
+
+def gf_inv(a):
+    return GF_EXP[255 - GF_LOG[a]]
+
+
+def mul_table(c):
+    """
+    Translation table that multiplies every byte by c.
+    """
+    table = _MUL_TABLES.get(c)
+    if table is None:
+        table = _MUL_TABLES[c] = bytes(gf_mul(c, x) for x in range(256))
+    return table
+
+
+def coefficient(row, column, repairs):
+    """
+    Weight of the symbol of data packet column in repair row of a block with the given number of repairs.
+    """
+    if repairs == 1:
+        return 1 # XOR parity
+    return gf_inv(row ^ (repairs + column))
+
+
+def scale(symbol, c):
+    """
+    The symbol multiplied by c, as an integer.
+    """
+    if c != 1:
+        symbol = bytes(symbol).translate(mul_table(c))
+    return int.from_bytes(symbol, 'little')
+
+
+def encode_symbol(file_id, chunk_num, flags, payload):
+    return SYMBOL_HEADER.pack(file_id, chunk_num, flags, len(payload)) + bytes(payload)
+
+
+def decode_symbol(symbol):
+    """
+    Returns:
+        tuple: (file_id, chunk_num, flags, payload)
+    """
+    file_id, chunk_num, flags, length = SYMBOL_HEADER.unpack_from(symbol)
+    return file_id, chunk_num, flags, symbol[SYMBOL_HEADER.size:SYMBOL_HEADER.size + length]
+
+
+class FecEncoder:
+    """
+    Sender side of the FEC layer.
+
+    New packets are added as they are sent for the first time. When a block is full,
+    or when the sender has no new data left, the repairs of the block are returned.
+
+    The number of repairs adapts to the loss rate of the path: the sender reports the
+    packets it sent, the packets it found lost and the packets the receiver recovered
+    with FEC (the losses FEC hid), and every block gets enough repairs for the
+    estimated loss rate times margin, between min_repairs and max_repairs.
+    """
+    def __init__(self, block_size=16, min_repairs=1, max_repairs=8, margin=1.5):
+        """
+        Args:
+            block_size (int): Data packets per block.
+            min_repairs (int): Repairs of every block, 1 is XOR parity.
+            max_repairs (int): Upper bound of the repairs of a block.
+            margin (float): Repairs as a multiple of the losses expected in a block.
+        """
+        self.block_size = min(block_size, MAX_BLOCK_SIZE)
+        self.min_repairs = min_repairs
+        self.max_repairs = min(max_repairs, MAX_REPAIRS)
+        self.margin = margin
+        self.base = None # Counter of the first packet of the open block
+        self.symbols = []
+        self.loss_rate = 0.0
+        self.sample_start = (0, 0, 0) # (sent, lost, recovered) at the start of the current sample
+
+    def add(self, seq, file_id, chunk_num, flags, payload):
+        """
+        Add a new packet to the open block.
+
+        Args:
+            seq (int): Unbounded sequence counter of the packet, consecutive within a block.
+
+        Returns:
+            list: The repairs of the block if it is full, see flush.
+        """
+        if self.base is None:
+            self.base = seq
+        self.symbols.append(encode_symbol(file_id, chunk_num, flags, payload))
+        if len(self.symbols) >= self.block_size:
+            return self.flush()
+        return []
+
+    def repair_count(self, count):
+        expected = count * self.loss_rate * self.margin
+        return min(max(math.ceil(expected), self.min_repairs), self.max_repairs)
+
+    def flush(self):
+        """
+        Close the open block.
+
+        Returns:
+            list: (base, count, index, repairs, payload) of every repair of the block, where base
+            is the counter of its first packet and count the number of its packets.
+        """
+        symbols = self.symbols
+        if not symbols:
+            return []
+        base, count = self.base, len(symbols)
+        self.base = None
+        self.symbols = []
+        repairs = self.repair_count(count)
+        size = max(len(symbol) for symbol in symbols)
+        result = []
+        for row in range(repairs):
+            value = 0
+            for column, symbol in enumerate(symbols):
+                value ^= scale(symbol, coefficient(row, column, repairs))
+            result.append((base, count, row, repairs, value.to_bytes(size, 'little')))
+        return result
+
+    def on_feedback(self, sent, lost, recovered):
+        """
+        Update the loss estimate.
+
+        Args:
+            sent (int): Packets sent so far, new ones only.
+            lost (int): Packets found lost so far.
+            recovered (int): Packets the receiver recovered with FEC so far.
+        """
+        sentStart, lostStart, recoveredStart = self.sample_start
+        if sent - sentStart < 4 * self.block_size:
+            return
+        sample = min((lost - lostStart + recovered - recoveredStart) / (sent - sentStart), 1.0)
+        self.loss_rate = 0.75 * self.loss_rate + 0.25 * sample
+        self.sample_start = (sent, lost, recovered)
+
+
+class FecBlock:
+    __slots__ = ('base', 'count', 'repairs', 'rows')
+
+    def __init__(self, base, count, repairs):
+        self.base = base
+        self.count = count
+        self.repairs = repairs
+        self.rows = {} # Received repairs: row -> payload
+
+
+class FecDecoder:
+    """
+    Receiver side of the FEC layer.
+
+    Keeps the chunk fields and payload of every received protected packet until its
+    block is resolved, and the repairs of the blocks. Whenever a block has at least as
+    many repairs as missing packets, the missing packets are rebuilt by solving the
+    linear system of the repairs over GF(256).
+
+    Packets are identified by the unbounded counters of the ReceiverConnection.
+
+    Payloads are copied when they are kept: a received payload is a view of a receive
+    slab of the DatagramReceiver, and a block that is never resolved would keep its
+    whole slab alive for as long as the horizon.
+    """
+    def __init__(self, horizon=16384):
+        """
+        Args:
+            horizon (int): Packets behind the delivered counter after which the state of
+                blocks that were never resolved is dropped.
+        """
+        self.horizon = horizon
+        self.packets = {} # counter -> (file_id, chunk_num, flags, payload)
+        self.blocks = {} # base counter -> FecBlock
+        self.block_of = {} # counter -> base counter of its block
+        self.recovered = 0
+
+    def add_packet(self, counter, file_id, chunk_num, flags, payload):
+        """
+        Keep a received protected packet.
+
+        Returns:
+            list: Packets recovered thanks to it, see recover.
+        """
+        if counter in self.packets:
+            return []
+        self.packets[counter] = (file_id, chunk_num, flags, bytes(payload))
+        base = self.block_of.get(counter)
+        return self.recover(base) if base is not None else []
+
+    def add_repair(self, base, count, row, repairs, payload):
+        """
+        Keep a received repair.
+
+        Returns:
+            list: Packets recovered thanks to it, see recover.
+        """
+        if count > MAX_BLOCK_SIZE or repairs > MAX_REPAIRS or row >= repairs or count == 0:
+            return []
+        block = self.blocks.get(base)
+        if block is None:
+            block = self.blocks[base] = FecBlock(base, count, repairs)
+            for counter in range(base, base + count):
+                self.block_of[counter] = base
+        elif block.count != count or block.repairs != repairs:
+            return []
+        block.rows[row] = bytes(payload)
+        return self.recover(base)
+
+    def recover(self, base):
+        """
+        Rebuild the missing packets of a block if it has enough repairs.
+
+        Returns:
+            list: (counter, file_id, chunk_num, flags, payload) of the recovered packets.
+        """
+        block = self.blocks[base]
+        packets = self.packets
+        missing = [counter for counter in range(base, base + block.count) if counter not in packets]
+        if not missing:
+            self.resolve(block)
+            return []
+        if len(missing) > len(block.rows):
+            return []
+        rows = sorted(block.rows)[:len(missing)]
+        size = max(len(block.rows[row]) for row in rows)
+        # Right hand side: every repair minus the weighted symbols of the packets that arrived
+        values = []
+        for row in rows:
+            value = int.from_bytes(block.rows[row], 'little')
+            for column in range(block.count):
+                counter = base + column
+                if counter in packets:
+                    value ^= scale(encode_symbol(*packets[counter]), coefficient(row, column, block.repairs))
+            values.append(value)
+        # Invert the weights of the missing packets in those rows with Gauss-Jordan elimination
+        n = len(missing)
+        matrix = [[coefficient(row, counter - base, block.repairs) for counter in missing] + [int(i == j) for j in range(n)]
+                  for i, row in enumerate(rows)]
+        for col in range(n):
+            pivot = next(r for r in range(col, n) if matrix[r][col])
+            matrix[col], matrix[pivot] = matrix[pivot], matrix[col]
+            inverse = gf_inv(matrix[col][col])
+            matrix[col] = [gf_mul(inverse, x) for x in matrix[col]]
+            for r in range(n):
+                if r != col and matrix[r][col]:
+                    factor = matrix[r][col]
+                    matrix[r] = [x ^ gf_mul(factor, y) for x, y in zip(matrix[r], matrix[col])]
+        recovered = []
+        for i, counter in enumerate(missing):
+            value = 0
+            for j in range(n):
+                c = matrix[i][n + j]
+                if c:
+                    value ^= scale(values[j].to_bytes(size, 'little'), c)
+            fields = decode_symbol(value.to_bytes(size, 'little'))
+            packets[counter] = fields
+            recovered.append((counter,) + fields)
+        self.recovered += len(recovered)
+        self.resolve(block)
+        return recovered
+
+    def resolve(self, block):
+        for counter in range(block.base, block.base + block.count):
+            self.packets.pop(counter, None)
+            self.block_of.pop(counter, None)
+        del self.blocks[block.base]
+
+    def discard_below(self, counter):
+        """
+        Drop the packets and blocks that ended more than horizon packets before counter.
+        """
+        limit = counter - self.horizon
+        for old in [c for c in self.packets if c < limit]:
+            del self.packets[old]
+        for base in [b for b, block in self.blocks.items() if block.base + block.count <= limit]:
+            self.resolve(self.blocks[base])
@@ -0,0 +1,388 @@
+import hashlib
+import hmac
+import json
+import os
+import struct
+import time
+from madpCodec import MAX_DATAGRAM_SIZE
+from madpIntegrity import CHECKSUMS, CHECKSUMS_BY_ID, get_checksum
+from madpPmtu import chunk_size
+
+# Connection setup of MADP.
+#
+# The sender opens a connection with a HELLO, sent to the data port of the receiver. It
+# proposes the parameters of the transfer: the chunk size, the initial sequence number, the
+# window, the checksum algorithms the sender can use (the one of the HELLO packet is its
+# preference), the size of the manifest and the port the sender receives ACKs on, at the
+# host the HELLO came from. The receiver answers with an ACCEPT that picks the checksum,
+# grants a window no larger than its reorder buffer and assigns the connection id every
+# data and repair packet carries, or with a REJECT. Data packets of a connection id the
+# receiver did not assign are dropped, so only a sender that received the ACCEPT gets its
+# data in, and stale packets of an earlier connection never mix into a new one.
+#
+# The ACCEPT also carries a resumption token: the parameters the receiver granted and an
+# expiry, with a MAC over them and the host of the sender, keyed with a secret of the
+# receiver. The sender caches the token with the parameters, see SessionCache. On its next
+# connection to the receiver it skips path MTU discovery, puts the token in the HELLO and
+# sends data right behind it, with the cached parameters and the connection id it proposed
+# in the HELLO (0-RTT). If the token is valid and the HELLO asks for no more than it grants,
+# the receiver keeps the proposed connection id and takes the data of the first flight.
+# Otherwise it assigns another connection id: the early data is dropped, and the sender
+# resends it under the assigned id once the ACCEPT arrives, so a refused 0-RTT costs a
+# round trip, never correctness.
+#
+# Compression is not part of the handshake. Every receiver inflates the chunks flagged
+# COMPRESSED and keeps the DICTIONARY chunks of the files in progress, so the flags of a
+# chunk tell the receiver all it needs, and the sender may decide per file and per chunk
+# whether to compress, even in the first flight of a 0-RTT connection.
+
+# Kinds of handshake packets
+HELLO = 1
+ACCEPT = 2
+REJECT = 3
+
+VERSION = 1
+# HELLO: version, bit mask of the type ids of the checksums the sender can use, chunk size,
+# initial sequence number, window in packets, total chunks, bytes and files of the manifest,
+# ACK port, followed by the resumption token if the sender has one.
+HELLO_FIELDS = struct.Struct('!BBIIIIQIH')
+# ACCEPT: checksum type id, connection id of the HELLO it answers, window in packets, lifetime of
+# the resumption token in seconds, followed by the token.
+ACCEPT_FIELDS = struct.Struct('!BIII')
+# REJECT: reason
+REJECT_FIELDS = struct.Struct('!B')
+REJECT_VERSION = 1
+REJECT_CHECKSUM = 2
+REJECT_CHUNK_SIZE = 3
+REJECT_SIZE = 4
+REJECT_BUSY = 5
+REJECT_REASONS = {
+    REJECT_VERSION: "unsupported protocol version",
+    REJECT_CHECKSUM: "no common checksum algorithm",
+    REJECT_CHUNK_SIZE: "chunk size larger than the receiver accepts",
+    REJECT_SIZE: "transfer larger than the receiver can store",
+    REJECT_BUSY: "receiver busy",
+}
+
+# Resumption token: expiry, chunk size, window, checksum type id, then a truncated HMAC-SHA256
+TOKEN_FIELDS = struct.Struct('!dIIB')
+TOKEN_MAC_SIZE = 16
+TOKEN_LIFETIME = 24 * 3600
+KEY_SIZE = 32
+
+
+def new_connection_id():
+    return int.from_bytes(os.urandom(4), 'big')
+
+
+def checksum_mask(checksums):
+    mask = 0
+    for checksum in checksums:
+        mask |= 1 << checksum.type_id
+    return mask
+
+
+def reject_reason(reason):
+    return REJECT_REASONS.get(reason, f"reason {reason}")
+
+
+class Hello:
+    """
+    Parameters of a transfer proposed by the sender.
+    """
+    def __init__(self, chunk_size, initial_seq_num, window, total_chunks, ack_port, size=0, files=0,
+                 checksums=None, token=b''):
+        """
+        Args:
+            chunk_size (int): Size of the chunks.
+            initial_seq_num (int): Sequence number of the first data packet.
+            window (int): Packets the sender keeps in flight at most.
+            total_chunks (int): Chunks of the transfer, the manifest included.
+            ack_port (int): Port the sender receives ACKs on.
+            size (int): Bytes of the files of the manifest.
+            files (int): Files of the manifest.
+            checksums (list): Checksum algorithms the sender can use, all of them by default.
+            token (bytes): Resumption token of an earlier connection, the sender sends data in its first flight.
+        """
+        self.version = VERSION
+        self.chunk_size = chunk_size
+        self.initial_seq_num = initial_seq_num
+        self.window = window
+        self.total_chunks = total_chunks
+        self.ack_port = ack_port
+        self.size = size
+        self.files = files
+        self.checksums = list(CHECKSUMS.values()) if checksums is None else list(checksums)
+        self.token = token
+
+    @property
+    def zero_rtt(self):
+        return bool(self.token)
+
+    def encode(self):
+        return HELLO_FIELDS.pack(self.version, checksum_mask(self.checksums), self.chunk_size, self.initial_seq_num,
+                                 self.window, self.total_chunks, self.size, self.files, self.ack_port) + self.token
+
+    @classmethod
+    def decode(cls, data):
+        """
+        Raises:
+            ValueError: If the data is not a HELLO.
+        """
+        if len(data) < HELLO_FIELDS.size:
+            raise ValueError("Truncated HELLO")
+        (version, mask, chunkSize, initialSeqNum, window, totalChunks,
+         size, files, ackPort) = HELLO_FIELDS.unpack_from(data)
+        checksums = [checksum for typeId, checksum in sorted(CHECKSUMS_BY_ID.items()) if mask & (1 << typeId)]
+        hello = cls(chunkSize, initialSeqNum, window, totalChunks, ackPort, size, files, checksums,
+                    bytes(data[HELLO_FIELDS.size:]))
+        hello.version = version
+        return hello
+
+
+class Accept:
+    """
+    Parameters of a transfer granted by the receiver.
+    """
+    def __init__(self, checksum, hello_id, window, lifetime=0, token=b''):
+        """
+        Args:
+            checksum (Checksum): Algorithm of the packets of the connection.
+            hello_id (int): Connection id of the HELLO answered.
+            window (int): Packets the sender may keep in flight at most.
+            lifetime (int): Seconds the token is valid.
+            token (bytes): Resumption token for the next connection.
+        """
+        self.checksum = checksum
+        self.hello_id = hello_id
+        self.window = window
+        self.lifetime = lifetime
+        self.token = token
+
+    def encode(self):
+        return ACCEPT_FIELDS.pack(self.checksum.type_id, self.hello_id, self.window, self.lifetime) + self.token
+
+    @classmethod
+    def decode(cls, data):
+        """
+        Raises:
+            ValueError: If the data is not an ACCEPT.
+        """
+        if len(data) < ACCEPT_FIELDS.size:
+            raise ValueError("Truncated ACCEPT")
+        typeId, helloId, window, lifetime = ACCEPT_FIELDS.unpack_from(data)
+        checksum = CHECKSUMS_BY_ID.get(typeId)
+        if checksum is None or window == 0:
+            raise ValueError("Invalid ACCEPT")
+        return cls(checksum, helloId, window, lifetime, bytes(data[ACCEPT_FIELDS.size:]))
+
+
+def decode_reject(data):
+    """
+    Returns:
+        int: The reason of a REJECT, 0 if it is truncated.
+    """
+    return REJECT_FIELDS.unpack_from(data)[0] if len(data) >= REJECT_FIELDS.size else 0
+
+
+class HandshakeAcceptor:
+    """
+    Receiver side of the handshake, without any I/O.
+
+    Decides on every HELLO, and issues and checks the resumption tokens. The caller
+    sends the reply, and opens a ReceiverConnection with the parameters of an ACCEPT.
+    """
+    def __init__(self, key, max_datagram_size=MAX_DATAGRAM_SIZE, window=65536, checksums=None, max_size=None,
+                 lifetime=TOKEN_LIFETIME):
+        """
+        Args:
+            key (bytes): Secret the tokens are authenticated with, see load_key.
+            max_datagram_size (int): Largest datagram received, bounds the chunk size.
+            window (int): Largest window granted, the capacity of the reorder buffer.
+            checksums (list): Algorithms accepted in order of preference, all of them by default.
+            max_size (int): Largest transfer in bytes, None for no limit.
+            lifetime (int): Seconds a token is valid.
+        """
+        self.key = key
+        self.max_datagram_size = max_datagram_size
+        self.window = window
+        self.checksums = list(CHECKSUMS.values()) if checksums is None else list(checksums)
+        self.max_size = max_size
+        self.lifetime = lifetime
+
+    def on_hello(self, checksum, hello_id, payload, host, window=None, in_use=()):
+        """
+        Decide on a HELLO.
+
+        Args:
+            checksum (Checksum): Algorithm of the HELLO packet, the preference of the sender.
+            hello_id (int): Connection id of the HELLO packet.
+            payload (bytes-like): Payload of the HELLO packet.
+            host (str): Host the HELLO came from.
+            window (int): Largest window granted to this connection, self.window by default.
+                A sender that would get no window at all is rejected as busy.
+            in_use (container): Connection ids of the open connections, never assigned again.
+
+        Returns:
+            tuple: (kind, connection_id, reply, hello, accept) where kind is ACCEPT or REJECT and
+            reply the payload of the reply packet, to send with the connection id. accept is None
+            for a REJECT. kind is None if the HELLO is not valid and must be dropped.
+        """
+        try:
+            hello = Hello.decode(payload)
+        except ValueError:
+            return None, None, None, None, None
+        window = min(hello.window, self.window if window is None else window)
+        picked = self.pick_checksum(checksum, hello.checksums)
+        reason = 0
+        if hello.version != VERSION:
+            reason = REJECT_VERSION
+        elif picked is None:
+            reason = REJECT_CHECKSUM
+        elif hello.chunk_size == 0 or hello.chunk_size > chunk_size(self.max_datagram_size, picked):
+            reason = REJECT_CHUNK_SIZE
+        elif self.max_size is not None and hello.size > self.max_size:
+            reason = REJECT_SIZE
+        elif window <= 0:
+            reason = REJECT_BUSY
+        if reason:
+            return REJECT, hello_id, REJECT_FIELDS.pack(reason), hello, None
+        # 0-RTT: the first flight was sent under the proposed connection id with the parameters of the token
+        connectionId = hello_id
+        granted = self.check_token(hello.token, host)
+        if (granted is None or granted[0] != hello.chunk_size or granted[2] is not picked
+                or hello.window > min(granted[1], window) or hello_id in in_use):
+            connectionId = new_connection_id()
+            while connectionId in in_use or connectionId == hello_id:
+                connectionId = new_connection_id()
+        accept = Accept(picked, hello_id, window, self.lifetime,
+                        self.issue_token(host, hello.chunk_size, window, picked))
+        return ACCEPT, connectionId, accept.encode(), hello, accept
+
+    def pick_checksum(self, preferred, offered):
+        """
+        The preference of the sender if the receiver accepts it, else the first accepted one the sender offers.
+        """
+        if preferred in self.checksums and preferred in offered:
+            return preferred
+        return next((checksum for checksum in self.checksums if checksum in offered), None)
+
+    def mac(self, host, fields):
+        return hmac.new(self.key, host.encode('utf-8') + fields, hashlib.sha256).digest()[:TOKEN_MAC_SIZE]
+
+    def issue_token(self, host, chunk_size, window, checksum):
+        fields = TOKEN_FIELDS.pack(time.time() + self.lifetime, chunk_size, window, checksum.type_id)
+        return fields + self.mac(host, fields)
+
+    def check_token(self, token, host):
+        """
+        Returns:
+            tuple: (chunk_size, window, checksum) granted by a valid token issued to host, None if
+            the token is not valid or has expired.
+        """
+        if len(token) != TOKEN_FIELDS.size + TOKEN_MAC_SIZE:
+            return None
+        fields = token[:TOKEN_FIELDS.size]
+        if not hmac.compare_digest(self.mac(host, fields), token[TOKEN_FIELDS.size:]):
+            return None
+        expiry, chunkSize, window, typeId = TOKEN_FIELDS.unpack(fields)
+        if expiry < time.time():
+            return None
+        return chunkSize, window, CHECKSUMS_BY_ID.get(typeId)
+
+
+def load_key(path):
+    """
+    Read the token key of the receiver, created on first use, so tokens stay valid across restarts.
+    """
+    try:
+        with open(path, 'rb') as f:
+            key = f.read()
+        if len(key) == KEY_SIZE:
+            return key
+    except FileNotFoundError:
+        pass
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    key = os.urandom(KEY_SIZE)
+    temporary = f"{path}.{os.getpid()}"
+    with open(os.open(temporary, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'wb') as f:
+        f.write(key)
+    try:
+        os.link(temporary, path) # Another process may have created it in the meantime
+    except FileExistsError:
+        pass
+    finally:
+        os.unlink(temporary)
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+class Session:
+    """
+    Parameters granted by a receiver, cached by the sender for 0-RTT.
+    """
+    def __init__(self, chunk_size, checksum, window, token, expiry):
+        self.chunk_size = chunk_size
+        self.checksum = checksum
+        self.window = window
+        self.token = token
+        self.expiry = expiry
+
+    @classmethod
+    def from_accept(cls, chunk_size, accept):
+        return cls(chunk_size, accept.checksum, accept.window, accept.token, time.time() + accept.lifetime)
+
+
+class SessionCache:
+    """
+    Sessions of the sender by receiver address, in a JSON file.
+
+    The file is read again before every change and replaced atomically, so the
+    workers of a sharded transfer may share it.
+    """
+    def __init__(self, path):
+        self.path = path
+
+    @staticmethod
+    def key(address):
+        return f"{address[0]}:{address[1]}"
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def save(self, sessions):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        temporary = f"{self.path}.{os.getpid()}"
+        with open(os.open(temporary, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'w') as f:
+            json.dump(sessions, f)
+        os.replace(temporary, self.path)
+
+    def get(self, address):
+        """
+        Returns:
+            Session: The session of the receiver at address, None if there is none or it expired.
+        """
+        entry = self.load().get(self.key(address))
+        if entry is None or entry['expiry'] < time.time():
+            return None
+        try:
+            return Session(entry['chunk_size'], get_checksum(entry['checksum']), entry['window'],
+                           bytes.fromhex(entry['token']), entry['expiry'])
+        except (KeyError, ValueError):
+            return None
+
+    def store(self, address, session):
+        sessions = self.load()
+        sessions[self.key(address)] = {'chunk_size': session.chunk_size, 'checksum': session.checksum.name,
+                                       'window': session.window, 'token': session.token.hex(),
+                                       'expiry': session.expiry}
+        self.save(sessions)
+
+    def forget(self, address):
+        sessions = self.load()
+        if sessions.pop(self.key(address), None) is not None:
+            self.save(sessions)
@@ -0,0 +1,139 @@
+import os
+import posixpath
+import struct
+
+# The manifest travels in the transfer itself, as the chunks of this reserved file id.
+# They are sent first, so the receiver has the table before any file chunk is delivered.
+MANIFEST_FILE_ID = 0xFFFFFFFF
+
+# Manifest encoding: magic, chunk size, number of files, then per file its size and
+# the length of its UTF-8 path followed by the path. File ids are the positions in the table.
+MANIFEST_HEADER = struct.Struct('!4sII')
+MANIFEST_ENTRY = struct.Struct('!QH')
+MANIFEST_MAGIC = b'MADM'
+
+
+class Manifest:
+    """
+    Table of the files of a transfer.
+
+    The data packets only carry a file id and a chunk number, the manifest maps the
+    id to the relative path of the file, its size and its number of chunks. Paths
+    use '/' as separator on every platform.
+    """
+    def __init__(self, chunk_size, entries=()):
+        """
+        Args:
+            chunk_size (int): Size of every chunk but the last one of a file.
+            entries (list): (path, size) tuples, the file id of an entry is its position.
+        """
+        self.chunk_size = chunk_size
+        self.paths = []
+        self.sizes = []
+        for path, size in entries:
+            self.add(path, size)
+
+    @classmethod
+    def from_directory(cls, root, chunk_size):
+        """
+        Build the manifest of every regular file under root, in sorted path order.
+
+        Args:
+            root (str): The directory to send.
+            chunk_size (int): Size of the chunks the files are cut into.
+        """
+        manifest = cls(chunk_size)
+        for directory, subdirectories, files in os.walk(root):
+            subdirectories.sort()
+            for name in sorted(files):
+                path = os.path.join(directory, name)
+                if os.path.isfile(path):
+                    relative = os.path.relpath(path, root).replace(os.sep, '/')
+                    manifest.add(relative, os.path.getsize(path))
+        return manifest
+
+    def add(self, path, size):
+        """
+        Append a file to the table.
+
+        Returns:
+            int: The file id of the file.
+        """
+        if len(self.paths) >= MANIFEST_FILE_ID:
+            raise ValueError("Too many files for one manifest")
+        self.paths.append(check_path(path))
+        self.sizes.append(size)
+        return len(self.paths) - 1
+
+    def __len__(self):
+        return len(self.paths)
+
+    def __iter__(self):
+        """
+        Iterate over (file_id, path, size) tuples.
+        """
+        return ((file_id, path, self.sizes[file_id]) for file_id, path in enumerate(self.paths))
+
+    def chunk_count(self, file_id):
+        """
+        Number of chunks of a file. An empty file is sent as a single empty chunk.
+        """
+        return max((self.sizes[file_id] + self.chunk_size - 1) // self.chunk_size, 1)
+
+    def total_chunks(self):
+        return sum(self.chunk_count(file_id) for file_id in range(len(self)))
+
+    def encode(self):
+        """
+        Returns:
+            bytes: The manifest as it is sent.
+        """
+        parts = [MANIFEST_HEADER.pack(MANIFEST_MAGIC, self.chunk_size, len(self))]
+        for path, size in zip(self.paths, self.sizes):
+            encoded = path.encode('utf-8')
+            parts.append(MANIFEST_ENTRY.pack(size, len(encoded)))
+            parts.append(encoded)
+        return b''.join(parts)
+
+    @classmethod
+    def decode(cls, data):
+        """
+        Parse a received manifest.
+
+        Raises:
+            ValueError: If the data is not a valid manifest or a path would leave the
+                output directory.
+        """
+        data = bytes(data)
+        if len(data) < MANIFEST_HEADER.size:
+            raise ValueError("Truncated manifest")
+        magic, chunkSize, count = MANIFEST_HEADER.unpack_from(data)
+        if magic != MANIFEST_MAGIC or chunkSize == 0:
+            raise ValueError("Not a MADP manifest")
+        manifest = cls(chunkSize)
+        offset = MANIFEST_HEADER.size
+        for _ in range(count):
+            if offset + MANIFEST_ENTRY.size > len(data):
+                raise ValueError("Truncated manifest")
+            size, length = MANIFEST_ENTRY.unpack_from(data, offset)
+            offset += MANIFEST_ENTRY.size
+            if offset + length > len(data):
+                raise ValueError("Truncated manifest")
+            manifest.add(data[offset:offset + length].decode('utf-8'), size)
+            offset += length
+        return manifest
+
+
+def check_path(path):
+    """
+    Reject paths that are absolute or climb out of the directory they are relative to,
+    since the receiver joins them to its output directory.
+
+    Returns:
+        str: The path.
+    """
+    normalized = posixpath.normpath(path)
+    if (not path or path.startswith('/') or '\\' in path or ':' in path.split('/')[0]
+            or normalized == '.' or normalized.startswith('../') or normalized == '..'):
+        raise ValueError(f"Unsafe path in manifest: {path!r}")
+    return path
@@ -0,0 +1,62 @@
+import time
+
+
+class Pacer:
+    """
+    Token bucket that spreads the packets of a window over the smoothed RTT.
+
+    The bucket is refilled at a multiple of the estimated delivery rate, the
+    congestion window per smoothed RTT, and every paced packet takes a token.
+    A packet that finds the bucket empty goes into debt, and the sender sleeps
+    the debt off before sending it. Debts shorter than min_delay are not slept
+    on, they are paid off by the next sleep, so a fast path sends micro-bursts
+    instead of calling sleep for every packet.
+
+    Until the first RTT sample arrives there is no rate to pace at, and packets
+    are sent without delay.
+    """
+    SLOW_START_GAIN = 2.0 # The window doubles every RTT in slow start, so the rate must keep up
+
+    def __init__(self, gain=1.2, burst=0.001, min_delay=0.0005):
+        """
+        Args:
+            gain (float): Multiple of the estimated delivery rate to pace at in congestion avoidance.
+            burst (float): Seconds worth of tokens the bucket holds after an idle period,
+                at least two packets.
+            min_delay (float): Shortest debt in seconds the sender sleeps on.
+        """
+        self.gain = gain
+        self.burst = burst
+        self.min_delay = min_delay
+        self.rate = None # Packets per second
+        self.depth = 2.0
+        self.tokens = 0.0
+        self.stamp = time.monotonic()
+
+    def update(self, window, srtt, slow_start=False):
+        """
+        Set the pacing rate from the congestion controller, called on every ACK.
+
+        Args:
+            window (int): Congestion window in packets.
+            srtt (float): Smoothed RTT in seconds.
+            slow_start (bool): Whether the controller is in slow start.
+        """
+        gain = self.SLOW_START_GAIN if slow_start else self.gain
+        self.rate = gain * window / max(srtt, 1e-6)
+        self.depth = max(self.rate * self.burst, 2.0)
+
+    def reserve(self, now=None):
+        """
+        Take the token of a packet about to be sent.
+
+        Returns:
+            float: Seconds to sleep before sending the packet, 0 to send it right away.
+        """
+        if self.rate is None:
+            return 0.0
+        now = time.monotonic() if now is None else now
+        self.tokens = min(self.tokens + (now - self.stamp) * self.rate, self.depth) - 1
+        self.stamp = now
+        delay = -self.tokens / self.rate
+        return delay if delay >= self.min_delay else 0.0
@@ -0,0 +1,157 @@
+import queue
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from madpCodec import packet_checksum, verify_data
+
+
+def verify_batch(batch):
+    return [verify_data(packet) for packet in batch]
+
+
+def holds_gil(batch):
+    """
+    True if every packet of the batch is too small for its checksum to release the GIL.
+    """
+    for packet in batch:
+        checksum = packet_checksum(packet)
+        if checksum is not None and len(packet) >= checksum.gil_release_size:
+            return False
+    return True
+
+
+class BatchVerifier:
+    """
+    Verification stage of the receive pipeline.
+
+    Batches of received datagrams are verified on a thread pool while the receive
+    loop goes on receiving. The results are taken back in the order the batches
+    were submitted, with the source addresses of the datagrams, so the protocol
+    sees the packets in arrival order. At most
+    limit batches are being verified at once, the receive loop waits for the
+    oldest one only when the pool is that far behind.
+
+    The pool only runs in parallel with the receive loop while the checksum is
+    computed without the GIL, which hashlib and zlib only do for large buffers, see
+    Checksum.gil_release_size. A batch of smaller packets, e.g. 1400 byte packets with
+    crc32, would only add thread handoffs, so it is verified inline on submit.
+    """
+    def __init__(self, threads=2, limit=8):
+        """
+        Args:
+            threads (int): Threads of the pool.
+            limit (int): Batches that may be verified at once.
+        """
+        self.pool = ThreadPoolExecutor(threads, thread_name_prefix='madp-verify')
+        self.limit = limit
+        self.pending = deque() # (batch, sources, future) in submission order
+
+    def __len__(self):
+        return len(self.pending)
+
+    def full(self):
+        return len(self.pending) >= self.limit
+
+    def submit(self, batch, sources):
+        if holds_gil(batch):
+            future = Future()
+            future.set_result(verify_batch(batch))
+        else:
+            future = self.pool.submit(verify_batch, batch)
+        self.pending.append((batch, sources, future))
+
+    def completed(self, wait=False):
+        """
+        Take the verified batches, in submission order, up to the first one that is not done.
+
+        Args:
+            wait (bool): Wait for the oldest batch if it is not done.
+
+        Returns:
+            list: (packet, valid, source) tuples.
+        """
+        results = []
+        pending = self.pending
+        while pending and (pending[0][2].done() or wait):
+            batch, sources, future = pending.popleft()
+            results.extend(zip(batch, future.result(), sources))
+            wait = False
+        return results
+
+    def close(self):
+        """
+        Stop the pool, the batches not taken yet are dropped.
+        """
+        self.pool.shutdown(wait=False, cancel_futures=True)
+        self.pending.clear()
+
+
+class DiskWriter:
+    """
+    Reassembly and disk I/O stage of the receive pipeline.
+
+    Stands in for the reassembler of a ReceiverConnection: add_chunk and
+    set_manifest only queue the call, and a thread of its own makes the calls on
+    the real reassembler, so opening and writing files never holds up the receive
+    loop. The queue is bounded by admission: while limit chunks wait, full() is
+    True and the receive loop drops new packets without acknowledging them, which
+    the sender recovers like losses.
+
+    Once a call failed, the following chunks are not written, and the next
+    add_chunk or set_manifest raises the error on the receive thread.
+    """
+    def __init__(self, reassembler, limit=8192):
+        """
+        Args:
+            reassembler (FileReassembler): Receives the chunks on the writer thread.
+            limit (int): Chunks that may wait to be written.
+        """
+        self.reassembler = reassembler
+        self.limit = limit
+        self.queue = queue.Queue()
+        self.error = None
+        self.thread = threading.Thread(target=self.run, name='madp-disk', daemon=True)
+        self.thread.start()
+
+    def full(self):
+        return self.queue.qsize() >= self.limit
+
+    def add_chunk(self, file_id, chunk_number, data, flags):
+        """
+        Raises:
+            Exception: The error of an earlier call on the writer thread.
+        """
+        self.check()
+        self.queue.put((self.reassembler.add_chunk, (file_id, chunk_number, data, flags)))
+
+    def set_manifest(self, manifest):
+        self.check()
+        self.queue.put((self.reassembler.set_manifest, (manifest,)))
+
+    def check(self):
+        if self.error is not None:
+            raise self.error
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            if self.error is not None:
+                continue # Drained without writing after a failure
+            call, args = item
+            try:
+                call(*args)
+            except Exception as e:
+                self.error = e
+
+    def close(self):
+        """
+        Wait until every queued chunk is written.
+
+        Raises:
+            Exception: The first error of the reassembler, e.g. an OSError of a write.
+        """
+        self.queue.put(None)
+        self.thread.join()
+        self.check()
@@ -0,0 +1,241 @@
+import errno
+import select
+import socket
+import sys
+import time
+from madpCodec import DATA_FIELDS, MAX_DATAGRAM_SIZE, REPAIR_FIELDS, PacketEncoder, decode_probe, decode_probe_ack
+from madpFec import SYMBOL_HEADER
+from madpIntegrity import CRC32
+
+# Datagram packetization layer path MTU discovery, after RFC 8899.
+#
+# The sender sends probes, datagrams padded to the size under test with the don't-fragment
+# bit set, and the receiver acknowledges every probe that arrives intact, back to the socket
+# the probe came from: the search runs before the handshake tells the ACK port of the sender. The largest
+# acknowledged size is the largest datagram the path carries without fragmentation, and the
+# chunk size of the transfer is derived from it. The receiver puts the largest datagram it
+# accepts into every probe ACK, and the sender never goes beyond it, so the two sides cannot
+# disagree on the size of a packet.
+#
+# Probes of several sizes are sent at once, so the search takes a few RTTs: first a ladder of
+# common MTUs up to jumbo frames, then evenly spaced sizes between the largest size that went
+# through and the smallest that did not. A probe that is not acknowledged is sent again up to
+# MAX_PROBES times before its size is considered too large, so a lost probe is not mistaken
+# for the MTU.
+#
+# The don't-fragment bit is set with IP_MTU_DISCOVER / IP_PMTUDISC_PROBE, which also makes the
+# kernel ignore the path MTU it cached from ICMP messages. It is only available on Linux;
+# elsewhere a large probe could be fragmented and still arrive, so no search is made.
+
+IP_MTU_DISCOVER = getattr(socket, 'IP_MTU_DISCOVER', 10)
+IP_PMTUDISC_PROBE = getattr(socket, 'IP_PMTUDISC_PROBE', 3)
+PROBING_SUPPORTED = sys.platform.startswith('linux')
+
+# Datagram sizes, the payload of a UDP packet: MTU minus the 20 byte IPv4 and 8 byte UDP headers
+BASE_DATAGRAM_SIZE = 1200 # Assumed to go through every path, as in QUIC
+JUMBO_DATAGRAM_SIZE = 9000 - 28
+# Common MTUs: 1280 (IPv6 minimum), 1400 (tunnels), 1492 (PPPoE), 1500 (Ethernet), 4096, 9000 (jumbo frames)
+LADDER = (1280 - 28, 1400 - 28, 1492 - 28, 1500 - 28, 4096 - 28, JUMBO_DATAGRAM_SIZE)
+MAX_PROBES = 3
+
+
+class PathMtuSearch:
+    """
+    The search state of path MTU discovery, without any I/O.
+
+    The caller sends a probe of every size of probes(), passes the acknowledged sizes
+    to on_ack and the sizes that could not be sent to on_failure, and calls on_timeout
+    when the probes were not all acknowledged within a probe timeout, until done is True.
+    """
+    def __init__(self, min_size=BASE_DATAGRAM_SIZE, max_size=JUMBO_DATAGRAM_SIZE, points=8, resolution=16,
+                 max_probes=MAX_PROBES):
+        """
+        Args:
+            min_size (int): Smallest datagram size searched.
+            max_size (int): Largest datagram size searched.
+            points (int): Sizes probed at once when narrowing the search.
+            resolution (int): The search ends once the largest size that went through is this close
+                to the smallest one that did not.
+            max_probes (int): Probes of a size that go unacknowledged before the size is too large.
+        """
+        self.min_size = min_size
+        self.max_size = min(max_size, MAX_DATAGRAM_SIZE)
+        self.points = points
+        self.resolution = resolution
+        self.max_probes = max_probes
+        self.best = None # Largest acknowledged size
+        self.ceiling = self.max_size + 1 # Smallest size known to be too large
+        self.receiver_max = None # Largest datagram the receiver accepts
+        self.pending = set() # Sizes of the current round not acknowledged yet
+        self.round = 0
+        self.attempts = 0
+        self.done = False
+        self.start_round([min_size] + [size for size in LADDER if min_size < size < self.max_size] + [self.max_size])
+
+    @property
+    def result(self):
+        """
+        Largest datagram size that went through, None if not even min_size did.
+        """
+        return self.best
+
+    def start_round(self, sizes):
+        self.pending = {size for size in sizes if (self.best or 0) < size < self.ceiling}
+        self.round += 1
+        self.attempts = 0
+        if not self.pending:
+            self.done = True
+
+    def next_round(self):
+        if self.best is None or self.ceiling - self.best <= self.resolution:
+            self.done = True
+            return
+        step = (self.ceiling - self.best) / (self.points + 1)
+        self.start_round(int(self.best + step * i) for i in range(1, self.points + 1))
+
+    def probes(self):
+        """
+        Sizes to probe now: those of the current round that are not acknowledged yet.
+        """
+        return sorted(self.pending)
+
+    def on_ack(self, size, receiver_max):
+        if receiver_max < self.ceiling:
+            self.ceiling = receiver_max + 1
+            self.pending = {pending for pending in self.pending if pending <= receiver_max}
+        self.receiver_max = receiver_max
+        if size >= self.ceiling or (self.best is not None and size <= self.best):
+            return
+        self.best = size
+        # Smaller sizes tell nothing more
+        self.pending = {pending for pending in self.pending if pending > size}
+        if not self.pending:
+            self.next_round()
+
+    def on_failure(self, size):
+        """
+        A probe of size could not be sent, e.g. it is larger than the MTU of the local interface.
+        """
+        if size in self.pending:
+            self.ceiling = min(self.ceiling, size)
+            self.pending = {pending for pending in self.pending if pending < size}
+            if not self.pending:
+                self.next_round()
+
+    def on_timeout(self):
+        self.attempts += 1
+        if self.attempts < self.max_probes:
+            return
+        # The sizes that are still not acknowledged are too large
+        self.ceiling = min(self.ceiling, min(self.pending))
+        self.pending = set()
+        self.next_round()
+
+
+def discover(sock, address, checksum=CRC32, min_size=BASE_DATAGRAM_SIZE, max_size=JUMBO_DATAGRAM_SIZE, timeout=0.2):
+    """
+    Find the largest datagram that reaches the receiver.
+
+    The probes are sent from sock, with the don't-fragment bit set for the duration of the
+    search, and their ACKs are received on it. Other datagrams arriving on sock are discarded.
+
+    Args:
+        sock (socket.socket): UDP socket the data packets will be sent from, in blocking mode.
+        address (tuple): Address of the receiver.
+        checksum (Checksum): Integrity algorithm of the probes.
+        min_size (int): Smallest datagram size searched.
+        max_size (int): Largest datagram size searched.
+        timeout (float): Seconds to wait for the ACKs of the first probes, later probes wait for three RTTs.
+
+    Returns:
+        int: The largest datagram size, None if the search is not supported on the platform or
+        the receiver acknowledged no probe.
+    """
+    if not PROBING_SUPPORTED:
+        return None
+    previous = sock.getsockopt(socket.IPPROTO_IP, IP_MTU_DISCOVER)
+    sock.setsockopt(socket.IPPROTO_IP, IP_MTU_DISCOVER, IP_PMTUDISC_PROBE)
+    encoder = PacketEncoder(checksum)
+    search = PathMtuSearch(min_size, max_size)
+    try:
+        while not search.done:
+            attempt = (search.round, search.attempts)
+            for size in search.probes():
+                try:
+                    encoder.send_probe(sock, address, size)
+                except OSError as e:
+                    # Other errors, e.g. an ICMP error of an earlier probe, count as a lost probe
+                    if e.errno == errno.EMSGSIZE:
+                        search.on_failure(size)
+            if (search.round, search.attempts) != attempt:
+                continue # A size that could not be sent ended the round
+            deadline = time.monotonic() + timeout
+            # Wait until the round or the attempt is over
+            while not search.done and (search.round, search.attempts) == attempt:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not select.select([sock], [], [], remaining)[0]:
+                    search.on_timeout()
+                    break
+                try:
+                    packet = sock.recv(MAX_DATAGRAM_SIZE)
+                except OSError:
+                    continue # ICMP error of an earlier probe
+                valid, echoTime, size, receiverMax = decode_probe_ack(packet)
+                if valid:
+                    timeout = max(3 * (time.time() - echoTime), 0.05)
+                    search.on_ack(size, receiverMax)
+    finally:
+        sock.setsockopt(socket.IPPROTO_IP, IP_MTU_DISCOVER, previous)
+    return search.result
+
+
+def answer_probe(encoder, sock, address, packet, max_size=MAX_DATAGRAM_SIZE, verified=False):
+    """
+    Acknowledge a path MTU probe on the receiver.
+
+    Args:
+        encoder (PacketEncoder): Encoder of the ACKs, switched to the checksum of the probe.
+        sock (socket.socket): UDP socket the ACKs are sent from.
+        address (tuple): Address the probe came from.
+        packet (bytes-like): The probe.
+        max_size (int): Largest datagram the receiver accepts.
+        verified (bool): The checksum was verified already, see madpCodec.verify_data.
+
+    Returns:
+        bool: False if the probe was corrupted or truncated.
+    """
+    valid, checksum, sendTime, size = decode_probe(packet, verified)
+    if not valid:
+        return False
+    if encoder.checksum is not checksum:
+        encoder.use(checksum)
+    encoder.send_probe_ack(sock, address, sendTime, size, max_size)
+    return True
+
+
+def discover_chunk_size(receiver_address, checksum=CRC32, default=1400, min_size=BASE_DATAGRAM_SIZE,
+                        max_size=JUMBO_DATAGRAM_SIZE):
+    """
+    Run path MTU discovery from a socket of its own and derive the chunk size of a transfer.
+
+    Args:
+        receiver_address (tuple): Address of the receiver.
+        default (int): Chunk size if the search fails.
+
+    Returns:
+        int: The chunk size.
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        size = discover(sock, receiver_address, checksum, min_size, max_size)
+    finally:
+        sock.close()
+    return default if size is None else chunk_size(size, checksum)
+
+
+def chunk_size(datagram_size, checksum=CRC32):
+    """
+    Largest chunk whose data packet, and the repair packets protecting it, fit datagram_size
+    bytes with the given checksum. A repair carries the chunk fields in front of the chunk.
+    """
+    return datagram_size - max(DATA_FIELDS.size, REPAIR_FIELDS.size + SYMBOL_HEADER.size) - checksum.size
@@ -1,162 +1,199 @@
-import hashlib
+import os
+import shutil
 import socket
-import struct
 import threading
 import time
-from utils import FileReassembler
+from madpCodec import MAX_DATAGRAM_SIZE, DatagramReceiver, PacketEncoder, decode_handshake, is_handshake, is_probe
+from madpConnection import ReceiverConnection
+from madpHandshake import ACCEPT, HELLO, HandshakeAcceptor, load_key
+from madpIntegrity import get_checksum
+from madpPipeline import BatchVerifier, DiskWriter
+from madpPmtu import answer_probe
+from utils import StreamingReassembler
 
-PACKET_SIZE = 1434
+# Chunk size until the manifest of the transfer tells the one of the sender, which sizes its chunks
+# with path MTU discovery. The chunks are written to the output files at chunk_number * chunk size.
+CHUNK_SIZE = 1400
+# Largest datagram received. It is advertised in the ACKs of the path MTU probes of the sender,
+# which never sends a larger packet, so no packet is truncated whatever chunk size the sender picks.
+PACKET_SIZE = MAX_DATAGRAM_SIZE
+# Handshake: the sender proposes the parameters of the transfer and the receiver grants a window of at
+# most WINDOW packets, the capacity of its reorder buffer, and picks the checksum, the preference of the
+# sender if it is in CHECKSUM_ALGORITHMS, else the first one of them the sender offers. Transfers larger
+# than the free space of OUTPUT_FOLDER are refused. The resumption tokens that let a returning sender send
+# data in its first flight are authenticated with the key in TOKEN_KEY_FILE, created on first use.
+WINDOW = 65536
+CHECKSUM_ALGORITHMS = ['crc32', 'adler32', 'blake2b', 'md5']
+TOKEN_KEY_FILE = os.path.expanduser('~/.madp/token_key')
+# The received files are written under this folder, at the paths of the manifest
+OUTPUT_FOLDER = 'received'
+# Receive pipeline: the receive thread hands every batch to VERIFY_THREADS threads that verify the
+# checksums, with at most VERIFY_BATCHES batches in verification, and the chunks go to a disk thread
+# through a queue of at most DISK_QUEUE chunks. While the queue is full, packets are dropped unacknowledged.
+VERIFY_THREADS = 2
+VERIFY_BATCHES = 8
+DISK_QUEUE = 8192
+# How long the receive thread waits for datagrams while batches are being verified
+VERIFY_POLL = 0.0005
 
 if __name__ == "__main__":
     # IP and port of the receiver
     madpReceiverAddr = ('', 65432)
     outgoingSocket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
     outgoingSocket.bind(madpReceiverAddr)
-    serverAddress = ('172.17.0.3', 65433) # 172.17.0.2
+    # The sender tells the port it receives ACKs on in its HELLO, at the host the HELLO comes from
+    serverAddress = None
     AckSocket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    expectedSeqNum = 0  # Expected sequence number of the next packet
-    buffer = {} # Dictionary to hold out of order packets
+    # Receives the data packets in batches, with UDP GRO where the platform supports it
+    datagramReceiver = DatagramReceiver(outgoingSocket, PACKET_SIZE)
+
+    # The receive pipeline. Checksums are verified on a thread pool, and the chunks are written
+    # to disk on a thread of their own, so the receive thread never waits on hashing or disk I/O.
+    verifier = BatchVerifier(VERIFY_THREADS, VERIFY_BATCHES)
+    diskWriter = DiskWriter(StreamingReassembler(CHUNK_SIZE, OUTPUT_FOLDER), DISK_QUEUE)
+
+    # The connection holds the protocol state: the expected sequence number, the buffer of
+    # out of order packets and its SACK ranges. It decodes the manifest that comes first, and the
+    # chunks it delivers are queued to the disk writer, whose reassembler writes every chunk straight
+    # to its offset in the file of the manifest. It is opened by the HELLO of the sender, with the
+    # parameters the acceptor granted, and the packets that come before are dropped.
+    connection = None
+    os.makedirs(OUTPUT_FOLDER, exist_ok=True)
+    acceptor = HandshakeAcceptor(load_key(TOKEN_KEY_FILE), PACKET_SIZE, WINDOW,
+                                 [get_checksum(name) for name in CHECKSUM_ALGORITHMS],
+                                 shutil.disk_usage(OUTPUT_FOLDER).free)
+    helloReply = None # (connection id of the HELLO, address, checksum, send_handshake arguments) of the ACCEPT
+
+    # Encoder with a reusable buffer for the ACK packets
+    ackEncoder = PacketEncoder()
 
-    # File reassembler object serves for hashing and reconstructing the file 
-    # from the chunks and the file ids.
-    fileReassembler = FileReassembler()
     timeStart = None
     timeEnd = None
     started = False
 
-    totalChunks = -2
+    def sendAck(ack):
+        # ACKs are protected with the algorithm the sender picked
+        if ackEncoder.checksum is not connection.checksum:
+            ackEncoder.use(connection.checksum)
+        ackEncoder.send_ack(AckSocket, serverAddress, *ack)
+        #print("Sent ACK for packet : ", ack[1])
 
-    def advanceBuffer(seqNum):
-        global expectedSeqNum, buffer, fileReassembler
-        # If our buffer is empty we do not take action and simply return the seqNum
-        # as this seqNum will already have incremented.
-        if buffer == {}:
-            # #print("Buffer empty")
-            return seqNum
-        else:
-            #print("Buffer ", seqNum, " --->", end=" ")
-            while True:
-                # If our expected seqNum is in the buffer we deliver it to the file reassembler
-                # and remove it from the buffer. Then we increment the seqNum and continue.
-                # This is done until we reach a seqNum that is not in the buffer.
-                # This increment is linear even though buffer is hashed. We are gaining time
-                # by not iterating a list.
-                # Also the argument of this function is the incremented seqNum meaning it is the expected one.
-                if seqNum in buffer:
-                    fileReassembler.add_chunk(*buffer[seqNum])
-                    del buffer[seqNum]
-                    seqNum += 1
-                else:
-                    break
-            #print(seqNum)
-            return seqNum # After advancing the buffer we return the new seqNum, namely, the expected one
+    def sendHandshake(address, checksum, reply, echoTime):
+        if ackEncoder.checksum is not checksum:
+            ackEncoder.use(checksum)
+        ackEncoder.send_handshake(AckSocket, address, *reply, echo_time=echoTime)
+
+    def handleHello(packet, source):
+        """
+        Answers the HELLO of a sender. The first one that is accepted opens the connection, a repeated
+        HELLO gets the same ACCEPT again, and any other sender is rejected as busy.
+        """
+        global connection, serverAddress, helloReply
+        valid, checksum, sendTime, kind, helloId, payload = decode_handshake(packet, verified=True)
+        if not valid or kind != HELLO:
+            return
+        if helloReply is not None and helloReply[0] == helloId: # The ACCEPT was lost
+            sendHandshake(*helloReply[1:], sendTime)
+            return
+        kind, connectionId, reply, hello, accept = acceptor.on_hello(
+            checksum, helloId, payload, source[0], 0 if connection is not None else None)
+        if kind is None:
+            return
+        address = (source[0], hello.ack_port)
+        if kind == ACCEPT:
+            checksum = accept.checksum
+            connection = ReceiverConnection(hello.initial_seq_num, diskWriter, accept.window, hello.total_chunks,
+                                            connectionId, checksum)
+            serverAddress = address
+            helloReply = (helloId, address, checksum, (kind, connectionId, reply))
+        sendHandshake(address, checksum, (kind, connectionId, reply), sendTime)
 
+    def handleVerified(results):
+        for receivedPacket, valid, source in results:
+            if not valid: # Corrupted
+                continue
+            if is_probe(receivedPacket): # Path MTU discovery of the sender, before the transfer
+                answer_probe(ackEncoder, AckSocket, source, receivedPacket, PACKET_SIZE, verified=True)
+                continue
+            if is_handshake(receivedPacket):
+                handleHello(receivedPacket, source)
+                continue
+            if connection is None: # Before the handshake
+                continue
+            if diskWriter.full(): # Dropped without an ACK, the sender retransmits it
+                continue
+            ack = connection.on_data(receivedPacket, verified=True)
+            if ack is None: # Held back
+                continue
+            sendAck(ack)
 
     def madpReceiverMain():
         """
         This function handles the reception and processing of UDP packets.
         
-        The function continuously receives packets and performs the following steps:
-        1. Checks if the expected sequence number matches the termination sequence number (7230).
-        2. If the sequence number matches, it calculates the time taken to receive all packets and sends an acknowledgment to the server.
-        3. If the sequence number doesn't match, it checks the integrity of the received packet and adds it to the file reassembler.
-        4. If the received sequence number is greater than the expected sequence number, it sends an acknowledgment for the last received packet and adds the new packet to the buffer.
-        5. If the received sequence number is less than the expected sequence number, it continues to the next iteration.
+        The function continuously receives batches of packets, hands every batch to the verifier thread pool
+        and takes the verified batches back in order. It performs the following steps for each packet:
+        1. Checks if the number of delivered chunks matches the total number of chunks. If so, it sends the
+           empty termination packet to the sender, waits for the disk writer and records the end time.
+        2. Drops the packet if it is corrupted, or if the queue of the disk writer is full. Path MTU probes are
+           answered, and the HELLO of the sender opens the connection; data packets before it are dropped.
+        3. If the sequence number matches the expected one, the connection delivers it and the buffered packets
+           behind it to the disk writer, which writes them with the file reassembler on its own thread.
+        4. If the received sequence number is greater than the expected sequence number, the connection buffers it.
+        5. An acknowledgment for the last in order packet is sent, with SACK blocks of the buffer. In order packets
+           are acknowledged with delayed ACKs as the sender asks in the packet headers, so the connection may hold the
+           ACK back; the receive then waits at most until the held ACK is due and sends it. While batches are
+           being verified it waits at most VERIFY_POLL, and it only waits for the verifier when VERIFY_BATCHES
+           batches are in verification.
         6. The function also handles keyboard interrupts by sending an empty acknowledgment packet and breaking the loop.
         
         Global Variables:
-        - expectedSeqNum: Represents the expected sequence number of the next packet.
+        - connection: The protocol state of the transfer, None until the handshake.
+        - verifier: The verification stage.
+        - diskWriter: The reassembly and disk I/O stage.
         - started: Indicates whether the reception has started or not.
         - timeStart: Stores the start time of the reception.
         - timeEnd: Stores the end time of the reception.
-        - fileReassembler: An object used to reassemble the received packets into a file.
         """
-        global expectedSeqNum, started, timeStart, timeEnd, fileReassembler, totalChunks
+        global started, timeStart, timeEnd
         while True:
             try:
-                if expectedSeqNum  == totalChunks:
-                    timeEnd = time.time()
+                if connection is not None and connection.complete:
                     AckSocket.sendto(b'', serverAddress)
+                    diskWriter.close() # Every chunk is on disk
+                    timeEnd = time.time()
                     break
-                receivedPacket, _ = outgoingSocket.recvfrom(PACKET_SIZE)
-                if not started:
-                    started = True
-                    timeStart = time.time()
-                if receivedPacket == "" or receivedPacket == None:
-                    break
-                # #print("Network probed")
-
-                # Below code serves for header unpacking and checksum calculation
-                checkSum = struct.unpack('!16s', receivedPacket[0:16])[0]
-                packedTime = struct.unpack('!d', receivedPacket[16:24])[0]
-                packedSeqNum = struct.unpack('!H', receivedPacket[24:26])[0]
-                packedFileId = struct.unpack('!H', receivedPacket[26:28])[0]
-                packedChunkNum = struct.unpack('!H', receivedPacket[28:30])[0]
-                packedTotalChunks = struct.unpack('!H', receivedPacket[30:32])[0]
-                isLastChunk = struct.unpack('!?', receivedPacket[32:33])[0]
-                isLarge = struct.unpack('!?', receivedPacket[33:34])[0]
-                #print("Received packet : ", packedSeqNum, packedFileId, packedChunkNum, isLastChunk, isLarge)
-                packet = receivedPacket[34:]
-                calculatedCheckSum = hashlib.md5(packet).digest()
-                #print("Expected seq num : ", expectedSeqNum)
-                #print ("Received seq num : ", packedSeqNum)
-                # #print("Received checksum : ", checkSum)
-                # #print("Calculated checksum : ", calculatedCheckSum)
-                totalChunks = packedTotalChunks
-                # If the received packet is the expected one we check the checksum and add it to the file reassembler
-                # Also we directly deliver it only if we have the expected packet.
-                if packedSeqNum == expectedSeqNum: # If the received packet is the expected one
-                    if checkSum == calculatedCheckSum:
-                        # Directly deliver
-                        fileReassembler.add_chunk(packedFileId, packedChunkNum, packet, isLastChunk, isLarge)
-                        expectedSeqNum += 1
-
-                        # Advance buffer and acknowledge the expected - 1
-                        expectedSeqNum = advanceBuffer(expectedSeqNum)
-                        acknowledgementPacket =  struct.pack('!d', packedTime) + struct.pack('!H', expectedSeqNum-1)
-                        ackCheckSum = hashlib.md5(struct.pack('!H', expectedSeqNum-1)).digest()
-                        ackCheckSum = struct.pack('!16s', ackCheckSum)
-                        acknowledgementPacket = ackCheckSum + acknowledgementPacket
-                        AckSocket.sendto(acknowledgementPacket, serverAddress)
-                        #print("Sent ACK for packet : ", expectedSeqNum-1)
-                        #print("Expected seq num : ", expectedSeqNum)
-
-
-                # If the received packet is not the expected one we add it to the buffer so that sender don't
-                # send it again. Also we send ACK for the last received packet. By doing this we are not losing
-                # any packets. In the meanwhile we tell sender to send the expected packet by triggering Fast Retransmit.
-                elif packedSeqNum > expectedSeqNum:
-                    #print("----------------------")
-                    #print("\tPacked seq num : ", packedSeqNum)
-                    #print("\tExpected seq num : ", expectedSeqNum)
-                    # #print("Packed Checksum : ", checkSum)
-                    # #print("Calculated checksum : ", calculatedCheckSum)
-                    #print("\tPacket buffered : ", packedSeqNum)
-                    #print("----------------------")
-                    # Instead of dropping packet we send ACK for the last received packet and add new packet to the buffer
-                    if max(expectedSeqNum-1, 0) > 0:
-                        acknowledgementPacket =  struct.pack('!d', packedTime) + struct.pack('!H', max(expectedSeqNum-1, 0))
-                        ackCheckSum = hashlib.md5(struct.pack('!H', max(expectedSeqNum-1,0))).digest()
-                        ackCheckSum = struct.pack('!16s', ackCheckSum)
-                        acknowledgementPacket = ackCheckSum + acknowledgementPacket
-                        AckSocket.sendto(acknowledgementPacket, serverAddress)
-                        #print("Sent ACK for packet : ", max(expectedSeqNum-1, 0))
-                    if packedSeqNum not in buffer: # If the packet is not in the buffer we add it
-                        buffer[packedSeqNum] = (packedFileId, packedChunkNum, packet, isLastChunk, isLarge)
-                else:
-                    # If the received packet is less than the expected one we simply continue
-                    # This is an optimization to not to process the packets that we already processed
-                    continue        
+                # A held ACK and the batches in verification limit how long the receive may block
+                timeout = None
+                if connection is not None and connection.pending_ack is not None:
+                    timeout = max(connection.ack_deadline - time.monotonic(), 0)
+                if len(verifier):
+                    timeout = VERIFY_POLL if timeout is None else min(timeout, VERIFY_POLL)
+                # Every datagram that is already queued is received before the next blocking receive
+                batch = datagramReceiver.receive(timeout)
+                if batch:
+                    if not started:
+                        started = True
+                        timeStart = time.time()
+                    # #print("Network probed")
+                    if verifier.full():
+                        handleVerified(verifier.completed(wait=True))
+                    verifier.submit(batch, datagramReceiver.sources)
+                handleVerified(verifier.completed())
+                if (connection is not None and connection.pending_ack is not None
+                        and time.monotonic() >= connection.ack_deadline):
+                    sendAck(connection.take_ack())
 
             except KeyboardInterrupt:
-                AckSocket.sendto(b'', serverAddress)
                 break
         # Termination
-        AckSocket.sendto(b'', serverAddress)                  
+        if serverAddress is not None:
+            AckSocket.sendto(b'', serverAddress)                  
     
     
 
     madpReceiverMain()
+    verifier.close()
 
     print("-----------------------")
     print("Total Time: ", timeEnd - timeStart)
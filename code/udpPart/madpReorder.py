@@ -0,0 +1,94 @@
+class ReorderBuffer:
+    """
+    Fixed capacity ring that holds out of order packets until the gap before them is filled.
+
+    A packet with the unbounded sequence counter seq lives in slot seq % capacity.
+    The fields of the packets are kept in preallocated parallel slots instead of a
+    tuple per packet, and a presence bitmap tells which slots are occupied. The
+    payloads are memoryviews into the receive buffers of DatagramReceiver, so
+    buffering a packet copies nothing.
+
+    Draining finds the run of present slots after the delivered counter with a
+    bitmap search and delivers it in a single pass. A slot put without a payload
+    only keeps the place of a packet that was already delivered, and is released
+    without being delivered again.
+    """
+    def __init__(self, capacity=65536):
+        """
+        Args:
+            capacity (int): Number of slots, the furthest a packet may be ahead of the
+                next expected one. Packets further ahead are not buffered.
+        """
+        self.capacity = capacity
+        self.present = bytearray(capacity)
+        self.file_ids = [0] * capacity
+        self.chunk_nums = [0] * capacity
+        self.payloads = [None] * capacity
+        self.chunk_flags = bytearray(capacity)
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, seq):
+        return self.present[seq % self.capacity] == 1
+
+    def put(self, seq, file_id, chunk_num, payload, flags):
+        """
+        Buffer a packet.
+
+        Args:
+            seq (int): Unbounded sequence counter of the packet, less than capacity
+                ahead of the next expected packet.
+            payload (bytes-like): The chunk data, None if the packet was already delivered.
+            flags (int): Chunk flags of the packet, see madpCodec.
+
+        Returns:
+            bool: False if the packet was already buffered.
+        """
+        i = seq % self.capacity
+        if self.present[i]:
+            return False
+        self.present[i] = 1
+        self.file_ids[i] = file_id
+        self.chunk_nums[i] = chunk_num
+        self.payloads[i] = payload
+        self.chunk_flags[i] = flags
+        self.count += 1
+        return True
+
+    def drain(self, seq, deliver):
+        """
+        Deliver the buffered packets that follow seq without a gap.
+
+        Args:
+            seq (int): Unbounded sequence counter of the next expected packet.
+            deliver (callable): Called as deliver(file_id, chunk_num, payload, flags)
+                for each packet with a payload, in order.
+
+        Returns:
+            int: Number of slots released, the packets delivered earlier included.
+        """
+        if not self.count:
+            return 0
+        capacity = self.capacity
+        start = seq % capacity
+        # End of the run of present slots, wrapping around the end of the ring at most once
+        end = self.present.find(0, start)
+        if end == -1:
+            wrapped = self.present.find(0, 0, start)
+            end = capacity + (start if wrapped == -1 else wrapped)
+        delivered = 0
+        for i in range(start, end):
+            j = i % capacity
+            payload = self.payloads[j]
+            if payload is not None:
+                deliver(self.file_ids[j], self.chunk_nums[j], payload, self.chunk_flags[j])
+            delivered += 1
+        # Release the slots of the run
+        for a, b in ((start, min(end, capacity)), (0, max(end - capacity, 0))):
+            if a < b:
+                self.present[a:b] = bytes(b - a)
+                self.payloads[a:b] = [None] * (b - a)
+        self.count -= delivered
+        return delivered
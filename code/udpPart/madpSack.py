@@ -0,0 +1,234 @@
+from bisect import bisect_right
+from collections import deque
+
+# Upper bound of SACK blocks carried by one ACK
+MAX_SACK_BLOCKS = 32
+
+
+class SackRanges:
+    """
+    Receiver side record of the out of order packets held in the buffer.
+
+    The packets are kept as sorted, disjoint [start, end) ranges of unbounded
+    sequence counters, which is exactly what the SACK blocks of an ACK report.
+    Adding a packet merges it with its neighbours, so the number of ranges is the
+    number of holes in the buffer, not the number of buffered packets.
+    """
+    def __init__(self):
+        self.starts = []
+        self.ends = []
+
+    def __len__(self):
+        return len(self.starts)
+
+    def add(self, seq):
+        """
+        Record a buffered packet.
+
+        Args:
+            seq (int): Unbounded sequence counter of the packet.
+        """
+        starts, ends = self.starts, self.ends
+        i = bisect_right(starts, seq) - 1
+        if i >= 0 and seq < ends[i]:
+            return # Already recorded
+        joinsLeft = i >= 0 and ends[i] == seq
+        joinsRight = i + 1 < len(starts) and starts[i + 1] == seq + 1
+        if joinsLeft and joinsRight:
+            ends[i] = ends[i + 1]
+            del starts[i + 1], ends[i + 1]
+        elif joinsLeft:
+            ends[i] = seq + 1
+        elif joinsRight:
+            starts[i + 1] = seq
+        else:
+            starts.insert(i + 1, seq)
+            ends.insert(i + 1, seq + 1)
+
+    def discard_below(self, seq):
+        """
+        Forget everything below seq, i.e. the packets that have been delivered.
+        """
+        starts, ends = self.starts, self.ends
+        while starts and ends[0] <= seq:
+            del starts[0], ends[0]
+        if starts and starts[0] < seq:
+            starts[0] = seq
+
+    def blocks(self, recent=None, limit=MAX_SACK_BLOCKS):
+        """
+        Select the ranges to report in an ACK.
+
+        As in RFC 2018, the range holding the most recently received packet goes
+        first so that the sender learns about every range over successive ACKs,
+        followed by the lowest ranges, which describe the holes the sender should
+        fill first.
+
+        Args:
+            recent (int): Sequence counter of the packet that triggered the ACK.
+            limit (int): Maximum number of ranges.
+
+        Returns:
+            list: (start, end) tuples.
+        """
+        starts, ends = self.starts, self.ends
+        first = None
+        if recent is not None:
+            i = bisect_right(starts, recent) - 1
+            if i >= 0 and recent < ends[i]:
+                first = i
+        blocks = [] if first is None else [(starts[first], ends[first])]
+        for i in range(min(len(starts), limit)):
+            if len(blocks) == limit:
+                break
+            if i != first:
+                blocks.append((starts[i], ends[i]))
+        return blocks
+
+
+class Scoreboard:
+    """
+    Sender side record of which packets the receiver reported in SACK blocks.
+
+    Packets are indexed by the unbounded sequence counters of the sender. The
+    scoreboard answers which packets between the base and the highest SACKed
+    packet are still missing, so only those holes are retransmitted. It also
+    counts the SACKed packets above the base, which are no longer in flight.
+
+    As in RFC 6675, a hole is considered lost once DUP_THRESH packets above it
+    have been SACKed. With fewer packets outstanding the threshold is lowered so
+    that small windows recover without a timeout (early retransmit, RFC 5827).
+    A retransmission is considered lost again once that many packets sent after
+    it have been SACKed while it is still missing.
+    """
+    DUP_THRESH = 3
+
+    def __init__(self, total_packets):
+        self.sacked = bytearray(total_packets)
+        self.highest_sacked = 0
+        self.base = 0
+        self.sacked_in_window = 0
+        self.next_hole = 0 # Holes below this were already declared lost
+        self.retransmissions = deque() # (packets sent when it was declared lost, seq) in declaration order
+
+    def advance(self, base):
+        """
+        Move the base after a cumulative ACK.
+
+        Args:
+            base (int): The new base.
+
+        Returns:
+            int: Number of packets acknowledged by the move that were not SACKed before.
+        """
+        if base <= self.base:
+            return 0
+        alreadySacked = self.sacked.count(1, self.base, base)
+        self.sacked_in_window -= alreadySacked
+        acked = base - self.base - alreadySacked
+        self.base = base
+        return acked
+
+    def mark(self, start, end):
+        """
+        Record a SACK block.
+
+        Args:
+            start (int): First SACKed packet.
+            end (int): One past the last SACKed packet.
+
+        Returns:
+            int: Number of packets that were not SACKed before.
+        """
+        start = max(start, self.base)
+        end = min(end, len(self.sacked))
+        if start >= end:
+            return 0
+        newly = end - start - self.sacked.count(1, start, end)
+        self.sacked[start:end] = b'\x01' * (end - start)
+        self.sacked_in_window += newly
+        if end > self.highest_sacked:
+            self.highest_sacked = end
+        return newly
+
+    def is_sacked(self, seq):
+        return self.sacked[seq] == 1
+
+    def lost(self, sent, fast_retransmit=False):
+        """
+        Packets that became lost since the last call.
+
+        Every hole is returned once, and again only if its retransmission is
+        lost as well, so this can be called on every ACK.
+
+        Args:
+            sent (int): Sequence counter of the next new packet.
+            fast_retransmit (bool): Declare the base lost even without SACK information,
+                used after three duplicate ACKs.
+
+        Returns:
+            list: Sequence counters of the packets to retransmit.
+        """
+        sacked = self.sacked
+        holes = []
+        threshold = max(min(self.DUP_THRESH, sent - self.base - 1), 1)
+        # Every packet below end has at least threshold SACKed packets above it
+        end = self.lost_bound(threshold)
+        # Retransmissions overtaken by enough SACKed packets sent after them
+        retransmissions = self.retransmissions
+        while retransmissions and retransmissions[0][0] <= end:
+            _, seq = retransmissions.popleft()
+            if seq >= self.base and not sacked[seq]:
+                holes.append(seq)
+        if fast_retransmit and self.base < sent:
+            end = max(end, self.base + 1)
+        seq = sacked.find(0, max(self.base, self.next_hole), max(end, 0))
+        while seq != -1:
+            holes.append(seq)
+            seq = sacked.find(0, seq + 1, end)
+        self.next_hole = max(self.next_hole, end)
+        for seq in holes:
+            retransmissions.append((sent, seq))
+        return holes
+
+    def lost_bound(self, threshold):
+        """
+        The threshold-th highest SACKed packet, the base if fewer packets are SACKed.
+        """
+        seq = self.highest_sacked
+        for _ in range(threshold):
+            seq = self.sacked.rfind(1, self.base, seq)
+            if seq == -1:
+                return self.base
+        return seq
+
+    def last_hole(self, sent):
+        """
+        Highest packet in [base, sent) that was not SACKed, -1 if there is none.
+        """
+        end = min(sent, len(self.sacked))
+        return self.sacked.rfind(0, self.base, end) if self.base < end else -1
+
+    def holes(self, sent):
+        """
+        All packets in [base, sent) that were not SACKed, used after a timeout.
+
+        A timeout means the earlier retransmissions may have been lost as well,
+        so every hole is declared lost again.
+
+        Args:
+            sent (int): Sequence counter of the next new packet.
+
+        Returns:
+            list: Sequence counters of the packets to retransmit.
+        """
+        sacked = self.sacked
+        end = min(sent, len(sacked))
+        holes = []
+        seq = sacked.find(0, self.base, end) if self.base < end else -1
+        while seq != -1:
+            holes.append(seq)
+            seq = sacked.find(0, seq + 1, end)
+        self.next_hole = max(self.next_hole, end)
+        self.retransmissions = deque((sent, seq) for seq in holes)
+        return holes
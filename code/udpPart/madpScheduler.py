@@ -0,0 +1,287 @@
+import heapq
+from collections import deque
+
+
+class PendingFile:
+    """
+    A file whose chunks are not all sent yet: the chunks first..end of the chunk list,
+    of which next is the next one to send.
+    """
+    __slots__ = ('file_id', 'next', 'end', 'priority', 'deadline', 'order')
+
+    def __init__(self, file_id, first, count, priority, deadline, order):
+        self.file_id = file_id
+        self.next = first
+        self.end = first + count
+        self.priority = priority
+        self.deadline = deadline
+        self.order = order
+
+    @property
+    def remaining(self):
+        return self.end - self.next
+
+
+class Scheduler:
+    """
+    Interface of the transmission schedulers of the MADP sender.
+
+    The sender asks the scheduler for the chunk to send with every new sequence
+    number, retransmissions resend the chunk their sequence number was given. The
+    chunks of a file are contiguous in the chunk list and are sent in file order,
+    the scheduler only decides which file the next chunk is taken from.
+
+    Files added as urgent, e.g. the manifest, are sent first in the order they were
+    added, before the policy is asked. The priority and deadline of a file may be
+    changed while it is being sent with set_priority.
+
+    Subclasses implement the policy with enqueue, select, taken, finished and reorder.
+    """
+    name = None
+
+    def __init__(self):
+        self.files = {} # file_id -> PendingFile, until every chunk of the file is taken
+        self.urgent = deque()
+        self.added = 0
+
+    def add_file(self, file_id, first, count, priority=1.0, deadline=None, urgent=False):
+        """
+        Add a file to the schedule.
+
+        Args:
+            file_id (int): Identifier of the file.
+            first (int): Index of its first chunk in the chunk list.
+            count (int): Number of chunks of the file.
+            priority (float): Relative importance, higher is sent sooner or with a larger share.
+            deadline (float): Seconds after the start of the transfer the file should be
+                complete by, None if it has none.
+            urgent (bool): Send the file before every other file.
+        """
+        pending = PendingFile(file_id, first, count, priority, deadline, self.added)
+        self.added += 1
+        if count <= 0:
+            return
+        if urgent:
+            self.urgent.append(pending)
+        else:
+            self.files[file_id] = pending
+            self.enqueue(pending)
+
+    def set_priority(self, file_id, priority=None, deadline=None):
+        """
+        Change the priority or the deadline of a file that is not sent completely yet.
+
+        Returns:
+            bool: False if the file has no chunk left to schedule.
+        """
+        pending = self.files.get(file_id)
+        if pending is None:
+            return False
+        if priority is not None:
+            pending.priority = priority
+        if deadline is not None:
+            pending.deadline = deadline
+        self.reorder()
+        return True
+
+    def __len__(self):
+        """
+        Number of files with chunks left to schedule.
+        """
+        return len(self.files) + len(self.urgent)
+
+    def next_chunk(self):
+        """
+        Take the next chunk to send.
+
+        Returns:
+            int: Index of the chunk in the chunk list, None once every chunk was taken.
+        """
+        if self.urgent:
+            pending = self.urgent[0]
+            index = pending.next
+            pending.next += 1
+            if pending.next >= pending.end:
+                self.urgent.popleft()
+            return index
+        pending = self.select()
+        if pending is None:
+            return None
+        index = pending.next
+        pending.next += 1
+        if pending.next >= pending.end:
+            del self.files[pending.file_id]
+            self.finished(pending)
+        else:
+            self.taken(pending)
+        return index
+
+    def enqueue(self, pending):
+        raise NotImplementedError
+
+    def select(self):
+        """
+        The file the next chunk is taken from, None if there is none.
+        """
+        raise NotImplementedError
+
+    def taken(self, pending):
+        """
+        A chunk of the selected file was taken and the file has chunks left.
+        """
+
+    def finished(self, pending):
+        """
+        The last chunk of the selected file was taken.
+        """
+        raise NotImplementedError
+
+    def reorder(self):
+        """
+        The priority or the deadline of a pending file changed.
+        """
+
+
+class FifoScheduler(Scheduler):
+    """
+    Sends the files one after the other, in the order they were added.
+    """
+    name = 'fifo'
+
+    def __init__(self):
+        super().__init__()
+        self.queue = deque()
+
+    def enqueue(self, pending):
+        self.queue.append(pending)
+
+    def select(self):
+        return self.queue[0] if self.queue else None
+
+    def finished(self, pending):
+        self.queue.popleft()
+
+
+class SrptScheduler(Scheduler):
+    """
+    Shortest remaining processing time first.
+
+    The file with the fewest chunks left, divided by its priority, is sent first,
+    which minimizes the mean completion time: small files are not held back behind
+    large ones. The key of the selected file only decreases while it is sent, so it
+    stays at the top of the heap and taking a chunk costs O(1).
+    """
+    name = 'srpt'
+
+    def __init__(self):
+        super().__init__()
+        self.heap = [] # [key, order, pending] entries, the key of the top one is updated in place
+
+    def key(self, pending):
+        return pending.remaining / pending.priority
+
+    def enqueue(self, pending):
+        heapq.heappush(self.heap, [self.key(pending), pending.order, pending])
+
+    def select(self):
+        return self.heap[0][2] if self.heap else None
+
+    def taken(self, pending):
+        self.heap[0][0] = self.key(pending)
+
+    def finished(self, pending):
+        heapq.heappop(self.heap)
+
+    def reorder(self):
+        for entry in self.heap:
+            entry[0] = self.key(entry[2])
+        heapq.heapify(self.heap)
+
+
+class WeightedRoundRobinScheduler(Scheduler):
+    """
+    Weighted round robin.
+
+    The files take turns, and each turn a file sends as many chunks as its priority
+    rounded to a whole number, at least one, so every file makes progress at a rate
+    proportional to its weight.
+    """
+    name = 'wrr'
+
+    def __init__(self):
+        super().__init__()
+        self.queue = deque()
+        self.credit = 0 # Chunks the file at the head of the queue may still send in its turn
+
+    def weight(self, pending):
+        return max(int(round(pending.priority)), 1)
+
+    def enqueue(self, pending):
+        self.queue.append(pending)
+
+    def select(self):
+        if not self.queue:
+            return None
+        if self.credit <= 0:
+            self.credit = self.weight(self.queue[0])
+        return self.queue[0]
+
+    def taken(self, pending):
+        self.credit -= 1
+        if self.credit <= 0:
+            self.queue.rotate(-1) # End of its turn
+
+    def finished(self, pending):
+        self.queue.popleft()
+        self.credit = 0
+
+
+class DeadlineScheduler(Scheduler):
+    """
+    Earliest deadline first.
+
+    The file with the earliest deadline is sent first, files without a deadline
+    come after those with one, in the order they were added. Deadlines only order
+    the files, a file that misses its deadline is still sent completely.
+    """
+    name = 'edf'
+
+    def __init__(self):
+        super().__init__()
+        self.heap = [] # (deadline, order, pending) entries
+
+    def key(self, pending):
+        return float('inf') if pending.deadline is None else pending.deadline
+
+    def enqueue(self, pending):
+        heapq.heappush(self.heap, (self.key(pending), pending.order, pending))
+
+    def select(self):
+        return self.heap[0][2] if self.heap else None
+
+    def finished(self, pending):
+        heapq.heappop(self.heap)
+
+    def reorder(self):
+        self.heap = [(self.key(entry[2]), entry[1], entry[2]) for entry in self.heap]
+        heapq.heapify(self.heap)
+
+
+SCHEDULERS = {scheduler.name: scheduler for scheduler in (FifoScheduler, SrptScheduler, WeightedRoundRobinScheduler, DeadlineScheduler)}
+
+
+def get_scheduler(name):
+    """
+    Create a transmission scheduler by name.
+
+    Args:
+        name (str): 'fifo', 'srpt', 'wrr' or 'edf'.
+
+    Returns:
+        Scheduler: The scheduler.
+    """
+    try:
+        scheduler = SCHEDULERS[name]
+    except KeyError:
+        raise ValueError(f"Unknown scheduler {name!r}, expected one of {sorted(SCHEDULERS)}") from None
+    return scheduler()
@@ -1,214 +1,247 @@
-import hashlib
+import os
 import socket
-import struct
 import threading
 import time
-
-# Settings for file I/O
+from madpCodec import PacketEncoder
+from madpCompress import CompressedChunks
+from madpConnection import SenderConnection
+from madpFec import FecEncoder
+from madpHandshake import Hello, Session, SessionCache, new_connection_id, reject_reason
+from madpIntegrity import get_checksum
+from madpManifest import MANIFEST_FILE_ID, Manifest
+from madpPmtu import chunk_size, discover
+from madpScheduler import get_scheduler
+from madpSource import ChunkIndex
+from madpTimer import TimerWheel
+
+# Settings for file I/O. Every file under DATA_FOLDER is sent, with its path relative to it.
 DATA_FOLDER = '../app/objects' 
 PACKET_SIZE = 1400
+# Path MTU discovery: before the transfer, probes find the largest datagram between MIN_DATAGRAM_SIZE
+# and MAX_DATAGRAM_SIZE (9000 byte jumbo frames) that reaches the receiver unfragmented, and the chunks
+# are sized to fill it. PACKET_SIZE is the chunk size without discovery or when it fails.
+PMTU_DISCOVERY = True
+MIN_DATAGRAM_SIZE = 1200
+MAX_DATAGRAM_SIZE = 8972
+# Integrity algorithm of the connection: 'crc32', 'adler32', 'blake2b' or 'md5'.
+# It is the preference of the sender in the handshake, the receiver may pick another one.
+CHECKSUM_ALGORITHM = 'crc32'
+# Sequence number of the first packet on the wire, announced to the receiver in the handshake
+INITIAL_SEQ_NUM = 0
+# 0-RTT resumption: the parameters the receiver granted are cached in SESSION_CACHE with its resumption
+# token, and the next transfer to the same receiver skips path MTU discovery and sends data right
+# behind its HELLO instead of waiting for the ACCEPT.
+RESUMPTION = True
+SESSION_CACHE = os.path.expanduser('~/.madp/sessions.json')
+# Congestion controller: 'newreno' or 'cubic'
+CONGESTION_CONTROL = 'newreno'
+# Pacing rate as a multiple of the estimated delivery rate (cwnd / smoothed RTT), 0 disables pacing
+PACING_GAIN = 1.2
+# Whether retransmissions wait for the pacer. They replace packets that already left the
+# network, so by default they go out right away to shorten recovery.
+PACE_RETRANSMISSIONS = False
+# Packets handed to the kernel in one call, sent as one GSO buffer on Linux
+SEND_BATCH = 32
+# Delayed ACKs the receiver is asked for: one ACK per ACK_FREQUENCY in order packets, or
+# ACK_DELAY seconds after the first unacknowledged one. Gaps are acknowledged immediately.
+ACK_FREQUENCY = 2
+ACK_DELAY = 0.005
+# Transmission scheduler choosing the file every new chunk is taken from: 'srpt' (fewest chunks
+# left first), 'wrr' (weighted round robin), 'edf' (earliest deadline first) or 'fifo' (file by file)
+SCHEDULER = 'srpt'
+# Per file priorities and deadlines, by path relative to DATA_FOLDER. A higher priority shortens the
+# remaining size of a file for 'srpt' and is its weight for 'wrr', the default is 1. Deadlines are
+# seconds after the start of the transfer, for 'edf'.
+FILE_PRIORITIES = {}
+FILE_DEADLINES = {}
+# Forward error correction: every FEC_BLOCK_SIZE new packets are followed by repair packets from
+# which the receiver rebuilds lost packets without a retransmission. The number of repairs per
+# block follows the measured loss rate between FEC_MIN_REPAIRS (1 is XOR parity) and FEC_MAX_REPAIRS.
+FEC = False
+FEC_BLOCK_SIZE = 16
+FEC_MIN_REPAIRS = 1
+FEC_MAX_REPAIRS = 8
+# zlib level the chunks are compressed with, 1 (fastest) to 9 (smallest), 0 disables compression.
+# Every file is sampled first and files that do not compress are sent raw, as are the chunks
+# that do not shrink. With COMPRESSION_DICTIONARY the first chunk of every file is the dictionary
+# of its other chunks, which compresses small chunks much better.
+COMPRESSION_LEVEL = 0
+COMPRESSION_DICTIONARY = True
+
+
+def fec_encoder():
+    """
+    Returns:
+        FecEncoder: The FEC encoder of the settings above, None if FEC is disabled.
+    """
+    if not FEC:
+        return None
+    return FecEncoder(FEC_BLOCK_SIZE, FEC_MIN_REPAIRS, FEC_MAX_REPAIRS)
 
 
-def readData():
+def probed_chunk_size(sock, address):
     """
-    Reads the data from files and returns a dictionary containing the file names as keys and the file contents as values.
-    
+    Size the chunks with path MTU discovery, see madpPmtu.discover.
+
     Returns:
-        dict: A dictionary containing the file names as keys and the file contents as values.
+        int: The largest chunk that fits the datagrams that reach the receiver, PACKET_SIZE if
+        PMTU_DISCOVERY is off or the search failed.
     """
-    data = {}
-    for i in range(10):
-        with open(DATA_FOLDER + f'/small-{i}.obj', 'rb') as f:
-            data[f'small-{i}.obj'] = f.read()
-    for i in range(10):
-        with open(DATA_FOLDER + f'/large-{i}.obj', 'rb') as f:
-            data[f'large-{i}.obj'] = f.read()        
-    return data
-
-def chunks(data):
-    """
-    Split the data into smaller chunks for transmission.
+    if not PMTU_DISCOVERY:
+        return PACKET_SIZE
+    checksum = get_checksum(CHECKSUM_ALGORITHM)
+    datagramSize = discover(sock, address, checksum, MIN_DATAGRAM_SIZE, MAX_DATAGRAM_SIZE)
+    return PACKET_SIZE if datagramSize is None else chunk_size(datagramSize, checksum)
 
-    Args:
-        data (dict): A dictionary containing file data.
 
+def cached_session(cache, address):
+    """
     Returns:
-        tuple: A tuple containing the chunked data and the total number of chunks.
+        Session: The session of the receiver at address to resume, None without RESUMPTION.
     """
-    chunked = []
-    for i in range(10):
-        fileData = data[f'small-{i}.obj']
-        for i in range(0, len(fileData), PACKET_SIZE):
-            chunk = fileData[i:i + PACKET_SIZE]
-            chunked.append(chunk)
-        data[f'small-{i}.obj'] = chunked
-    for i in range(10):
-        fileData = data[f'large-{i}.obj']
-        for i in range(0, len(fileData), PACKET_SIZE):
-            chunk = fileData[i:i + PACKET_SIZE]
-            chunked.append(chunk)
-        data[f'large-{i}.obj'] = chunked
-    return chunked, len(chunked)
-
-def interleaved_chunks(data):
+    return cache.get(address) if RESUMPTION else None
+
+
+def new_hello(chunk_size, total_chunks, manifest, window_size, ack_port, session=None):
+    """
+    The HELLO of a transfer. With a cached session, it asks for the window the receiver granted
+    before and carries its resumption token, and the transfer uses the checksum of the session.
+
+    Args:
+        total_chunks (int): Chunks of the transfer, the manifest included.
+        manifest (Manifest): Manifest of the transfer.
+        ack_port (int): Port the ACKs arrive on.
     """
-    Interleaves the data into chunks for transmission. 1 small 1 large 1 small 1 large ...
+    size = sum(manifest.sizes)
+    if session is None:
+        return Hello(chunk_size, INITIAL_SEQ_NUM, window_size, total_chunks, ack_port, size, len(manifest))
+    return Hello(chunk_size, INITIAL_SEQ_NUM, min(window_size, session.window), total_chunks, ack_port, size,
+                 len(manifest), token=session.token)
+
+
+def mapped_chunks(chunk_size=PACKET_SIZE):
+    """
+    Builds the manifest of every file under DATA_FOLDER, maps the files into memory and
+    indexes their chunks: the encoded manifest first, under MANIFEST_FILE_ID, then the
+    files in manifest order, file id i being the i-th entry of the manifest.
+
+    No file is read into memory and no chunk is copied, the payloads are memoryviews
+    into the mappings.
+
+    The files are added to a SCHEDULER scheduler with their FILE_PRIORITIES and
+    FILE_DEADLINES, the manifest as urgent so it is always sent first.
+
+    With a COMPRESSION_LEVEL, the index is wrapped in CompressedChunks, which compresses
+    the chunks as they are sent.
 
     Args:
-        data (dict): A dictionary containing the data to be chunked.
+        chunk_size (int): Size of the chunks, carried to the receiver by the manifest.
 
     Returns:
-        tuple: A tuple containing the chunked data and the total number of chunks.
+        tuple: A tuple containing the chunks, the total number of chunks, the scheduler and the manifest.
     """
-    chunked = []
-    for j in range(10):
-        for size in ['small', 'large']:
-            tempchunked = []
-            fileData = data[f'{size}-{j}.obj']
-            file_id = j
-            is_large = size == 'large'
-            for i in range(0, len(fileData), PACKET_SIZE):
-                chunk = fileData[i:i + PACKET_SIZE]
-                chunk_num = i // PACKET_SIZE
-                tempchunked.append((file_id, chunk_num, chunk, 0, is_large)) # 0 means not last chunk
-            tempchunked[-1] = (file_id, chunk_num, chunk, 1, is_large)
-            chunked += tempchunked
-
-    return chunked, len(chunked)
+    manifest = Manifest.from_directory(DATA_FOLDER, chunk_size)
+    index = ChunkIndex(chunk_size)
+    scheduler = get_scheduler(SCHEDULER)
+    count = index.add_buffer(manifest.encode(), MANIFEST_FILE_ID)
+    scheduler.add_file(MANIFEST_FILE_ID, 0, count, urgent=True)
+    for file_id, path, size in manifest:
+        first = len(index)
+        count = index.add_file(os.path.join(DATA_FOLDER, *path.split('/')), file_id)
+        scheduler.add_file(file_id, first, count, FILE_PRIORITIES.get(path, 1.0), FILE_DEADLINES.get(path))
+    if COMPRESSION_LEVEL:
+        index = CompressedChunks(index, COMPRESSION_LEVEL, COMPRESSION_DICTIONARY)
+    return index, len(index), scheduler, manifest
 
 
 if __name__ == "__main__":
     # Define the address and port of the MADP receiver
-    madpReceiverAddr = ('172.17.0.2', 65432) # 172.17.0.3
+    madpReceiverAddr = ('172.17.0.2', 65432) # 172.17.0.3
     outgoingSocket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
     serverAddress = ('', 65433)
     receiverSocket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
     receiverSocket.bind(serverAddress)
-    # Read the data from the files
-    data = readData()
-    # Divide it into chunks
-    (chunkedData, totalChunks) = interleaved_chunks(data); # #print(totalChunks)
-
-    # Sequence number of the next packet to be sent (starts at 0)
-    # Sender starts incrementing this sequence number and sends the packet
-    # Sender window is measured between the base and the sequence number, so the window size is 1 at the beginning
-    seqNum = 0
-    base = 0
-    # This is explained in the paper and fixed to 64000 to match the TCP standard
-    # Again below, we employed flow control and congestion avoidance; however, later 
-    # we found out that fixing windowSize to 64000 is doing great and there was no
-    # significant improvement for the cases.
+    # Port the receiver sends the ACKs to, announced in the HELLO
+    ackPort = receiverSocket.getsockname()[1]
+    sessionCache = SessionCache(SESSION_CACHE)
+
+    # This is explained in the paper and fixed to 64000 to match the TCP standard.
+    # windowSize is the receiver window, the congestion controller limits the packets
+    # in flight further, so the sender never has more than min(cwnd, windowSize) in flight.
+    # The receiver may grant less in the handshake.
     windowSize = 64000
-    congestionWindowSize = 1
-    ssthresh = 64000  # Slow start threshold
 
-    # Duplicate ACK count
-    # Used for fast retransmit,
-    dupACKcount = 0
-    lastACK = 0
+    def openConnection(session):
+        """
+        Size the chunks, map the files and set up the connection with its HELLO.
 
-    # Timeout interval in seconds, initially set to 1 second
-    # By the book we calculate the timeout interval using the sampleRTT and devRTT
-    timeoutInterval = 1.0
-    estimatedRTT = timeoutInterval
-    devRTT = 0
+        With a cached session the chunks have the size the receiver accepted before and the data
+        follows the HELLO in the first flight. Otherwise path MTU discovery sizes the chunks, and
+        the data waits for the ACCEPT.
+
+        Returns:
+            tuple: The connection, its packet encoder and the chunk size.
+        """
+        chunkSize = session.chunk_size if session is not None else probed_chunk_size(outgoingSocket, madpReceiverAddr)
+        # Map the files and index their chunks behind the manifest, the payloads are read from the mappings when they are sent
+        (chunkedData, totalChunks, scheduler, manifest) = mapped_chunks(chunkSize); # #print(totalChunks)
+        hello = new_hello(chunkSize, totalChunks, manifest, windowSize, ackPort, session)
+        checksum = session.checksum if session is not None else get_checksum(CHECKSUM_ALGORITHM)
+        # The connection holds the whole protocol state: handshake, base and sequence number, scoreboard,
+        # retransmission queue, congestion controller, pacer and timeouts. The threads below
+        # only receive, send and wait, and they touch the connection under condB only.
+        connection = SenderConnection(chunkedData, checksum, INITIAL_SEQ_NUM, hello.window,
+                                      CONGESTION_CONTROL, PACING_GAIN, PACE_RETRANSMISSIONS,
+                                      ack_frequency=ACK_FREQUENCY, ack_delay=ACK_DELAY, scheduler=scheduler,
+                                      fec=fec_encoder(), hello=hello, connection_id=new_connection_id())
+        # The packet encoder owns reusable header buffers, and only the sender thread sends data.
+        # It writes the ACK policy into every header.
+        encoder = PacketEncoder(connection.checksum, connection.ack_frequency, connection.ack_delay,
+                                connection.connection_id)
+        return connection, encoder, chunkSize
 
     # Locks and conditions
     lockB = threading.Lock()
-    lockT = threading.Lock()
-    lockD = threading.Lock()
     condB = threading.Condition(lockB)
 
+    # One long-lived timer thread serves the retransmission timer. Re-arming it on an ACK
+    # only replaces the deadline of RETRANSMIT_TIMER on the wheel.
+    timerWheel = TimerWheel()
+    RETRANSMIT_TIMER = 'retransmit'
+
     def MADPAckHandler():
         """
         This function handles the acknowledgment (ACK) packets received by the sender.
 
-        It continuously listens for ACK packets from the receiver and performs the following tasks:
+        It continuously listens for ACK packets from the receiver and hands them to the connection, which:
         - Verifies the integrity of the ACK packet using checksum.
         - Updates the base sequence number if a new ACK is received.
-        - Handles duplicate ACKs and performs fast retransmit if necessary.
-        - Adjusts the congestion window size based on the received ACKs.
-        - Updates the timeout interval for retransmission based on the sample round-trip time (RTT).
+        - Records the SACK blocks of the ACK on the scoreboard.
+        - Handles duplicate ACKs and queues the lost holes for retransmission.
+        - Feeds the congestion controller with acknowledged packets, RTT samples and losses.
+        - Updates the pacing rate and the timeout interval for retransmission based on the sample round-trip time (RTT).
+        Afterwards the sender thread is woken up and the retransmission timer is re-armed.
 
         Globals used:
-        - base: The base sequence number of the packets sent.
-        - timer: The timer used for retransmission.
-        - dupACKcount: The count of duplicate ACKs received.
-        - timeoutInterval: The current timeout interval for retransmission.
-        - congestionWindowSize: The current congestion window size.
-        - ssthresh: The slow start threshold for congestion control.
+        - connection: The protocol state of the transfer.
+        - timerWheel: The timer wheel holding the retransmission deadline.
 
-        Note: This function runs in an infinite loop until termination condition is triggered.
+        Note: This function runs in an infinite loop until the receiver reports the end of the transfer.
 
         """
-        
-        global base, timer, dupACKcount, timeoutInterval, congestionWindowSize, ssthresh
         while True:
             try:
-                packet  = receiverSocket.recv(1024)
+                packet  = receiverSocket.recv(2048)
                 # ##print("Received ACK", packet)
-                if packet == b'' or packet == None:
+                with condB:
+                    valid = connection.on_ack(packet)
+                    delay = connection.retransmit_delay()
+                    condB.notify_all()
+                if connection.done: # The receiver sent the empty termination packet
                     break
-
-                # extract checksum, time, and seqNum with struct unpack
-                checkSum = struct.unpack('!16s', packet[0:16])[0]
-                packedTime = struct.unpack('!d', packet[16:24])[0]
-                packedSeqNum = struct.unpack('!H', packet[24:26])[0]
-                calculatedCheckSum = hashlib.md5(struct.pack('!H', packedSeqNum)).digest()
-
-                if checkSum == calculatedCheckSum: # Checksum is correct
-                    with lockB: # Update base
-                        #print("Received ACK for packet:", packedSeqNum,"SeqNum:",seqNum, "Base: ",base, "--->", end=" ")
-                        # If our ack is newer than base, update base. This basically means that we received an ACK for further packet
-                        # The receiver is telling us that it received the packet up to this ack and requires the ack+1 now.
-                        if packedSeqNum + 1 > base:  
-                            base = packedSeqNum + 1 # We advance our base to the ack+1
-                        # If our ack is older than base, we received a duplicate ack. We now start suspecting packet loss.
-                        # We increase the duplicate ack count and if it reaches 3, we perform fast retransmit.
-                        elif packedSeqNum + 1 <= base: 
-                            if lastACK == packedSeqNum:
-                                dupACKcount += 1
-                                
-                                if dupACKcount == 3:
-                                    base = packedSeqNum + 1
-                                    dupACKcount = 0      
-                                    ssthresh = max(congestionWindowSize // 2, 2)
-                                    congestionWindowSize = ssthresh  # Reset congestion window      
-                                    #print("Fast retransmit", base, end=" ")
-                                #print("Duplicate ACK", end=" ")
-                            else:
-                                # If the last ack is not the same as the current ack, we reset the duplicate ack count
-                                # there might be an out of order ack
-                                dupACKcount = 0
-                                #print("Out of order ACK", end=" ")
-                        # Update last ack
-                        lastACK = packedSeqNum
-                        
-                    with condB:
-                        condB.notify_all()
-
-                        #print(base)
-                    with lockT:
-                        with lockB:
-                            # Reset timer
-                            timer.cancel()
-                            sampleRTT = time.time() - packedTime
-                            timeoutInterval = calculateTimeoutInterval(sampleRTT)
-                            timer = threading.Timer(timeoutInterval, MADPRetransmitter)
-                            timer.start()
-                    
-
-                    # Adjust window size based on ACKs
-                    with lockB:
-                        if congestionWindowSize < ssthresh:
-                            # Slow start phase
-                            congestionWindowSize *= 2
-                        else:
-                            # Congestion avoidance phase
-                            congestionWindowSize += 1 / congestionWindowSize
-                else:
-                    ##print("Corrupted ACK packet")
-                    pass
+                if valid:
+                    # Reset timer
+                    timerWheel.schedule(RETRANSMIT_TIMER, delay, MADPRetransmitter)
 
             except KeyboardInterrupt:
                 ##print("Exiting MADPAckHandler")
@@ -218,67 +251,57 @@ if __name__ == "__main__":
         """
         This function handles the sending of packets in the MADP protocol.
 
-        It continuously sends packets until all chunks have been sent. It uses global variables
-        to keep track of the current state of the sender.
+        It continuously sends packets until all chunks have been acknowledged. The connection decides
+        which packets go out: retransmissions queued by the ACK handler and the retransmitter come
+        before any new data, as long as the packets in flight stay below min(cwnd, windowSize).
 
         Globals:
-        - chunkedData: A list containing the chunked data to be sent.
-        - base: The base sequence number of the sliding window.
-        - timer: The timer used for retransmission.
-        - seqNum: The current sequence number.
-        - congestionWindowSize: The congestion window size.
-        - windowSize: The size of the sliding window.
+        - connection: The protocol state of the transfer.
+        - timerWheel: The timer wheel holding the retransmission deadline.
+        - senderEncoder: Packs the headers and sends the batches.
 
         The function follows the following steps:
-        1. Check if the current sequence number is equal to the total number of chunks. If so, break the loop.
-        2. Get the current base sequence number.
-        3. If the difference between the current sequence number and the base is less than the window size:
-            - Get the file ID, chunk number, packet, flag, and is_large from the chunkedData list.
-            - Pack the current time, sequence number, file ID, chunk number, flag, is_large, and packet.
-            - Calculate the checksum of the packet.
-            - Append the checksum, packed time, sequence number, file ID, chunk number, flag, is_large, and packet together.
-            - Send the packet using the outgoingSocket.
-            - If the current base is equal to the sequence number, cancel the timer and start a new one.
-            - Increment the sequence number.
-        4. If the difference between the current sequence number and the base is greater than or equal to the window size,
-           wait for the base condition to be notified.
-        5. Handle KeyboardInterrupt by breaking the loop.
+        1. Check if all chunks are acknowledged or the receiver finished. If so, break the loop.
+        2. Take the HELLO if it is due, at the start and whenever the timer expired before the ACCEPT.
+        3. Take a batch of up to SEND_BATCH packets from the connection. Every packet takes a token
+           from the pacer, and the batch ends at the first packet that is not due yet. There is none
+           before the ACCEPT, unless the connection resumes a session.
+        4. Arm the retransmission timer if nothing was in flight before the batch or the HELLO is sent.
+        5. If there is nothing to send, wait for the base condition to be notified.
+        6. Otherwise send the HELLO, sleep until the batch is due and send it with the encoder, which packs
+           the headers and uses UDP generic segmentation offload when the platform supports it, followed by
+           the repair packets of the FEC blocks it completed. The encoder follows the checksum and the
+           connection id the receiver granted.
+        7. Handle KeyboardInterrupt by breaking the loop.
         """
-        global chunkedData, base, timer, seqNum, congestionWindowSize, windowSize, totalChunks
         while True:
             try:
-                with lockD:
-                    if seqNum == totalChunks: # All chunks are sent
+                with condB:
+                    if connection.finished: # All chunks are acknowledged
                         break
-                with lockB:
-                    tempBase = base
-                if seqNum - tempBase < windowSize:
-                    with lockD:
-                        file_id, chunk_num, packet, flag, is_large = chunkedData[seqNum]
-
-                    # pack current time, seqNum, file_id, chunk_num, flag and is_large and packet
-                    packedTime = struct.pack('!d', time.time())
-                    packedSeqNum = struct.pack('!H', seqNum)
-                    packedFileId = struct.pack('!H', file_id)
-                    packedChunkNum = struct.pack('!H', chunk_num)
-                    packedTotalChunks = struct.pack('!H', totalChunks)
-                    packedFlag = struct.pack('!?', flag)
-                    packedIsLarge = struct.pack('!?', is_large)
-                    checkSum = hashlib.md5(packet).digest()
-                    packet = checkSum + packedTime + packedSeqNum + packedFileId + packedChunkNum + packedTotalChunks + packedFlag + packedIsLarge + packet
-                    outgoingSocket.sendto(packet, madpReceiverAddr)
-
-                    if tempBase == seqNum:
-                        with lockT:
-                            timer.cancel()
-                            timer = threading.Timer(timeoutInterval, MADPRetransmitter)
-                            timer.start()
-
-                    seqNum += 1                 
-
-                else:
-                    with condB:
+                    hello = connection.take_hello()
+                    packets, delay, arm = connection.next_batch(SEND_BATCH)
+                    repairs = connection.take_repairs()
+                    if arm or hello is not None:
+                        timerWheel.schedule(RETRANSMIT_TIMER, connection.retransmit_delay(), MADPRetransmitter)
+                    if not packets and hello is None:
                         condB.wait()
+                        continue
+                    checksum, connectionId = connection.checksum, connection.connection_id
+
+                if hello is not None:
+                    senderEncoder.send_handshake(outgoingSocket, madpReceiverAddr, *hello)
+                if senderEncoder.checksum is not checksum:
+                    senderEncoder.use(checksum)
+                senderEncoder.connection_id = connectionId
+                if delay > 0:
+                    time.sleep(delay)
+
+                # Headers are packed into the encoder's buffers and sent together with the chunks
+                senderEncoder.send_data_batch(outgoingSocket, madpReceiverAddr, packets)
+                # The repair packets of the FEC blocks the batch completed follow it
+                for repair in repairs:
+                    senderEncoder.send_repair(outgoingSocket, madpReceiverAddr, *repair)
 
                 #time.sleep(0.02)        
 
@@ -291,71 +314,50 @@ if __name__ == "__main__":
         Retransmits packets that have not been acknowledged by the receiver.
         
         This function is responsible for retransmitting packets that have not been acknowledged by the receiver.
-        It uses global variables to keep track of the current state of the transmission, including the base sequence number,
-        the current sequence number, the timer, the congestion window size, and the slow start threshold.
+        The first expiry after the last progress only lets a tail loss probe out, and when the timer expires
+        again without progress the connection queues every hole that was not SACKed and reduces the
+        congestion window. It runs on the timer wheel thread, so it only wakes up the sender thread,
+        which sends the queued packets, and re-arms itself.
         
         Globals:
-            - base: The base sequence number of the transmission.
-            - seqNum: The current sequence number.
-            - timer: The timer used for retransmission.
-            - congestionWindowSize: The size of the congestion window.
-            - ssthresh: The slow start threshold.
+            - connection: The protocol state of the transfer.
+            - timerWheel: The timer wheel holding the retransmission deadline.
         
         Returns:
             None
         """
-         
-        global base, seqNum, timer, congestionWindowSize, ssthresh, totalChunks
-        
-        with lockT:
-            with lockB:
-                if base == totalChunks:
-                    return
-                tempBase = base
-            #print("Timeout for packet : ", tempBase, "interval is:", timeoutInterval)
-            #print("Retransmitting packet: ", tempBase)
-            for i in range(tempBase, seqNum):
-                try:
-                    with lockD:
-                        file_id, chunk_num, packet, flag, is_large = chunkedData[i]
-                    packedTime = struct.pack('!d', time.time())
-                    packedSeqNum = struct.pack('!H', i)
-                    packedFileId = struct.pack('!H', file_id)
-                    packedChunkNum = struct.pack('!H', chunk_num)
-                    packedTotalChunks = struct.pack('!H', totalChunks)
-                    packedFlag = struct.pack('!?', flag)
-                    packedIsLarge = struct.pack('!?', is_large)
-                    checkSum = hashlib.md5(packet).digest()
-                    packet = checkSum + packedTime + packedSeqNum + packedFileId + packedChunkNum + packedTotalChunks + packedFlag + packedIsLarge + packet
-                    outgoingSocket.sendto(packet, madpReceiverAddr)
-
-                    #time.sleep(0.02)
-                except KeyboardInterrupt:
-                    ##print("Exiting MADPRetransmitter")
-                    break
-            # Adjust congestion window and ssthresh on timeout
-            ssthresh = max(congestionWindowSize // 2, 2)
-            congestionWindowSize = 1
-            timer.cancel()
-            timer = threading.Timer(timeoutInterval, MADPRetransmitter)
-            timer.start()
-
-
-    def calculateTimeoutInterval(sampleRTT):
-        global estimatedRTT, devRTT
-        estimatedRTT = 0.875 * estimatedRTT + 0.125 * sampleRTT
-        devRTT = 0.75 * devRTT + 0.25 * abs(sampleRTT - estimatedRTT)
-        return min(estimatedRTT + 4 * devRTT, 2)
-    
-    ackThread = threading.Thread(target=MADPAckHandler)
-    ackThread.daemon = True
-    ackThread.start()
-
-    timer = threading.Timer(timeoutInterval, MADPRetransmitter)
-
-    MADPSender()
-
-    ackThread.join()
+        with condB:
+            #print("Timeout for packet : ", connection.base, "interval is:", connection.timeout_interval)
+            delay = connection.on_timer()
+            condB.notify_all()
+        if delay is not None:
+            timerWheel.schedule(RETRANSMIT_TIMER, delay, MADPRetransmitter)
+
+    session = cached_session(sessionCache, madpReceiverAddr)
+    while True:
+        connection, senderEncoder, chunkSize = openConnection(session)
+
+        ackThread = threading.Thread(target=MADPAckHandler)
+        ackThread.daemon = True
+        ackThread.start()
+
+        MADPSender()
+
+        ackThread.join()
+        timerWheel.cancel(RETRANSMIT_TIMER)
+        if connection.rejected and session is not None:
+            # The receiver no longer accepts the cached parameters, start over with a full handshake
+            sessionCache.forget(madpReceiverAddr)
+            session = None
+            continue
+        break
+
+    timerWheel.stop()
+
+    if connection.accept is not None:
+        sessionCache.store(madpReceiverAddr, Session.from_accept(chunkSize, connection.accept))
+    elif connection.rejected:
+        print("Transfer rejected by the receiver:", reject_reason(connection.rejected))
 
 
                         
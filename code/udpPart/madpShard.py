@@ -0,0 +1,338 @@
+import asyncio
+import multiprocessing
+import os
+import queue
+import shutil
+import sys
+import time
+from madpAsync import receive_transfer, send_transfer
+from madpCodec import MAX_DATAGRAM_SIZE
+from madpCompress import CompressedChunks
+from madpHandshake import Hello, HandshakeAcceptor, Session, SessionCache, load_key, reject_reason
+from madpIntegrity import get_checksum
+from madpManifest import MANIFEST_FILE_ID, Manifest
+from madpPmtu import discover_chunk_size
+from madpScheduler import get_scheduler
+from madpSource import ChunkIndex
+from utils import PartialFile, StreamingReassembler
+
+# Sharded transfers. The files are split across SHARDS worker processes on each side, and
+# every pair of workers runs a transfer of its own on the asyncio engine, so the packet
+# processing of the transfer is spread over as many cores. A shard is a contiguous run of
+# the chunks of the files in manifest order, so a large file may be split between shards.
+#
+# Both sides compute the same shards from the manifest, which every shard sends first.
+# The receiver workers write their chunks into the shared .part files at their offsets,
+# and report every part of a file they completed to the coordinating process, which
+# renames a file once all of its parts are in.
+#
+# Shard i uses the data port DATA_PORT + 2 * i and the ACK port ACK_PORT + 2 * i. The shards
+# do not share a port with SO_REUSEPORT: the kernel spreads the datagrams of a shared port
+# over the sockets by a hash of their addresses, and a worker must see the packets of its
+# own transfer only.
+#
+# Every shard makes a handshake of its own, and the receiver learns the ACK port of the shard
+# from its HELLO. The resumption tokens are bound to the host of the sender and not to a port,
+# so the session of shard 0 is cached and resumed by every shard.
+
+SHARDS = 4
+DATA_PORT = 65432
+ACK_PORT = 65433
+# Address of the receiver
+RECEIVER_HOST = '172.17.0.2'
+# Seconds the coordinator waits for a completion before it checks that no worker failed
+WORKER_POLL = 1.0
+
+
+def shard_ranges(manifest, shards):
+    """
+    Split the chunks of the files of a manifest into contiguous shards of about the same size.
+
+    Args:
+        manifest (Manifest): The files of the transfer.
+        shards (int): Number of shards.
+
+    Returns:
+        list: For every shard, a list of (file_id, first_chunk, count) parts of files.
+    """
+    counts = [manifest.chunk_count(file_id) for file_id in range(len(manifest))]
+    total = sum(counts)
+    # Shard i holds the chunks bounds[i]..bounds[i + 1] of the whole transfer
+    bounds = [shard * total // shards for shard in range(shards + 1)]
+    ranges = [[] for _ in range(shards)]
+    shard = 0
+    position = 0 # Position of the first chunk of the file in the whole transfer
+    for file_id, count in enumerate(counts):
+        start, end = position, position + count
+        while start < end:
+            while bounds[shard + 1] <= start:
+                shard += 1
+            stop = min(end, bounds[shard + 1])
+            ranges[shard].append((file_id, start - position, stop - start))
+            start = stop
+        position = end
+    return ranges
+
+
+def shard_parts(ranges):
+    """
+    Number of shards every file is split between.
+
+    Returns:
+        dict: file_id -> number of parts.
+    """
+    parts = {}
+    for shard in ranges:
+        for file_id, _, _ in shard:
+            parts[file_id] = parts.get(file_id, 0) + 1
+    return parts
+
+
+def shard_chunks(data_folder, manifest, shard_range, chunk_size, scheduler, compression_level=0, compression_dictionary=True):
+    """
+    Index the chunks of a shard behind the manifest, in the order of the scheduler, compressed
+    with CompressedChunks if compression_level is not 0.
+
+    Returns:
+        tuple: A tuple containing the chunk index, the total number of chunks and the scheduler.
+    """
+    index = ChunkIndex(chunk_size)
+    scheduler = get_scheduler(scheduler)
+    count = index.add_buffer(manifest.encode(), MANIFEST_FILE_ID)
+    scheduler.add_file(MANIFEST_FILE_ID, 0, count, urgent=True)
+    for file_id, first, count in shard_range:
+        start = len(index)
+        count = index.add_file(os.path.join(data_folder, *manifest.paths[file_id].split('/')), file_id, first, count)
+        scheduler.add_file(file_id, start, count)
+    if compression_level:
+        index = CompressedChunks(index, compression_level, compression_dictionary)
+    return index, len(index), scheduler
+
+
+class ShardReassembler(StreamingReassembler):
+    """
+    Writes the parts of the files that belong to one shard into the shared output files.
+
+    Every worker writes its chunks into the .part file at their offsets, without
+    truncating what the other workers wrote. Once the part of a file in the shard is
+    complete, it reports (file_id, part path, final path, number of parts) on the
+    completion queue; the coordinator renames the file when all of its parts are in.
+    """
+    def __init__(self, chunk_size, directory, shard, shards, completions):
+        """
+        Args:
+            shard (int): Index of the shard of the worker.
+            shards (int): Number of shards.
+            completions (multiprocessing.Queue): Queue of the coordinator.
+        """
+        super().__init__(chunk_size, directory)
+        self.shard = shard
+        self.shards = shards
+        self.completions = completions
+        self.expected = {} # file_id -> number of chunks in this shard
+        self.parts = {}
+
+    def set_manifest(self, manifest):
+        super().set_manifest(manifest)
+        ranges = shard_ranges(manifest, self.shards)
+        self.expected = {file_id: count for file_id, _, count in ranges[self.shard]}
+        self.parts = shard_parts(ranges)
+
+    def add_chunk(self, file_id, chunk_number, data, flags):
+        if file_id in self.completed:
+            return None
+        partial = self.files.get(file_id)
+        if partial is None:
+            path = self.path(file_id)
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            partial = self.files[file_id] = PartialFile(path + ".part", self.manifest.sizes[file_id], shared=True)
+        partial.write(chunk_number, chunk_number * self.chunk_size, data, flags == 1)
+        if partial.tracker.received == self.expected.get(file_id):
+            partial.close()
+            del self.files[file_id]
+            self.completed.add(file_id)
+            self.completions.put((file_id, partial.path, self.path(file_id), self.parts[file_id]))
+        return None
+
+
+def send_worker(shard, shards, data_folder, encoded_manifest, settings):
+    manifest = Manifest.decode(encoded_manifest)
+    scheduler = settings.pop('scheduler')
+    compressionLevel = settings.pop('compression_level', 0)
+    compressionDictionary = settings.pop('compression_dictionary', True)
+    cache = settings.pop('session_cache', None)
+    sessionAddress = (RECEIVER_HOST, DATA_PORT)
+    session = None
+    if cache is not None and settings.pop('resumption', True):
+        cache = SessionCache(cache)
+        session = cache.get(sessionAddress)
+        if session is not None and session.chunk_size != manifest.chunk_size:
+            session = None
+    window = settings.pop('window_size', 64000)
+    while True:
+        chunks, totalChunks, shardScheduler = shard_chunks(data_folder, manifest, shard_ranges(manifest, shards)[shard],
+                                                           manifest.chunk_size, scheduler, compressionLevel,
+                                                           compressionDictionary)
+        # The receiver of the shard is told the whole transfer, so its admission covers every shard
+        hello = Hello(manifest.chunk_size, settings.get('initial_seq_num', 0), window, totalChunks,
+                      ACK_PORT + 2 * shard, sum(manifest.sizes), len(manifest))
+        checksum = settings.get('checksum', 'crc32')
+        if session is not None:
+            hello.window = min(window, session.window)
+            hello.token = session.token
+            checksum = session.checksum
+        connection = asyncio.run(send_transfer(chunks, (RECEIVER_HOST, DATA_PORT + 2 * shard),
+                                               ('0.0.0.0', ACK_PORT + 2 * shard),
+                                               **dict(settings, checksum=checksum, window_size=hello.window),
+                                               scheduler=shardScheduler, hello=hello))
+        chunks.close()
+        if connection.rejected and session is not None:
+            # The cached parameters are refused, start over with a full handshake
+            session = None
+            continue
+        break
+    if connection.rejected:
+        print(f"Shard {shard} rejected by the receiver:", reject_reason(connection.rejected))
+    elif shard == 0 and isinstance(cache, SessionCache) and connection.accept is not None:
+        cache.store(sessionAddress, Session.from_accept(manifest.chunk_size, connection.accept))
+
+
+def receive_worker(shard, shards, chunk_size, directory, key, acceptor_settings, completions):
+    try:
+        reassembler = ShardReassembler(chunk_size, directory, shard, shards, completions)
+        # Built in the worker, the checksums of the acceptor must be those of the process
+        checksums = acceptor_settings.pop('checksums', None)
+        if checksums is not None:
+            checksums = [get_checksum(name) for name in checksums]
+        acceptor = HandshakeAcceptor(key, MAX_DATAGRAM_SIZE, checksums=checksums, **acceptor_settings)
+        asyncio.run(receive_transfer(('0.0.0.0', DATA_PORT + 2 * shard), acceptor, reassembler))
+    finally:
+        completions.put(None) # The shard is done, or failed and exits with an error
+
+
+def send_sharded(data_folder, chunk_size, shards=SHARDS, **settings):
+    """
+    Send every file under data_folder with one worker process per shard.
+
+    Args:
+        data_folder (str): The directory to send.
+        chunk_size (int): Size of the chunks.
+        shards (int): Number of worker processes.
+        **settings: Settings of send_transfer, scheduler, the name of the scheduler of every shard,
+            compression_level and compression_dictionary, see shard_chunks, and session_cache, the path
+            of the SessionCache, with resumption, whether its session is resumed.
+    """
+    manifest = Manifest.from_directory(data_folder, chunk_size)
+    settings.setdefault('scheduler', 'srpt')
+    workers = [multiprocessing.Process(target=send_worker, args=(shard, shards, data_folder, manifest.encode(), dict(settings)))
+               for shard in range(shards)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+
+def receive_sharded(directory, chunk_size, key, shards=SHARDS, **acceptor_settings):
+    """
+    Receive a sharded transfer with one worker process per shard.
+
+    The calling process is the coordinator: it merges the parts the workers report
+    and moves a file to its final path once every shard wrote its part. A worker that
+    fails or is killed ends the transfer: the other workers are terminated and the
+    coordinator raises.
+
+    Args:
+        key (bytes): Secret of the resumption tokens, shared by every shard.
+        **acceptor_settings: Settings of the HandshakeAcceptor of every shard, checksums by name.
+
+    Returns:
+        int: Number of files received.
+
+    Raises:
+        RuntimeError: If a worker exited with an error.
+    """
+    completions = multiprocessing.Queue()
+    workers = [multiprocessing.Process(target=receive_worker, args=(shard, shards, chunk_size, directory, key,
+                                                                   dict(acceptor_settings), completions))
+               for shard in range(shards)]
+    for worker in workers:
+        worker.start()
+    partsDone = {} # file_id -> parts written
+    received = 0
+    running = shards
+    while running:
+        try:
+            completion = completions.get(timeout=WORKER_POLL)
+        except queue.Empty:
+            check_workers(workers)
+            continue
+        if completion is None:
+            running -= 1
+            continue
+        fileId, partPath, path, parts = completion
+        partsDone[fileId] = partsDone.get(fileId, 0) + 1
+        if partsDone[fileId] == parts:
+            os.replace(partPath, path)
+            received += 1
+    for worker in workers:
+        worker.join()
+    check_workers(workers)
+    return received
+
+
+def check_workers(workers):
+    """
+    Terminate every worker and raise if one of them exited with an error.
+    """
+    failed = [(shard, worker.exitcode) for shard, worker in enumerate(workers) if worker.exitcode not in (None, 0)]
+    if not failed:
+        return
+    for worker in workers:
+        if worker.is_alive():
+            worker.terminate()
+    for worker in workers:
+        worker.join()
+    raise RuntimeError("Shard workers failed: " + ", ".join(f"shard {shard} exited with {exitcode}"
+                                                             for shard, exitcode in failed))
+
+
+if __name__ == "__main__":
+    # python3 madpShard.py send|receive [shards] runs a sharded transfer with the settings of
+    # madpSender.py / madpReceiver.py
+    if len(sys.argv) not in (2, 3) or sys.argv[1] not in ('send', 'receive'):
+        print("Usage: python3 madpShard.py send|receive [shards]")
+        sys.exit(1)
+    shards = int(sys.argv[2]) if len(sys.argv) == 3 else SHARDS
+
+    if sys.argv[1] == 'send':
+        import madpSender
+        chunkSize = madpSender.PACKET_SIZE
+        session = madpSender.cached_session(SessionCache(madpSender.SESSION_CACHE), (RECEIVER_HOST, DATA_PORT))
+        if session is not None:
+            chunkSize = session.chunk_size
+        elif madpSender.PMTU_DISCOVERY:
+            # The path is the same for every shard, shard 0 answers the probes
+            chunkSize = discover_chunk_size((RECEIVER_HOST, DATA_PORT), get_checksum(madpSender.CHECKSUM_ALGORITHM),
+                                            madpSender.PACKET_SIZE, madpSender.MIN_DATAGRAM_SIZE,
+                                            madpSender.MAX_DATAGRAM_SIZE)
+        send_sharded(madpSender.DATA_FOLDER, chunkSize, shards,
+                     checksum=madpSender.CHECKSUM_ALGORITHM, initial_seq_num=madpSender.INITIAL_SEQ_NUM,
+                     congestion_control=madpSender.CONGESTION_CONTROL, pacing_gain=madpSender.PACING_GAIN,
+                     pace_retransmissions=madpSender.PACE_RETRANSMISSIONS,
+                     ack_frequency=madpSender.ACK_FREQUENCY, ack_delay=madpSender.ACK_DELAY,
+                     batch=madpSender.SEND_BATCH, scheduler=madpSender.SCHEDULER, fec=madpSender.fec_encoder(),
+                     compression_level=madpSender.COMPRESSION_LEVEL,
+                     compression_dictionary=madpSender.COMPRESSION_DICTIONARY,
+                     session_cache=madpSender.SESSION_CACHE, resumption=madpSender.RESUMPTION)
+    else:
+        import madpReceiver
+        os.makedirs(madpReceiver.OUTPUT_FOLDER, exist_ok=True)
+        timeStart = time.time()
+        received = receive_sharded(madpReceiver.OUTPUT_FOLDER, madpReceiver.CHUNK_SIZE,
+                                   load_key(madpReceiver.TOKEN_KEY_FILE), shards, window=madpReceiver.WINDOW,
+                                   checksums=madpReceiver.CHECKSUM_ALGORITHMS,
+                                   max_size=shutil.disk_usage(madpReceiver.OUTPUT_FOLDER).free)
+        print("-----------------------")
+        print("Files: ", received)
+        print("Total Time: ", time.time() - timeStart)
+        print("-----------------------")
@@ -0,0 +1,144 @@
+import mmap
+import os
+from array import array
+from collections import OrderedDict
+from madpCodec import LAST_CHUNK
+
+# Source files mapped at once. Every mapping holds a file descriptor, so the index maps
+# the files when their chunks are sent and unmaps the least recently used one beyond this.
+MAX_OPEN_MAPS = 64
+
+
+class ChunkIndex:
+    """
+    The chunks of a transfer, read straight from memory mapped source files.
+
+    The index only records the path of every source file, and a chunk is described
+    by a row of parallel arrays: the source it belongs to, file id, offset, length
+    and flags. A file is mapped read-only when one of its chunks is first sent, and
+    at most max_open files are mapped at once: the least recently used mapping is
+    closed to map another one, so a tree of any number of files is sent within the
+    file descriptor limit. A payload is a memoryview into the mapping, so the files
+    are never read into memory as a whole nor copied chunk by chunk. The kernel pages
+    the data in and out as needed, which lets a transfer be larger than the memory of
+    the sender.
+
+    Indexing returns a (file_id, chunk_num, payload, flag) tuple, so the index can
+    be used wherever a list of chunks is expected.
+    """
+    def __init__(self, chunk_size, max_open=MAX_OPEN_MAPS):
+        """
+        Args:
+            chunk_size (int): Size of every chunk but the last one of a file.
+            max_open (int): Source files mapped at once.
+        """
+        self.chunk_size = chunk_size
+        self.max_open = max_open
+        self.paths = [] # Path of every source file, None for empty files and buffers
+        self.buffers = [] # memoryview of every buffer and empty file, None for the other files
+        self.open_maps = OrderedDict() # source -> (mmap, memoryview), least recently used first
+        self.sources = array('I') # Index of the source of every chunk
+        self.file_ids = array('I')
+        self.offsets = array('Q')
+        self.lengths = array('I')
+        self.flags = array('B')
+        self.ranges = {} # file_id -> (index of its first chunk, number of chunks)
+
+    def add_file(self, path, file_id, first=0, count=None):
+        """
+        Append the chunks of a file to the index. The file is mapped when its chunks are taken.
+
+        Args:
+            path (str): The source file.
+            file_id (int): Identifier of the file on the wire.
+            first (int): First chunk to index, for a part of the file.
+            count (int): Number of chunks to index, None up to the end of the file.
+
+        Returns:
+            int: Number of chunks indexed. An empty file has a single empty chunk.
+        """
+        size = os.stat(path).st_size
+        if size == 0:
+            return self._add_source(None, memoryview(b''), size, file_id, first, count)
+        return self._add_source(path, None, size, file_id, first, count)
+
+    def add_buffer(self, data, file_id):
+        """
+        Append the chunks of an in-memory buffer, e.g. the encoded manifest.
+
+        Args:
+            data (bytes): The content.
+            file_id (int): Identifier of the content on the wire.
+
+        Returns:
+            int: Number of chunks of the buffer.
+        """
+        return self._add_source(None, memoryview(data), len(data), file_id)
+
+    def _add_source(self, path, buffer, size, file_id, first=0, count=None):
+        source = len(self.paths)
+        self.paths.append(path)
+        self.buffers.append(buffer)
+        total = max((size + self.chunk_size - 1) // self.chunk_size, 1)
+        end = total if count is None else min(first + count, total)
+        self.ranges[file_id] = (len(self.offsets), max(end - first, 0))
+        for chunk in range(first, end):
+            offset = chunk * self.chunk_size
+            self.sources.append(source)
+            self.file_ids.append(file_id)
+            self.offsets.append(offset)
+            self.lengths.append(min(self.chunk_size, size - offset))
+            self.flags.append(LAST_CHUNK if chunk == total - 1 else 0)
+        return max(end - first, 0)
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def file_range(self, file_id):
+        """
+        Returns:
+            tuple: (index of the first chunk, number of chunks) of the file in the index.
+        """
+        return self.ranges[file_id]
+
+    def __getitem__(self, seq):
+        offset = self.offsets[seq]
+        payload = self.view(self.sources[seq])[offset:offset + self.lengths[seq]]
+        return self.file_ids[seq], offset // self.chunk_size, payload, self.flags[seq] & LAST_CHUNK
+
+    def view(self, source):
+        """
+        memoryview of a source, mapping its file if it is not mapped.
+        """
+        buffer = self.buffers[source]
+        if buffer is not None:
+            return buffer
+        entry = self.open_maps.get(source)
+        if entry is not None:
+            self.open_maps.move_to_end(source)
+            return entry[1]
+        while len(self.open_maps) >= self.max_open:
+            self._unmap(*self.open_maps.popitem(last=False)[1])
+        with open(self.paths[source], 'rb') as f:
+            mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if hasattr(mapping, 'madvise') and hasattr(mmap, 'MADV_SEQUENTIAL'):
+            mapping.madvise(mmap.MADV_SEQUENTIAL) # Chunks are sent roughly in file order
+        view = memoryview(mapping)
+        self.open_maps[source] = (mapping, view)
+        return view
+
+    @staticmethod
+    def _unmap(mapping, view):
+        view.release()
+        try:
+            mapping.close()
+        except BufferError:
+            pass # A payload of the file is still in use, the mapping is closed with its last view
+
+    def close(self):
+        """
+        Unmap the source files. Payloads taken from the index must not be used afterwards.
+        """
+        for mapping, view in self.open_maps.values():
+            self._unmap(mapping, view)
+        self.open_maps.clear()
@@ -0,0 +1,88 @@
+import time
+from madpCodec import LAST_CHUNK
+from utils import ChunkTracker
+
+
+class ReceiveStream:
+    """
+    Receive side of the stream of one file.
+
+    A stream has its own ordering and reassembly state, independent of the
+    sequence space of the connection: the chunks of the file that were received,
+    the length of the prefix that was received without a gap, and the time it
+    completed.
+    """
+    def __init__(self, file_id):
+        self.file_id = file_id
+        self.tracker = ChunkTracker()
+        self.next_chunk = 0 # Every chunk before it was received
+        self.completed_at = None # Monotonic time of the last missing chunk
+
+    @property
+    def complete(self):
+        return self.completed_at is not None
+
+    def add(self, chunk_num, is_last):
+        """
+        Record a chunk of the file.
+
+        Returns:
+            bool: False if the chunk was already received.
+        """
+        tracker = self.tracker
+        if not tracker.add(chunk_num, is_last):
+            return False
+        if chunk_num == self.next_chunk:
+            nextChunk = chunk_num + 1
+            while nextChunk in tracker:
+                nextChunk += 1
+            self.next_chunk = nextChunk
+        if tracker.is_complete():
+            self.completed_at = time.monotonic()
+        return True
+
+
+class ReceiveStreams:
+    """
+    Demultiplexes the chunks of a connection into one ReceiveStream per file.
+
+    Every file is a stream of its own over the shared connection, so a chunk is
+    handed on as soon as it arrives instead of waiting behind the losses of other
+    files in the sequence space of the connection. Duplicates are dropped per
+    stream, so each chunk is delivered once.
+    """
+    def __init__(self, deliver):
+        """
+        Args:
+            deliver (callable): Called as deliver(file_id, chunk_num, payload, flags) for
+                every new chunk, with its chunk flags.
+        """
+        self.deliver = deliver
+        self.streams = {} # file_id -> ReceiveStream
+        self.completed = [] # File ids in the order their streams completed
+
+    def __getitem__(self, file_id):
+        return self.streams[file_id]
+
+    def __contains__(self, file_id):
+        return file_id in self.streams
+
+    def add(self, file_id, chunk_num, payload, flags):
+        """
+        Route a chunk to the stream of its file and deliver it if it is new.
+
+        Args:
+            flags (int): Chunk flags, see madpCodec.
+
+        Returns:
+            bool: False if the chunk was a duplicate.
+        """
+        stream = self.streams.get(file_id)
+        if stream is None:
+            stream = self.streams[file_id] = ReceiveStream(file_id)
+        if not stream.add(chunk_num, flags & LAST_CHUNK):
+            return False
+        if stream.complete:
+            self.completed.append(file_id)
+        self.deliver(file_id, chunk_num, payload, flags)
+        return True
@@ -0,0 +1,104 @@
+import threading
+import time
+
+
+class TimerWheel:
+    """
+    Hashed timer wheel serviced by a single long-lived thread.
+
+    Deadlines are kept per key (a connection, a packet, ...). Scheduling a key
+    again replaces its previous deadline, which costs a dict update and a list
+    append, so re-arming a retransmission timer on every ACK never creates or
+    joins a thread. Superseded entries are dropped lazily when their slot comes
+    up on the wheel.
+
+    Callbacks run on the wheel thread, so they should be short and must not block.
+    """
+    def __init__(self, tick=0.005, slots=512):
+        """
+        Args:
+            tick (float): Resolution of the wheel in seconds.
+            slots (int): Number of slots, deadlines further than tick * slots away
+                simply stay in their slot for more than one round.
+        """
+        self.tick = tick
+        self.slots = slots
+        self.wheel = [[] for _ in range(slots)]
+        self.timers = {} # key -> (deadline, callback, generation)
+        self.generation = 0
+        self.cursor = int(time.monotonic() / tick) # Next tick the wheel thread will visit
+        self.condition = threading.Condition()
+        self.stopped = False
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def schedule(self, key, delay, callback):
+        """
+        Arm or re-arm the timer of key.
+
+        Args:
+            key (hashable): Identifies the timer, a previous deadline of the same key is replaced.
+            delay (float): Seconds from now until callback is called.
+            callback (callable): Called without arguments on the wheel thread.
+        """
+        deadline = time.monotonic() + delay
+        with self.condition:
+            self.generation += 1
+            self.timers[key] = (deadline, callback, self.generation)
+            # The slot of the first tick that starts after the deadline, or the next one to
+            # be visited if that tick has already passed
+            self.wheel[max(int(deadline / self.tick) + 1, self.cursor) % self.slots].append((key, self.generation))
+            if len(self.timers) == 1:
+                self.condition.notify()
+
+    def cancel(self, key):
+        """
+        Disarm the timer of key if it is armed.
+        """
+        with self.condition:
+            self.timers.pop(key, None)
+
+    def stop(self):
+        """
+        Stop the wheel thread, pending timers are discarded.
+        """
+        with self.condition:
+            self.stopped = True
+            self.timers.clear()
+            self.condition.notify()
+        self.thread.join()
+
+    def run(self):
+        while True:
+            with self.condition:
+                # Sleep until there is something to wait for
+                while not self.timers and not self.stopped:
+                    self.condition.wait()
+                if self.stopped:
+                    return
+                nextTick = self.cursor
+            time.sleep(max((nextTick + 1) * self.tick - time.monotonic(), 0))
+
+            now = time.monotonic()
+            nowTick = int(now / self.tick)
+            fired = []
+            with self.condition:
+                # After a long stall every slot is visited once instead of once per missed tick
+                nextTick = max(self.cursor, nowTick - self.slots + 1)
+                while nextTick <= nowTick:
+                    slot = self.wheel[nextTick % self.slots]
+                    pending = []
+                    for key, generation in slot:
+                        timer = self.timers.get(key)
+                        if timer is None or timer[2] != generation:
+                            continue # Cancelled or re-armed
+                        if timer[0] <= now:
+                            del self.timers[key]
+                            fired.append(timer[1])
+                        else:
+                            pending.append((key, generation)) # Due in a later round
+                    slot[:] = pending
+                    nextTick += 1
+                self.cursor = nextTick
+            for callback in fired:
+                callback()
@@ -0,0 +1,62 @@
+import os
+import socket
+import struct
+import sys
+
+# The modules of MADP are standalone scripts run from udpPart, import them the same way
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from madpCodec import UDP_SEGMENT # noqa: E402
+
+
+def free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class CaptureSocket:
+    """
+    Stands in for a UDP socket: keeps the datagrams sent instead of sending them.
+
+    A GSO send is split into its datagrams at the segment size, as the kernel does.
+    The send number full_at raises BlockingIOError, as on a full socket buffer, and
+    with gso_error a GSO send fails with that errno, as on a kernel without UDP_SEGMENT.
+    """
+    def __init__(self, full_at=None, gso_error=None):
+        self.packets = []
+        self.sends = [] # Datagrams of every sendmsg
+        self.full_at = full_at
+        self.gso_error = gso_error
+        self.sock = None
+
+    def sendmsg(self, buffers, ancdata=(), flags=0, address=None):
+        if len(self.sends) + 1 == self.full_at:
+            self.full_at = None
+            raise BlockingIOError
+        data = b''.join(bytes(buffer) for buffer in buffers)
+        segmentSize = len(data)
+        for level, kind, value in ancdata:
+            if kind == UDP_SEGMENT:
+                if self.gso_error is not None:
+                    raise OSError(self.gso_error, os.strerror(self.gso_error))
+                segmentSize, = struct.unpack('=H', value)
+        datagrams = [data[i:i + segmentSize] for i in range(0, len(data), segmentSize)] or [b'']
+        self.sends.append(len(datagrams))
+        self.packets.extend(datagrams)
+        return len(data)
+
+    def sendto(self, data, address):
+        return self.sendmsg([data], (), 0, address)
+
+    def fileno(self):
+        """
+        A descriptor that is always writable, for loop.add_writer.
+        """
+        if self.sock is None:
+            self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        return self.sock.fileno()
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
@@ -0,0 +1,104 @@
+import time
+
+import pytest
+
+from conftest import CaptureSocket
+from madpCodec import LAST_CHUNK, PacketEncoder
+from madpConnection import ReceiverConnection
+from madpIntegrity import CRC32
+from utils import FileReassembler
+
+TOTAL = 12
+
+
+def packets(ack_frequency=3, ack_delay=0.02):
+    """
+    The data packets of one file of TOTAL chunks, with the ACK policy of the sender in their headers.
+    """
+    encoder = PacketEncoder(CRC32, ack_frequency=ack_frequency, ack_delay=ack_delay)
+    sock = CaptureSocket()
+    for seq in range(TOTAL):
+        encoder.send_data(sock, None, seq, 1, seq, LAST_CHUNK if seq == TOTAL - 1 else 0, bytes([seq]) * 10)
+    return sock.packets
+
+
+@pytest.fixture
+def receiver(tmp_path):
+    return ReceiverConnection(0, FileReassembler(tmp_path), window=64, total_chunks=TOTAL, checksum=CRC32)
+
+
+def test_one_ack_per_ack_frequency_packets(receiver):
+    acks = [receiver.on_data(packet) for packet in packets()[:9]]
+    assert [ack is not None for ack in acks] == [False, False, True] * 3
+    assert [ack[1] for ack in acks if ack is not None] == [2, 5, 8] # Cumulative, the last in order packet
+    assert receiver.pending_ack is None
+
+
+def test_every_packet_is_acknowledged_without_a_delay(receiver):
+    acks = [receiver.on_data(packet) for packet in packets(ack_frequency=3, ack_delay=0)[:4]]
+    assert all(ack is not None for ack in acks)
+
+
+def test_deadline_from_the_ack_delay_of_the_header(receiver):
+    data = packets(ack_delay=0.04)
+    before = time.monotonic()
+    assert receiver.on_data(data[0]) is None
+    after = time.monotonic()
+    assert receiver.ack_delay == pytest.approx(0.04)
+    assert before + 0.04 <= receiver.ack_deadline <= after + 0.04
+    deadline = receiver.ack_deadline
+    assert receiver.on_data(data[1]) is None
+    assert receiver.ack_deadline == deadline # Counted from the first unacknowledged packet
+    ack = receiver.take_ack()
+    assert ack[1] == 1 # Covers both held packets
+    assert receiver.take_ack() is None
+    assert receiver.on_data(data[2]) is None # A new round of ack_frequency packets
+    assert receiver.ack_deadline >= deadline
+
+
+def test_out_of_order_packet_is_acknowledged_immediately(receiver):
+    data = packets()
+    assert receiver.on_data(data[0]) is None
+    ack = receiver.on_data(data[2]) # data[1] is missing
+    assert ack is not None
+    assert ack[1] == 0
+    assert ack[2] == [(2, 3)]
+    assert receiver.pending_ack is None # Superseded by the immediate ACK
+
+
+def test_packet_filling_a_gap_is_acknowledged_immediately(receiver):
+    data = packets()
+    receiver.on_data(data[0])
+    receiver.on_data(data[2])
+    ack = receiver.on_data(data[1])
+    assert ack is not None
+    assert ack[1] == 2
+    assert ack[2] == []
+
+
+def test_duplicate_is_acknowledged_immediately(receiver):
+    data = packets()
+    receiver.on_data(data[0])
+    receiver.on_data(data[1])
+    assert receiver.on_data(data[2]) is not None
+    assert receiver.on_data(data[3]) is None
+    assert receiver.on_data(data[1]) is not None # The ACK that covered it was lost
+
+
+def test_last_packet_is_acknowledged_immediately(receiver):
+    acks = [receiver.on_data(packet) for packet in packets(ack_frequency=5)]
+    assert receiver.complete
+    assert acks[-1] is not None
+    assert acks[-1][1] == TOTAL - 1
+
+
+def test_connection_is_not_complete_before_any_packet(tmp_path):
+    receiver = ReceiverConnection(0, FileReassembler(tmp_path), total_chunks=TOTAL, checksum=CRC32)
+    assert not receiver.complete
+    # Without the number of chunks of the transfer the connection never completes on its own
+    receiver = ReceiverConnection(0, FileReassembler(tmp_path), checksum=CRC32)
+    assert not receiver.complete
+    for packet in packets():
+        receiver.on_data(packet)
+    assert receiver.delivered_chunks == TOTAL
+    assert not receiver.complete
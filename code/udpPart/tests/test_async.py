@@ -0,0 +1,44 @@
+import asyncio
+
+from conftest import CaptureSocket
+from madpAsync import SenderProtocol
+from madpCodec import decode_data, decode_repair, is_repair
+from madpConnection import SenderConnection
+from madpFec import FecEncoder
+from madpIntegrity import CRC32
+
+
+def test_full_socket_keeps_unsent_packets_and_repairs():
+    chunks = [(1, i, bytes([i]) * 100, 0) for i in range(8)]
+    connection = SenderConnection(chunks, CRC32, pacing_gain=0, fec=FecEncoder(4, 1, 1))
+    batches = []
+    next_batch = connection.next_batch
+    def counted(limit):
+        batch = next_batch(limit)
+        batches.append(len(batch[0]))
+        return batch
+    connection.next_batch = counted
+    sock = CaptureSocket(full_at=5)
+
+    async def main():
+        protocol = SenderProtocol(connection, sock, ('127.0.0.1', 9), batch=8)
+        protocol.encoder.gso = False # One sendmsg per packet
+        protocol.pump()
+        # The fifth packet hit the full buffer: the pump stopped with the tail and the repairs kept
+        assert protocol.blocked is not None
+        packets, repairs = protocol.blocked
+        assert [packet[0] for packet in packets] == [4, 5, 6, 7]
+        assert len(repairs) == 2
+        calls = len(batches)
+        await asyncio.sleep(0.05) # The socket is writable again
+        assert protocol.blocked is None
+        assert batches[calls:] == [0] * (len(batches) - calls) # No new packet to take
+        protocol.finish()
+
+    asyncio.run(main())
+    sock.close()
+    seqs = [decode_data(packet)[4] for packet in sock.packets if not is_repair(packet)]
+    repairBlocks = [decode_repair(packet)[4] for packet in sock.packets if is_repair(packet)]
+    assert seqs == list(range(8)) # Every packet exactly once, in order
+    assert sorted(repairBlocks) == [0, 4]
+    assert connection.in_flight() == 8
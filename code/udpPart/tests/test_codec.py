@@ -0,0 +1,148 @@
+import errno
+import struct
+
+import pytest
+
+from conftest import CaptureSocket
+from madpCodec import (DATA_FIELDS, GRO_BUFFER_SIZE, GSO_MAX_BYTES, GSO_MAX_SEGMENTS, MSG_DONTWAIT, SOL_UDP,
+                       UDP_GRO, DatagramReceiver, PacketEncoder, decode_data)
+from madpIntegrity import CRC32
+
+SOURCE = ('127.0.0.1', 9)
+
+
+class QueueSocket:
+    """
+    Stands in for a UDP socket with datagrams queued on it.
+
+    Every entry of reads is what one receive call returns: a list of datagrams the kernel
+    coalesced, with GRO, or a single datagram. An empty queue raises BlockingIOError like
+    a non-blocking receive. With gro False the socket refuses UDP_GRO like an older kernel.
+    """
+    def __init__(self, reads, gro=True):
+        self.reads = list(reads)
+        self.gro = gro
+        self.calls = []
+
+    def setsockopt(self, level, option, value):
+        if not self.gro:
+            raise OSError(errno.ENOPROTOOPT, "Protocol not available")
+
+    def next_read(self, space, flags):
+        self.calls.append(flags)
+        if not self.reads:
+            raise BlockingIOError
+        datagrams = self.reads.pop(0)
+        data = b''.join(datagrams)
+        space[:len(data)] = data
+        return datagrams, len(data)
+
+    def recvmsg_into(self, buffers, ancillary_size, flags=0):
+        datagrams, size = self.next_read(buffers[0], flags)
+        ancdata = []
+        if len(datagrams) > 1:
+            ancdata.append((SOL_UDP, UDP_GRO, struct.pack('=i', len(datagrams[0]))))
+        return size, ancdata, 0, SOURCE
+
+    def recvfrom_into(self, buffer, nbytes=0, flags=0):
+        return self.next_read(buffer, flags)[1], SOURCE
+
+
+def receiver(reads, gro=True, max_size=1500):
+    sock = QueueSocket(reads, gro)
+    datagramReceiver = DatagramReceiver(sock, max_size)
+    datagramReceiver.gro = gro # Set by the platform check, which is only true on Linux
+    if gro:
+        datagramReceiver.receive_size = GRO_BUFFER_SIZE
+        datagramReceiver.ancillary_size = 64
+    return datagramReceiver, sock
+
+
+def test_gro_buffers_are_split_at_the_segment_size():
+    segments = [bytes([i]) * 1200 for i in range(5)]
+    reads = [segments[:3], segments[3:], [b'single']]
+    datagramReceiver, sock = receiver(reads)
+    datagrams = datagramReceiver.receive()
+    assert [bytes(datagram) for datagram in datagrams] == segments + [b'single']
+    assert datagramReceiver.sources == [SOURCE] * 6
+    assert all(isinstance(datagram, memoryview) for datagram in datagrams)
+    assert sock.calls == [0, MSG_DONTWAIT, MSG_DONTWAIT, MSG_DONTWAIT] # Only the first call blocks
+
+
+def test_gro_short_last_segment():
+    reads = [[b'a' * 1000, b'b' * 1000, b'c' * 10]]
+    datagramReceiver, _ = receiver(reads)
+    assert [bytes(datagram) for datagram in datagramReceiver.receive()] == [b'a' * 1000, b'b' * 1000, b'c' * 10]
+
+
+def test_without_gro():
+    reads = [[b'first'], [b'second' * 200], [b'']]
+    datagramReceiver, sock = receiver(reads, gro=False)
+    assert not datagramReceiver.gro
+    assert datagramReceiver.receive_size == 1500
+    assert [bytes(datagram) for datagram in datagramReceiver.receive()] == [b'first', b'second' * 200, b'']
+    assert datagramReceiver.receive() == []
+
+
+def test_datagrams_outlive_their_slab():
+    # Every receive needs a whole GRO buffer of room, a slab holds a few of them
+    reads = [[bytes([i]) * 60000] for i in range(40)]
+    datagramReceiver, _ = receiver(reads)
+    datagramReceiver.batch = 1
+    datagrams = [datagramReceiver.receive()[0] for _ in range(40)]
+    assert len({id(datagram.obj) for datagram in datagrams}) > 1
+    assert [bytes(datagram) for datagram in datagrams] == [bytes([i]) * 60000 for i in range(40)]
+
+
+def payloads(sizes):
+    return [(seq, 1, seq, 0, bytes([seq]) * size) for seq, size in enumerate(sizes)]
+
+
+def send_batch(packets, **kwargs):
+    encoder = PacketEncoder(CRC32)
+    encoder.gso = True
+    sock = CaptureSocket(**kwargs)
+    encoder.send_data_batch(sock, SOURCE, packets)
+    assert encoder.batch_sent == len(packets)
+    assert [decode_data(packet)[4] for packet in sock.packets] == [packet[0] for packet in packets]
+    assert all(decode_data(packet)[0] for packet in sock.packets)
+    return encoder, sock
+
+
+def test_gso_segment_limit():
+    _, sock = send_batch(payloads([100] * GSO_MAX_SEGMENTS))
+    assert sock.sends == [GSO_MAX_SEGMENTS]
+
+
+def test_gso_byte_limit():
+    headerSize = DATA_FIELDS.size + CRC32.size
+    _, sock = send_batch(payloads([1400] * GSO_MAX_SEGMENTS))
+    perSend = GSO_MAX_BYTES // (headerSize + 1400)
+    assert sock.sends == [perSend, GSO_MAX_SEGMENTS - perSend]
+    assert all(len(packet) == headerSize + 1400 for packet in sock.packets)
+
+
+def test_gso_runs_end_at_a_shorter_packet():
+    _, sock = send_batch(payloads([1400, 1400, 1400, 300, 1400, 1400, 1400, 1400]))
+    assert sock.sends == [4, 4]
+    _, sock = send_batch(payloads([300, 1400, 1400]))
+    assert sock.sends == [1, 2] # A longer packet starts a new run
+
+
+@pytest.mark.parametrize('error', [errno.EIO, errno.EINVAL])
+def test_gso_falls_back_to_one_send_per_packet(error):
+    encoder, sock = send_batch(payloads([1400] * 8), gso_error=error)
+    assert not encoder.gso
+    assert sock.sends == [1] * 8
+    sock.gso_error = None
+    encoder.send_data_batch(sock, SOURCE, payloads([1400] * 8))
+    assert sock.sends == [1] * 16 # GSO stays off
+
+
+def test_other_errors_are_raised():
+    encoder = PacketEncoder(CRC32)
+    encoder.gso = True
+    with pytest.raises(OSError) as exception:
+        encoder.send_data_batch(CaptureSocket(gso_error=errno.EPERM), SOURCE, payloads([1400] * 4))
+    assert exception.value.errno == errno.EPERM
+    assert encoder.gso
@@ -0,0 +1,120 @@
+import os
+
+import pytest
+
+from madpCodec import COMPRESSED, DICTIONARY, LAST_CHUNK
+from madpCompress import DICTIONARY_REF, NO_DICTIONARY, ChunkInflater, CompressedChunks
+from madpSource import ChunkIndex
+
+CHUNK_SIZE = 1000
+TEXT = b''.join(b'record %06d: the quick brown fox jumps over the lazy dog\n' % i for i in range(200))
+
+
+def compressed_index(*files, **settings):
+    index = ChunkIndex(CHUNK_SIZE)
+    for file_id, data in enumerate(files):
+        index.add_buffer(data, file_id)
+    return CompressedChunks(index, **settings)
+
+
+def sent_size(chunks):
+    return sum(len(chunks[seq][2]) for seq in range(len(chunks)))
+
+
+def inflate_all(chunks, order=None):
+    """
+    Inflate every chunk of the index in the given order of sequence numbers.
+
+    Returns:
+        dict: file_id -> content of the file.
+    """
+    inflater = ChunkInflater(CHUNK_SIZE)
+    files = {}
+    for seq in range(len(chunks)) if order is None else order:
+        file_id, chunk_num, payload, flag = chunks[seq]
+        for chunkNum, data, flags in inflater.inflate(file_id, chunk_num, bytes(payload), flag):
+            files.setdefault(file_id, {})[chunkNum] = bytes(data)
+    return {file_id: b''.join(parts[i] for i in sorted(parts)) for file_id, parts in files.items()}
+
+
+def test_round_trip_with_dictionary():
+    chunks = compressed_index(TEXT)
+    flags = [chunks[seq][3] for seq in range(len(chunks))]
+    assert flags[0] & DICTIONARY and not any(flag & DICTIONARY for flag in flags[1:])
+    assert all(flag & COMPRESSED for flag in flags)
+    assert flags[-1] & LAST_CHUNK
+    # Every chunk but the first is compressed against the first one
+    assert DICTIONARY_REF.unpack_from(chunks[0][2])[0] == NO_DICTIONARY
+    assert DICTIONARY_REF.unpack_from(chunks[1][2])[0] == 0
+    # The dictionary pays off against chunks compressed alone
+    alone = compressed_index(TEXT, dictionary=False)
+    assert sent_size(chunks) < sent_size(alone) < len(TEXT)
+    assert inflate_all(chunks) == {0: TEXT}
+
+
+def test_chunks_wait_for_their_dictionary():
+    chunks = compressed_index(TEXT)
+    order = list(reversed(range(len(chunks)))) # The dictionary arrives last
+    assert inflate_all(chunks, order) == {0: TEXT}
+
+
+def test_without_dictionary():
+    chunks = compressed_index(TEXT, dictionary=False)
+    assert not any(chunks[seq][3] & DICTIONARY for seq in range(len(chunks)))
+    assert all(DICTIONARY_REF.unpack_from(chunks[seq][2])[0] == NO_DICTIONARY for seq in range(len(chunks)))
+    assert inflate_all(chunks) == {0: TEXT}
+
+
+def test_incompressible_file_is_sent_raw():
+    noise = os.urandom(5 * CHUNK_SIZE)
+    chunks = compressed_index(noise, TEXT)
+    for seq in range(5):
+        file_id, chunk_num, payload, flag = chunks[seq]
+        assert not flag & (COMPRESSED | DICTIONARY)
+        assert bytes(payload) == noise[seq * CHUNK_SIZE:(seq + 1) * CHUNK_SIZE]
+    assert inflate_all(chunks) == {0: noise, 1: TEXT}
+
+
+def test_incompressible_chunk_of_a_compressible_file_is_sent_raw():
+    data = TEXT[:4 * CHUNK_SIZE] + os.urandom(CHUNK_SIZE) + TEXT[:3 * CHUNK_SIZE]
+    chunks = compressed_index(data, sample=8)
+    assert not chunks[4][3] & COMPRESSED
+    assert all(chunks[seq][3] & COMPRESSED for seq in range(len(chunks)) if seq != 4)
+    assert inflate_all(chunks) == {0: data}
+
+
+def test_retransmission_is_identical():
+    chunks = compressed_index(TEXT)
+    assert bytes(chunks[3][2]) == bytes(chunks[3][2])
+
+
+@pytest.mark.parametrize('corrupt', ['flip', 'truncate', 'reference'])
+def test_corrupted_chunk(corrupt):
+    chunks = compressed_index(TEXT, dictionary=False)
+    file_id, chunk_num, payload, flag = chunks[2]
+    payload = bytearray(payload)
+    if corrupt == 'flip':
+        payload[DICTIONARY_REF.size] ^= 0xFF
+    elif corrupt == 'truncate':
+        del payload[-4:]
+    else:
+        del payload[DICTIONARY_REF.size - 1:]
+    with pytest.raises(ValueError):
+        ChunkInflater(CHUNK_SIZE).inflate(file_id, chunk_num, bytes(payload), flag)
+
+
+def test_chunk_larger_than_the_chunk_size():
+    chunks = compressed_index(TEXT)
+    file_id, chunk_num, payload, flag = chunks[0]
+    with pytest.raises(ValueError):
+        ChunkInflater(CHUNK_SIZE // 2).inflate(file_id, chunk_num, bytes(payload), flag)
+
+
+def test_forget():
+    chunks = compressed_index(TEXT, TEXT)
+    inflater = ChunkInflater(CHUNK_SIZE)
+    for seq in range(len(chunks)):
+        inflater.inflate(*chunks[seq])
+    assert {key[0] for key in inflater.dictionaries} == {0, 1}
+    inflater.forget(0)
+    assert {key[0] for key in inflater.dictionaries} == {1}
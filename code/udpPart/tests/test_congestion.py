@@ -0,0 +1,150 @@
+import pytest
+
+from madpCongestion import Cubic, NewReno, get_congestion_controller
+
+RTT = 0.1
+
+
+def ack_round(controller, now, rtt=RTT):
+    """
+    Acknowledge one window of packets one by one, as the ACKs of a round trip arrive.
+    """
+    for _ in range(controller.window):
+        controller.on_ack(1, rtt, 10 ** 6, now)
+
+
+@pytest.mark.parametrize('name', ['newreno', 'cubic'])
+def test_slow_start_doubles_every_round_trip(name):
+    controller = get_congestion_controller(name, initial_window=10)
+    assert controller.in_slow_start
+    for expected in (20, 40, 80):
+        ack_round(controller, 0.0)
+        assert controller.window == expected
+
+
+@pytest.mark.parametrize('name', ['newreno', 'cubic'])
+def test_window_is_capped(name):
+    controller = get_congestion_controller(name, initial_window=10, max_window=30)
+    for _ in range(5):
+        ack_round(controller, 0.0)
+    assert controller.window == 30
+
+
+def test_newreno_congestion_avoidance_adds_one_packet_per_round_trip():
+    controller = NewReno(initial_window=20)
+    controller.ssthresh = 20
+    for expected in (21, 22, 23):
+        for _ in range(round(controller.cwnd)):
+            controller.on_ack(1, RTT, 10 ** 6, 0.0)
+        assert controller.cwnd == pytest.approx(expected, abs=0.1)
+        assert not controller.in_slow_start
+
+
+@pytest.mark.parametrize('name', ['newreno', 'cubic'])
+def test_one_reduction_per_recovery(name):
+    controller = get_congestion_controller(name, initial_window=40)
+    controller.on_loss(100, 1.0) # Packets up to 99 were outstanding
+    reduced = controller.cwnd
+    assert reduced == 40 * (0.5 if name == 'newreno' else Cubic.BETA)
+    assert controller.ssthresh == reduced
+    controller.on_loss(105, 1.0) # Another hole of the same window
+    controller.on_ack(10, RTT, 99, 1.1) # Still recovering
+    assert controller.cwnd == reduced
+    controller.on_ack(10, RTT, 100, 1.2) # Every packet outstanding at the loss is acknowledged
+    assert controller.recover is None
+    assert controller.cwnd > reduced
+    controller.on_loss(200, 1.3) # A loss in a later window is a new episode
+    assert controller.cwnd < reduced
+
+
+@pytest.mark.parametrize('name', ['newreno', 'cubic'])
+def test_timeout_collapses_the_window(name):
+    controller = get_congestion_controller(name, initial_window=40)
+    controller.on_loss(100, 1.0)
+    controller.on_timeout(150, 2.0) # A timeout during recovery still counts
+    assert controller.window == 1
+    assert controller.in_slow_start
+    controller.on_ack(1, RTT, 149, 2.1) # The packets sent before the timeout end no recovery
+    assert controller.window == 1
+    controller.on_ack(1, RTT, 150, 2.2)
+    assert controller.window == 2
+
+
+def test_newreno_timeout_halves_the_threshold():
+    controller = NewReno(initial_window=40)
+    controller.on_timeout(100, 1.0)
+    assert controller.ssthresh == 20
+    assert NewReno(initial_window=3).ssthresh == 64000
+    controller = NewReno(initial_window=3)
+    controller.on_timeout(100, 1.0)
+    assert controller.ssthresh == 2 # Never below two packets
+
+
+def test_cubic_window_after_a_loss():
+    controller = Cubic(initial_window=100)
+    controller.on_loss(1000, 10.0)
+    # W_max = 100, the window drops to BETA W_max and K = cbrt(W_max (1 - BETA) / C)
+    k = (100 * 0.3 / 0.4) ** (1 / 3)
+    assert controller.cwnd == pytest.approx(70)
+    assert controller.k == pytest.approx(k)
+    controller.recover = None
+    # An ACK 2 s after the loss aims at W(t + RTT) = C (t + RTT - K)^3 + W_max
+    target = 0.4 * (2.0 + RTT - k) ** 3 + 100
+    controller.on_ack(1, RTT, 1000, 12.0)
+    assert controller.cwnd == pytest.approx(70 + (target - 70) / 70)
+    # Around K the window is back at W_max and flat
+    controller.cwnd = 70.0
+    now = 10.0
+    while now < 10.0 + k:
+        ack_round(controller, now)
+        now += RTT
+    assert controller.cwnd == pytest.approx(100, abs=1.5)
+    ack_round(controller, 10.0 + k + RTT)
+    assert controller.cwnd == pytest.approx(100, abs=1.5)
+    # Beyond K it follows the cubic function up again
+    for _ in range(20):
+        ack_round(controller, now)
+        now += RTT
+    assert controller.cwnd == pytest.approx(0.4 * (now - 10.0 - k) ** 3 + 100, abs=1)
+    assert controller.cwnd > 102
+
+
+def test_cubic_tcp_friendly_region():
+    # With a short RTT, NewReno would grow faster than the cubic function right after a loss
+    rtt = 0.001
+    controller = Cubic(initial_window=10)
+    controller.on_loss(100, 0.0)
+    controller.recover = None
+    k = (10 * 0.3 / 0.4) ** (1 / 3)
+    t = 0.5
+    cubic = 0.4 * (t + rtt - k) ** 3 + 10
+    friendly = 10 * 0.7 + 3 * 0.3 / 1.7 * (t + rtt) / rtt
+    assert friendly > cubic
+    controller.on_ack(1, rtt, 100, t)
+    assert controller.cwnd == pytest.approx(7 + (friendly - 7) / 7)
+
+
+def test_cubic_epoch_restarts():
+    controller = Cubic(initial_window=100)
+    controller.on_loss(1000, 10.0)
+    controller.on_ack(1, RTT, 1000, 11.0)
+    controller.on_loss(2000, 12.0) # A new loss starts a new epoch at the current window
+    assert controller.epoch_start == 12.0
+    assert controller.w_max == pytest.approx(70, abs=1)
+    controller.on_timeout(3000, 13.0) # After a timeout, slow start up to the threshold
+    assert controller.epoch_start is None
+    assert controller.cwnd == 1
+    threshold = controller.ssthresh
+    controller.recover = None
+    while controller.in_slow_start:
+        controller.on_ack(1, RTT, 3000, 14.0)
+    # The first ACK in congestion avoidance starts an epoch from the window reached, without a plateau
+    controller.on_ack(1, RTT, 3000, 15.0)
+    assert controller.epoch_start == 15.0
+    assert controller.w_max >= threshold
+    assert controller.k == 0
+
+
+def test_unknown_congestion_controller():
+    with pytest.raises(ValueError):
+        get_congestion_controller('vegas')
@@ -0,0 +1,135 @@
+import asyncio
+import socket
+
+import pytest
+
+import madpDaemon
+from madpCodec import MAX_DATAGRAM_SIZE, PacketEncoder, decode_handshake
+from madpHandshake import ACCEPT, HELLO, REJECT, REJECT_BUSY, Accept, Hello, HandshakeAcceptor, decode_reject
+from madpIntegrity import CRC32
+
+CHUNK_SIZE = 1000
+KEY = bytes(32)
+
+
+class Wire:
+    """
+    Loopback sockets: packets encoded onto the wire are read back as bytes, and the replies
+    of the daemon are received on the sender side.
+    """
+    def __init__(self):
+        self.out = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sink = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sink.bind(('127.0.0.1', 0))
+        self.sink.settimeout(1)
+        self.ack_port = self.sink.getsockname()[1]
+        self.encoder = PacketEncoder(CRC32)
+
+    def capture(self):
+        return self.sink.recv(MAX_DATAGRAM_SIZE)
+
+    def hello(self, hello_id, window, token=b''):
+        hello = Hello(CHUNK_SIZE, 0, window, 2, self.ack_port, 100, 1, token=token)
+        self.encoder.send_handshake(self.out, self.sink.getsockname(), HELLO, hello_id, hello.encode())
+        return self.capture()
+
+    def data(self, connection_id, seq_num, payload):
+        self.encoder.connection_id = connection_id
+        self.encoder.send_data(self.out, self.sink.getsockname(), seq_num, 0, seq_num, 0, payload)
+        return self.capture()
+
+    def reply(self):
+        """
+        Returns:
+            tuple: (kind, connection id, window of an ACCEPT or reason of a REJECT)
+        """
+        valid, _, _, kind, connectionId, payload = decode_handshake(self.capture())
+        assert valid
+        if kind == ACCEPT:
+            return kind, connectionId, Accept.decode(payload).window
+        return kind, connectionId, decode_reject(payload)
+
+    def close(self):
+        self.out.close()
+        self.sink.close()
+
+
+@pytest.fixture
+def wire():
+    wire = Wire()
+    yield wire
+    wire.close()
+
+
+def run_daemon(tmp_path, test, **settings):
+    async def main():
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        daemon = madpDaemon.ReceiverDaemon(HandshakeAcceptor(KEY, window=1000), sock, str(tmp_path), **settings)
+        try:
+            test(daemon)
+        finally:
+            daemon.connection_lost(None)
+            sock.close()
+    asyncio.run(main())
+
+
+def test_admissible_window(tmp_path):
+    def test(daemon):
+        hello = Hello(CHUNK_SIZE, 0, 600, 2, 1)
+        assert daemon.admissible_window(hello) == 1000 # The window of the acceptor
+        daemon.reserved = 700 * CHUNK_SIZE
+        assert daemon.admissible_window(hello) == 300
+        daemon.reserved = 990 * CHUNK_SIZE
+        assert daemon.admissible_window(hello) == 0 # Less than min_window
+        assert daemon.admissible_window(Hello(CHUNK_SIZE, 0, 5, 2, 1)) == 10 # It asks for less than min_window
+        assert daemon.admissible_window(Hello(0, 0, 5, 2, 1)) == 0
+    run_daemon(tmp_path, test, max_buffer_memory=1000 * CHUNK_SIZE, min_window=64)
+
+
+def test_memory_limit(tmp_path, wire):
+    def test(daemon):
+        daemon.datagram_received(wire.hello(1, 600), ('127.0.0.1', 5000))
+        kind, first, window = wire.reply()
+        assert (kind, window) == (ACCEPT, 600)
+        assert daemon.reserved == 600 * CHUNK_SIZE
+        # The second connection gets what is left of the memory
+        daemon.datagram_received(wire.hello(2, 600), ('127.0.0.1', 5001))
+        kind, second, window = wire.reply()
+        assert (kind, window) == (ACCEPT, 400)
+        assert daemon.reserved == 1000 * CHUNK_SIZE
+        # No memory left
+        daemon.datagram_received(wire.hello(3, 600), ('127.0.0.1', 5002))
+        assert wire.reply() == (REJECT, 3, REJECT_BUSY)
+        assert len(daemon.tenants) == 2
+        # Closing a connection gives its memory back
+        daemon.close(daemon.tenants[first])
+        assert daemon.reserved == 400 * CHUNK_SIZE
+        daemon.datagram_received(wire.hello(4, 600), ('127.0.0.1', 5003))
+        assert wire.reply()[0::2] == (ACCEPT, 600)
+    run_daemon(tmp_path, test, max_buffer_memory=1000 * CHUNK_SIZE)
+
+
+def test_connection_limit(tmp_path, wire):
+    def test(daemon):
+        daemon.datagram_received(wire.hello(1, 100), ('127.0.0.1', 5000))
+        assert wire.reply()[0] == ACCEPT
+        daemon.datagram_received(wire.hello(2, 100), ('127.0.0.1', 5001))
+        assert wire.reply() == (REJECT, 2, REJECT_BUSY)
+        # A repeated HELLO of the open connection gets its ACCEPT again
+        daemon.datagram_received(wire.hello(1, 100), ('127.0.0.1', 5000))
+        assert wire.reply()[0] == ACCEPT
+        assert len(daemon.tenants) == 1
+    run_daemon(tmp_path, test, max_connections=1)
+
+
+def test_packets_of_another_host_are_dropped(tmp_path, wire):
+    def test(daemon):
+        daemon.datagram_received(wire.hello(1, 100), ('127.0.0.1', 5000))
+        kind, connectionId, _ = wire.reply()
+        assert kind == ACCEPT
+        connection = daemon.tenants[connectionId].connection
+        daemon.datagram_received(wire.data(connectionId, 0, b'spoofed'), ('10.0.0.9', 5000))
+        assert connection.delivered_chunks == 0
+        daemon.datagram_received(wire.data(connectionId, 0, b'chunk'), ('127.0.0.1', 5000))
+        assert connection.delivered_chunks == 1
+    run_daemon(tmp_path, test)
@@ -0,0 +1,111 @@
+import random
+
+import pytest
+
+from madpFec import FecDecoder, FecEncoder
+
+
+def make_packets(count, seed):
+    """
+    (counter, file_id, chunk_num, flags, payload) of count packets with payloads of different lengths.
+    """
+    rng = random.Random(seed)
+    packets = []
+    for counter in range(count):
+        payload = bytes(rng.randrange(256) for _ in range(rng.randrange(1, 200)))
+        packets.append((1000 + counter, counter % 3, counter, counter & 1, payload))
+    return packets
+
+
+def encode(packets, block_size, parity):
+    encoder = FecEncoder(block_size=block_size, min_repairs=parity, max_repairs=parity)
+    repairs = []
+    for packet in packets:
+        repairs.extend(encoder.add(*packet))
+    repairs.extend(encoder.flush())
+    return repairs
+
+
+def blocks_of(repairs):
+    blocks = {}
+    for repair in repairs:
+        blocks.setdefault(repair[0], []).append(repair)
+    return blocks
+
+
+@pytest.mark.parametrize('parity', [1, 2, 4, 8]) # 1 is XOR parity, more is Cauchy Reed-Solomon
+def test_round_trip(parity):
+    packets = make_packets(40, parity) # Two full blocks and a short last block of 8
+    repairs = encode(packets, 16, parity)
+    blocks = blocks_of(repairs)
+    assert sorted((base, repair[1]) for base, block in blocks.items() for repair in block[:1]) == \
+        [(1000, 16), (1016, 16), (1032, 8)]
+    assert all(len(block) == parity for block in blocks.values())
+
+    rng = random.Random(parity)
+    lost = set()
+    for base, block in blocks.items():
+        lost.update(rng.sample(range(base, base + block[0][1]), parity))
+    decoder = FecDecoder()
+    recovered = []
+    for packet in packets:
+        if packet[0] not in lost:
+            recovered.extend(decoder.add_packet(*packet))
+    for repair in repairs:
+        recovered.extend(decoder.add_repair(*repair))
+    assert sorted(recovered) == sorted(packet for packet in packets if packet[0] in lost)
+    assert decoder.recovered == len(lost)
+    assert not decoder.packets and not decoder.blocks and not decoder.block_of
+
+
+def test_repairs_before_packets():
+    packets = make_packets(16, 7)
+    repairs = encode(packets, 16, 3)
+    decoder = FecDecoder()
+    for repair in repairs:
+        assert decoder.add_repair(*repair) == []
+    recovered = []
+    for packet in packets[3:]:
+        recovered.extend(decoder.add_packet(*packet))
+    assert recovered == packets[:3]
+
+
+def test_lost_repair():
+    packets = make_packets(16, 11)
+    repairs = encode(packets, 16, 3)
+    lost = {1003, 1010}
+    decoder = FecDecoder()
+    for packet in packets:
+        if packet[0] not in lost:
+            decoder.add_packet(*packet)
+    assert decoder.add_repair(*repairs[2]) == [] # Repair 1 lost, one repair for two missing packets
+    recovered = decoder.add_repair(*repairs[0])
+    assert sorted(recovered) == [packet for packet in packets if packet[0] in lost]
+
+
+def test_too_many_losses():
+    packets = make_packets(16, 13)
+    repairs = encode(packets, 16, 2)
+    decoder = FecDecoder()
+    for packet in packets[4:]:
+        decoder.add_packet(*packet)
+    for repair in repairs:
+        assert decoder.add_repair(*repair) == []
+    assert decoder.add_packet(*packets[0]) == [] # Still three missing, one too many
+    assert sorted(decoder.add_packet(*packets[1])) == packets[2:4]
+    assert decoder.recovered == 2
+
+
+def test_payloads_are_copied_out_of_the_receive_slab():
+    packets = make_packets(16, 17)
+    repairs = encode(packets, 16, 1)
+    slab = bytearray(b''.join(packet[4] for packet in packets))
+    decoder = FecDecoder()
+    offset = 0
+    for counter, fileId, chunkNum, flags, payload in packets:
+        if counter != 1005:
+            decoder.add_packet(counter, fileId, chunkNum, flags, memoryview(slab)[offset:offset + len(payload)])
+        offset += len(payload)
+    assert all(type(packet[3]) is bytes for packet in decoder.packets.values())
+    slab[:] = bytes(len(slab)) # The slab is reused once its datagrams are processed
+    assert decoder.add_repair(*repairs[0]) == [packets[5]]
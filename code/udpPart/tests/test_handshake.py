@@ -0,0 +1,152 @@
+import time
+
+import pytest
+
+from madpCodec import MAX_DATAGRAM_SIZE
+from madpHandshake import (ACCEPT, REJECT, REJECT_BUSY, REJECT_CHECKSUM, REJECT_CHUNK_SIZE, REJECT_SIZE,
+                           REJECT_VERSION, TOKEN_FIELDS, Accept, HandshakeAcceptor, Hello, decode_reject)
+from madpIntegrity import BLAKE2B, CRC32, MD5
+from madpPmtu import chunk_size
+
+KEY = bytes(range(32))
+HOST = '10.0.0.1'
+CHUNK_SIZE = 1024
+
+
+def hello(**fields):
+    settings = dict(chunk_size=CHUNK_SIZE, initial_seq_num=7, window=500, total_chunks=10, ack_port=40000)
+    settings.update(fields)
+    return Hello(**settings)
+
+
+def connect(acceptor, message, hello_id=1234, host=HOST, checksum=CRC32, **kwargs):
+    return acceptor.on_hello(checksum, hello_id, message.encode(), host, **kwargs)
+
+
+def test_accept():
+    acceptor = HandshakeAcceptor(KEY, window=300)
+    kind, connectionId, reply, decoded, accept = connect(acceptor, hello(size=5000, files=3))
+    assert kind == ACCEPT
+    assert connectionId != 1234 # No token, the receiver assigns the id
+    assert (decoded.size, decoded.files, decoded.initial_seq_num) == (5000, 3, 7)
+    accept = Accept.decode(reply)
+    assert accept.checksum is CRC32
+    assert accept.hello_id == 1234
+    assert accept.window == 300 # The receiver grants no more than its reorder buffer
+    assert acceptor.check_token(accept.token, HOST) == (CHUNK_SIZE, 300, CRC32)
+
+
+def test_pick_checksum():
+    acceptor = HandshakeAcceptor(KEY, checksums=[BLAKE2B, MD5])
+    assert acceptor.pick_checksum(MD5, [CRC32, MD5, BLAKE2B]) is MD5
+    assert acceptor.pick_checksum(CRC32, [CRC32, MD5, BLAKE2B]) is BLAKE2B
+
+
+def rejected(message, **settings):
+    window = settings.pop('window', None)
+    kind, connectionId, reply, decoded, accept = connect(HandshakeAcceptor(KEY, **settings), message, window=window)
+    assert kind == REJECT
+    assert connectionId == 1234
+    assert accept is None
+    return decode_reject(reply)
+
+
+def test_reject_version():
+    message = hello()
+    message.version = 2
+    assert rejected(message) == REJECT_VERSION
+
+
+def test_reject_checksum():
+    assert rejected(hello(checksums=[CRC32, MD5]), checksums=[BLAKE2B]) == REJECT_CHECKSUM
+
+
+@pytest.mark.parametrize('size', [0, chunk_size(MAX_DATAGRAM_SIZE, CRC32) + 1])
+def test_reject_chunk_size(size):
+    assert rejected(hello(chunk_size=size)) == REJECT_CHUNK_SIZE
+
+
+def test_reject_size():
+    assert rejected(hello(size=10001), max_size=10000) == REJECT_SIZE
+    assert connect(HandshakeAcceptor(KEY, max_size=10000), hello(size=10000))[0] == ACCEPT
+
+
+def test_reject_busy():
+    assert rejected(hello(), window=0) == REJECT_BUSY
+
+
+def test_truncated_hello():
+    acceptor = HandshakeAcceptor(KEY)
+    assert acceptor.on_hello(CRC32, 1234, hello().encode()[:10], HOST) == (None,) * 5
+
+
+def test_token():
+    acceptor = HandshakeAcceptor(KEY)
+    token = acceptor.issue_token(HOST, CHUNK_SIZE, 200, MD5)
+    assert acceptor.check_token(token, HOST) == (CHUNK_SIZE, 200, MD5)
+    tampered = bytearray(token)
+    tampered[TOKEN_FIELDS.size - 5] ^= 1 # A larger window
+    assert acceptor.check_token(bytes(tampered), HOST) is None
+    assert acceptor.check_token(token, '10.0.0.2') is None # Issued to another host
+    assert acceptor.check_token(token[:-1], HOST) is None
+    assert HandshakeAcceptor(bytes(32)).check_token(token, HOST) is None # Another key
+
+
+def later(monkeypatch, seconds):
+    now = time.time() + seconds
+    monkeypatch.setattr(time, 'time', lambda: now)
+
+
+def test_expired_token(monkeypatch):
+    acceptor = HandshakeAcceptor(KEY, lifetime=3600)
+    token = acceptor.issue_token(HOST, CHUNK_SIZE, 200, MD5)
+    later(monkeypatch, 3599)
+    assert acceptor.check_token(token, HOST) is not None
+    later(monkeypatch, 3601)
+    assert acceptor.check_token(token, HOST) is None
+
+
+def resumption(acceptor, **fields):
+    """
+    A HELLO with the token of an earlier connection, for 0-RTT.
+    """
+    accept = connect(acceptor, hello())[4]
+    return hello(token=accept.token, window=accept.window, **fields)
+
+
+def test_zero_rtt():
+    acceptor = HandshakeAcceptor(KEY)
+    message = resumption(acceptor)
+    assert message.zero_rtt
+    kind, connectionId, reply, decoded, accept = connect(acceptor, message, hello_id=99)
+    assert (kind, connectionId) == (ACCEPT, 99) # The first flight is taken
+    assert accept.token != message.token # A fresh token for the next connection
+
+
+def test_zero_rtt_id_in_use():
+    acceptor = HandshakeAcceptor(KEY)
+    message = resumption(acceptor)
+    kind, connectionId, reply, decoded, accept = connect(acceptor, message, hello_id=99, in_use={99, 100})
+    assert kind == ACCEPT
+    assert connectionId not in (99, 100)
+    assert accept.hello_id == 99 # The sender still matches the ACCEPT to its HELLO
+
+
+@pytest.mark.parametrize('case', ['host', 'expired', 'chunk_size', 'checksum', 'window'])
+def test_zero_rtt_refused(case, monkeypatch):
+    acceptor = HandshakeAcceptor(KEY, lifetime=3600)
+    message = resumption(acceptor)
+    host, checksum = HOST, CRC32
+    if case == 'expired':
+        later(monkeypatch, 3601)
+    elif case == 'host':
+        host = '10.0.0.2'
+    elif case == 'chunk_size':
+        message.chunk_size = CHUNK_SIZE - 1
+    elif case == 'checksum':
+        checksum = MD5
+    elif case == 'window':
+        message.window += 1
+    kind, connectionId, reply, decoded, accept = connect(acceptor, message, hello_id=99, host=host, checksum=checksum)
+    assert kind == ACCEPT # The connection goes on without its first flight
+    assert connectionId != 99
@@ -0,0 +1,84 @@
+import pytest
+
+from conftest import CaptureSocket
+from madpCodec import DATA_FIELDS, LAST_CHUNK, PacketEncoder, decode_ack, decode_data, decode_repair, verify_data
+from madpIntegrity import CHECKSUMS, get_checksum
+
+ALGORITHMS = sorted(CHECKSUMS.values(), key=lambda checksum: checksum.type_id)
+
+
+def encode_data(checksum, payload=b'madp' * 350):
+    encoder = PacketEncoder(checksum, ack_frequency=2, ack_delay=0.025, connection_id=7)
+    sock = CaptureSocket()
+    encoder.send_data(sock, None, 41, 3, 12, LAST_CHUNK, payload)
+    return bytearray(sock.packets[0])
+
+
+@pytest.mark.parametrize('checksum', ALGORITHMS, ids=lambda checksum: checksum.name)
+def test_data_round_trip(checksum):
+    payload = bytes(range(256)) * 5
+    packet = encode_data(checksum, payload)
+    assert len(packet) == DATA_FIELDS.size + checksum.size + len(payload)
+    assert verify_data(packet)
+    valid, used, _, connectionId, seqNum, fileId, chunkNum, flags, ackFrequency, ackDelay, data = decode_data(packet)
+    assert valid
+    assert used is checksum
+    assert (connectionId, seqNum, fileId, chunkNum, flags, ackFrequency, ackDelay) == (7, 41, 3, 12, LAST_CHUNK, 2, 25)
+    assert bytes(data) == payload
+
+
+@pytest.mark.parametrize('checksum', ALGORITHMS, ids=lambda checksum: checksum.name)
+def test_empty_payload(checksum):
+    packet = encode_data(checksum, b'')
+    assert decode_data(packet)[0]
+    assert bytes(decode_data(packet)[-1]) == b''
+
+
+@pytest.mark.parametrize('checksum', ALGORITHMS, ids=lambda checksum: checksum.name)
+@pytest.mark.parametrize('position', [0, 700, -1])
+def test_flipped_payload_bit_is_rejected(checksum, position):
+    packet = encode_data(checksum)
+    packet[DATA_FIELDS.size + checksum.size + position if position >= 0 else position] ^= 0x10
+    assert not verify_data(packet)
+    assert decode_data(packet) == (False,) + (None,) * 10
+
+
+@pytest.mark.parametrize('checksum', ALGORITHMS, ids=lambda checksum: checksum.name)
+def test_flipped_header_bit_is_rejected(checksum):
+    for offset in (5, 16, 27, 28): # Send time, sequence number, ACK delay, checksum
+        packet = encode_data(checksum)
+        packet[offset] ^= 0x01
+        assert not decode_data(packet)[0]
+
+
+@pytest.mark.parametrize('checksum', ALGORITHMS, ids=lambda checksum: checksum.name)
+def test_repair_and_ack_round_trip(checksum):
+    encoder = PacketEncoder(checksum, connection_id=7)
+    sock = CaptureSocket()
+    encoder.send_repair(sock, None, 100, 16, 1, 2, b'parity' * 100)
+    encoder.send_ack(sock, None, 1.5, 99, [(101, 104)], recovered=3)
+    repair, ack = sock.packets
+    valid, used, _, connectionId, baseSeq, count, row, repairs, payload = decode_repair(repair)
+    assert valid and used is checksum
+    assert (connectionId, baseSeq, count, row, repairs) == (7, 100, 16, 1, 2)
+    assert bytes(payload) == b'parity' * 100
+    assert decode_ack(ack) == (True, 1.5, 99, 3, [(101, 104)])
+    corrupted = bytearray(ack)
+    corrupted[-1] ^= 1 # The last SACK block
+    assert not decode_ack(corrupted)[0]
+
+
+def test_truncated_and_unknown_packets_are_rejected():
+    packet = encode_data(get_checksum('md5'))
+    assert not decode_data(packet[:DATA_FIELDS.size + 8])[0] # Cut inside the checksum
+    assert not decode_data(packet[:10])[0]
+    packet[0] = 0x3f # No algorithm has this type id
+    assert not decode_data(packet)[0]
+
+
+def test_get_checksum():
+    for name, checksum in CHECKSUMS.items():
+        assert get_checksum(name) is checksum
+    assert len({checksum.type_id for checksum in ALGORITHMS}) == len(ALGORITHMS)
+    with pytest.raises(ValueError, match='bogus'):
+        get_checksum('bogus')
@@ -0,0 +1,80 @@
+import os
+import re
+import shutil
+import subprocess
+import sys
+
+from conftest import free_port
+
+UDP_PART = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TIMEOUT = 60
+
+
+def deploy(tmp_path, **settings):
+    """
+    A copy of the scripts with the receiver on 127.0.0.1 and free ports, next to an objects
+    folder at ../app/objects, where the sender takes the files from.
+
+    Args:
+        settings: Values of the settings of madpSender.py, e.g. COMPRESSION_LEVEL=6.
+    """
+    code = tmp_path / 'udpPart'
+    shutil.copytree(UDP_PART, code, ignore=shutil.ignore_patterns('tests', '__pycache__', 'received'))
+    dataPort, ackPort = free_port(), free_port()
+    senderSettings = [(re.search(rf'^{name} = .*$', (code / 'madpSender.py').read_text(), re.M).group(),
+                       f'{name} = {value!r}') for name, value in settings.items()]
+    for name, replacements in (('madpSender.py', [("'172.17.0.2'", "'127.0.0.1'"), ('65432', str(dataPort)),
+                                                  ('65433', str(ackPort))] + senderSettings),
+                               ('madpReceiver.py', [('65432', str(dataPort))])):
+        path = code / name
+        source = path.read_text()
+        for old, new in replacements:
+            assert old in source
+            source = source.replace(old, new)
+        path.write_text(source)
+    objects = tmp_path / 'app' / 'objects'
+    (objects / 'nested' / 'deeper').mkdir(parents=True)
+    for i, size in enumerate([0, 1, 1399, 1400, 1401, 100000, 3 * 1024 * 1024]):
+        (objects / f'object-{i}.obj').write_bytes(os.urandom(size))
+    for i in range(20):
+        (objects / 'nested' / f'small-{i}.obj').write_bytes(os.urandom(i * 37))
+    (objects / 'nested' / 'deeper' / 'compressible.txt').write_bytes(b'madp ' * 50000)
+    # The token key of the receiver and the session cache of the sender are kept under ~/.madp
+    env = dict(os.environ, HOME=str(tmp_path))
+    return code, objects, env
+
+
+def transfer(code, env):
+    receiver = subprocess.Popen([sys.executable, 'madpReceiver.py'], cwd=code, env=env,
+                                stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    try:
+        sender = subprocess.run([sys.executable, 'madpSender.py'], cwd=code, env=env, timeout=TIMEOUT,
+                                stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        output, _ = receiver.communicate(timeout=TIMEOUT)
+    finally:
+        receiver.kill()
+    assert sender.returncode == 0, sender.stdout.decode()
+    assert receiver.returncode == 0, output.decode()
+
+
+def test_loopback_transfer(tmp_path):
+    code, objects, env = deploy(tmp_path)
+    transfer(code, env)
+    subprocess.run(['diff', '-r', objects, code / 'received'], check=True)
+    # The second transfer resumes the session of the first one, with data in its first flight
+    assert (code.parent / '.madp' / 'sessions.json').exists()
+    shutil.rmtree(code / 'received')
+    transfer(code, env)
+    subprocess.run(['diff', '-r', objects, code / 'received'], check=True)
+
+
+def test_loopback_compressed_transfer(tmp_path):
+    code, objects, env = deploy(tmp_path, COMPRESSION_LEVEL=6)
+    transfer(code, env)
+    subprocess.run(['diff', '-r', objects, code / 'received'], check=True)
+
+
+def test_loopback_cubic_transfer(tmp_path):
+    code, objects, env = deploy(tmp_path, CONGESTION_CONTROL='cubic')
+    transfer(code, env)
+    subprocess.run(['diff', '-r', objects, code / 'received'], check=True)
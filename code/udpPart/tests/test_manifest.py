@@ -0,0 +1,91 @@
+import os
+import resource
+import subprocess
+import sys
+
+import pytest
+
+from madpManifest import MANIFEST_FILE_ID, Manifest
+from madpSource import ChunkIndex
+
+UDP_PART = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FILES = 3000
+
+
+@pytest.fixture
+def tree(tmp_path):
+    """
+    A tree of FILES small files in nested directories, some of them empty.
+    """
+    contents = {}
+    for i in range(FILES):
+        path = f"d{i % 25}/e{i % 7}/f{i}.bin"
+        data = os.urandom(i % 3000)
+        os.makedirs(tmp_path / os.path.dirname(path), exist_ok=True)
+        (tmp_path / path).write_bytes(data)
+        contents[path] = data
+    return tmp_path, contents
+
+
+@pytest.fixture
+def low_fd_limit():
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (min(256, hard), hard))
+    yield
+    resource.setrlimit(resource.RLIMIT_NOFILE, (soft, hard))
+
+
+def test_manifest_round_trip(tree):
+    root, contents = tree
+    manifest = Manifest.from_directory(str(root), 1400)
+    assert len(manifest) == FILES
+    assert dict(zip(manifest.paths, manifest.sizes)) == {path: len(data) for path, data in contents.items()}
+    decoded = Manifest.decode(manifest.encode())
+    assert decoded.paths == manifest.paths
+    assert decoded.sizes == manifest.sizes
+    assert decoded.chunk_size == 1400
+
+
+def test_index_more_files_than_descriptors(tree, low_fd_limit):
+    root, contents = tree
+    manifest = Manifest.from_directory(str(root), 1400)
+    index = ChunkIndex(1400)
+    index.add_buffer(manifest.encode(), MANIFEST_FILE_ID)
+    for file_id, path, size in manifest:
+        index.add_file(os.path.join(str(root), *path.split('/')), file_id)
+    assert len(index.open_maps) == 0 # Nothing is mapped before it is sent
+    files = {}
+    for seq in range(len(index)):
+        file_id, chunk_num, payload, flag = index[seq]
+        if file_id != MANIFEST_FILE_ID:
+            files.setdefault(file_id, []).append((chunk_num, bytes(payload), flag))
+    assert len(index.open_maps) <= index.max_open
+    index.close()
+    for file_id, path in enumerate(manifest.paths):
+        chunks = sorted(files[file_id])
+        assert [chunk_num for chunk_num, _, _ in chunks] == list(range(len(chunks)))
+        assert [flag for _, _, flag in chunks] == [0] * (len(chunks) - 1) + [1]
+        assert b''.join(data for _, data, _ in chunks) == contents[path]
+
+
+def test_tcp_part_shares_the_manifest():
+    # The TCP baseline imports the manifest of udpPart, and still its own utils
+    tcpPart = os.path.join(UDP_PART, os.pardir, 'tcpPart')
+    result = subprocess.run([sys.executable, '-c', 'import client, server, madpManifest, utils; '
+                             'print(madpManifest.__file__); print(utils.__file__)'],
+                            cwd=tcpPart, capture_output=True, text=True, check=True)
+    manifest, utils = result.stdout.split()
+    assert os.path.samefile(manifest, os.path.join(UDP_PART, 'madpManifest.py'))
+    assert os.path.samefile(utils, os.path.join(tcpPart, 'utils.py'))
+
+
+def test_mapped_chunks(tree, low_fd_limit, monkeypatch):
+    import madpSender
+    root, contents = tree
+    monkeypatch.setattr(madpSender, 'DATA_FOLDER', str(root))
+    monkeypatch.setattr(madpSender, 'COMPRESSION_LEVEL', 0)
+    index, totalChunks, scheduler, manifest = madpSender.mapped_chunks(1400)
+    assert len(manifest) == FILES
+    assert totalChunks == len(index) == manifest.total_chunks() + index.file_range(MANIFEST_FILE_ID)[1]
+    assert sum(len(index[seq][2]) for seq in range(totalChunks)) == sum(manifest.sizes) + len(manifest.encode())
+    index.close()
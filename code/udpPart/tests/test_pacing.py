@@ -0,0 +1,62 @@
+import pytest
+
+from madpPacing import Pacer
+
+
+def pacer(window=100, srtt=0.1, min_delay=0.0):
+    # 1000 packets per second with a gain of 1, the clock is passed to reserve
+    pacer = Pacer(gain=1.0, burst=0.01, min_delay=min_delay)
+    pacer.update(window, srtt)
+    pacer.stamp = 0.0
+    return pacer
+
+
+def test_no_pacing_before_the_first_rtt_sample():
+    pacer = Pacer()
+    assert all(pacer.reserve() == 0.0 for _ in range(1000))
+
+
+def test_rate():
+    assert pacer().rate == 1000
+    paced = Pacer(gain=1.25)
+    paced.update(100, 0.1)
+    assert paced.rate == pytest.approx(1250)
+    paced.update(100, 0.1, slow_start=True)
+    assert paced.rate == pytest.approx(2000)
+
+
+def test_tokens_refill_at_the_rate():
+    paced = pacer()
+    # A burst at one instant goes into debt, one packet interval per packet
+    assert [paced.reserve(0.0) for _ in range(3)] == pytest.approx([0.001, 0.002, 0.003])
+    for _ in range(97):
+        paced.reserve(0.0)
+    assert paced.tokens == -100
+    # 50 ms later 50 tokens were paid back, the next packet waits for the other 50 and its own
+    assert paced.reserve(0.05) == pytest.approx(0.051)
+    # Sending exactly at the rate keeps the debt constant
+    for i in range(1, 20):
+        assert paced.reserve(0.05 + i * 0.001) == pytest.approx(0.051)
+
+
+def test_burst_cap_after_an_idle_period():
+    paced = pacer()
+    assert paced.depth == 10 # burst * rate
+    paced.reserve(0.0)
+    delays = [paced.reserve(60.0) for _ in range(13)]
+    # A minute idle fills the bucket to its depth only, not to 60000 tokens
+    assert delays[:10] == [0.0] * 10
+    assert delays[10:] == pytest.approx([0.001, 0.002, 0.003])
+
+
+def test_burst_is_at_least_two_packets():
+    paced = pacer(window=10, srtt=1.0) # 10 packets per second, 0.1 packet worth of burst
+    assert paced.depth == 2.0
+    paced.reserve(0.0)
+    assert [paced.reserve(100.0) for _ in range(3)] == pytest.approx([0.0, 0.0, 0.1])
+
+
+def test_short_debts_are_not_slept_on():
+    paced = pacer(min_delay=0.0025)
+    # The first two debts are paid off by the sleep of the third packet
+    assert [paced.reserve(0.0) for _ in range(4)] == pytest.approx([0.0, 0.0, 0.003, 0.004])
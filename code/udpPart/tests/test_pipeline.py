@@ -0,0 +1,127 @@
+import errno
+import time
+
+import pytest
+
+from conftest import CaptureSocket
+from madpCodec import PacketEncoder
+from madpConnection import ReceiverConnection
+from madpIntegrity import CRC32, MD5
+from madpPipeline import BatchVerifier, DiskWriter, holds_gil
+
+
+def packets(checksum, count, size):
+    encoder = PacketEncoder(checksum)
+    sock = CaptureSocket()
+    for seq in range(count):
+        encoder.send_data(sock, None, seq, 1, seq, 0, bytes([seq]) * size)
+    return [bytearray(packet) for packet in sock.packets]
+
+
+def test_holds_gil():
+    assert holds_gil(packets(CRC32, 4, 1400)) # zlib keeps the GIL up to 5 KiB
+    assert not holds_gil(packets(CRC32, 4, 6000))
+    assert holds_gil(packets(MD5, 4, 1400))
+    assert not holds_gil(packets(MD5, 4, 4000)) # hashlib releases it from 2 KiB
+    assert holds_gil([b'', b'\x3f']) # Unknown checksum types are rejected inline
+
+
+@pytest.mark.parametrize('checksum, size', [(CRC32, 1400), (MD5, 4000)])
+def test_bad_checksums_reach_the_receive_loop(checksum, size):
+    verifier = BatchVerifier(threads=2, limit=2)
+    first = packets(checksum, 4, size)
+    second = packets(checksum, 4, size)
+    first[1][-1] ^= 1 # A flipped payload bit
+    second[3][20] ^= 1 # A flipped header bit
+    verifier.submit(first, ['a'] * 4)
+    verifier.submit(second, ['b'] * 4)
+    assert verifier.full()
+    results = []
+    while len(verifier):
+        results.extend(verifier.completed(wait=True))
+    verifier.close()
+    assert [valid for _, valid, _ in results] == [True, False, True, True, True, True, True, False]
+    assert [source for _, _, source in results] == ['a'] * 4 + ['b'] * 4
+    assert [packet for packet, _, _ in results] == first + second # In submission order
+
+
+def test_inline_batches_are_done_on_submit():
+    verifier = BatchVerifier()
+    verifier.submit(packets(CRC32, 2, 1400), [None, None])
+    assert len(verifier.completed()) == 2
+    verifier.close()
+
+
+def test_close_drops_pending_batches():
+    verifier = BatchVerifier(threads=1)
+    for _ in range(4):
+        verifier.submit(packets(MD5, 8, 60000), [None] * 8)
+    verifier.close()
+    assert len(verifier) == 0
+    assert verifier.completed(wait=True) == []
+
+
+class Reassembler:
+    """
+    Records the chunks written, and fails on the chunk numbers in fail_at.
+    """
+    def __init__(self, fail_at=(), delay=0.0):
+        self.chunks = []
+        self.manifest = None
+        self.fail_at = fail_at
+        self.delay = delay
+
+    def set_manifest(self, manifest):
+        self.manifest = manifest
+
+    def add_chunk(self, file_id, chunk_number, data, flags):
+        time.sleep(self.delay)
+        if chunk_number in self.fail_at:
+            raise OSError(errno.ENOSPC, "No space left on device")
+        self.chunks.append((file_id, chunk_number, data, flags))
+
+
+def test_close_waits_for_the_queued_chunks():
+    reassembler = Reassembler(delay=0.01)
+    writer = DiskWriter(reassembler)
+    writer.set_manifest('manifest')
+    for chunk in range(10):
+        writer.add_chunk(1, chunk, b'x', 0)
+    writer.close()
+    assert reassembler.manifest == 'manifest'
+    assert [chunk[1] for chunk in reassembler.chunks] == list(range(10))
+
+
+def wait_for_error(writer):
+    deadline = time.monotonic() + 5
+    while writer.error is None and time.monotonic() < deadline:
+        time.sleep(0.001)
+
+
+def test_write_error_reaches_the_receive_loop():
+    reassembler = Reassembler(fail_at={2})
+    writer = DiskWriter(reassembler, limit=2)
+    for chunk in range(4):
+        writer.add_chunk(1, chunk, b'x', 0)
+    wait_for_error(writer)
+    with pytest.raises(OSError) as error:
+        writer.add_chunk(1, 4, b'x', 0)
+    assert error.value.errno == errno.ENOSPC
+    with pytest.raises(OSError):
+        writer.set_manifest(None)
+    with pytest.raises(OSError):
+        writer.close()
+    assert [chunk[1] for chunk in reassembler.chunks] == [0, 1] # Nothing is written after the failure
+    assert not writer.thread.is_alive()
+
+
+def test_write_error_reaches_the_connection():
+    writer = DiskWriter(Reassembler(fail_at={0}))
+    connection = ReceiverConnection(0, writer, window=16, total_chunks=4, checksum=CRC32)
+    data = packets(CRC32, 4, 100)
+    connection.on_data(data[0])
+    wait_for_error(writer)
+    with pytest.raises(OSError):
+        connection.on_data(data[1])
+    with pytest.raises(OSError):
+        writer.close()
@@ -0,0 +1,76 @@
+import pytest
+
+from madpCodec import MAX_DATAGRAM_SIZE
+from madpPmtu import BASE_DATAGRAM_SIZE, PathMtuSearch
+
+
+def search_path(path_size, lost=lambda size, attempt: False, receiver_max=MAX_DATAGRAM_SIZE, local_size=None,
+                **settings):
+    """
+    Run a search over a simulated path that carries datagrams up to path_size.
+
+    Args:
+        lost (callable): lost(size, attempt) tells whether the probe of the attempt of size is lost.
+        local_size (int): Largest datagram the local interface sends, larger probes fail to be sent.
+
+    Returns:
+        PathMtuSearch: The finished search.
+    """
+    search = PathMtuSearch(**settings)
+    sent = {}
+    while not search.done:
+        attempt = (search.round, search.attempts)
+        arrived = []
+        for size in search.probes():
+            if local_size is not None and size > local_size:
+                search.on_failure(size)
+                continue
+            sent[size] = sent.get(size, 0) + 1
+            if size <= path_size and size <= receiver_max and not lost(size, sent[size]):
+                arrived.append(size)
+        if (search.round, search.attempts) != attempt:
+            continue
+        for size in arrived:
+            search.on_ack(size, receiver_max)
+        if not search.done and (search.round, search.attempts) == attempt:
+            search.on_timeout()
+        assert search.round < 10
+    return search
+
+
+@pytest.mark.parametrize('path_size', [1200, 1371, 1437, 1472, 3000, 8972])
+def test_converges(path_size):
+    search = search_path(path_size)
+    assert path_size - search.resolution < search.result <= path_size
+
+
+@pytest.mark.parametrize('path_size', [1437, 3000])
+def test_converges_with_lost_probes(path_size):
+    # Every probe is lost twice before it gets through, and the probes of some smaller sizes never do
+    def lost(size, attempt):
+        return attempt < 3 or (size % 3 == 0 and size < path_size - 64)
+    search = search_path(path_size, lost)
+    assert path_size - search.resolution < search.result <= path_size
+
+
+def test_single_lost_probe_is_not_the_mtu():
+    # Only the largest size that goes through is lost, once
+    search = search_path(1472, lambda size, attempt: size == 1472 and attempt == 1)
+    assert search.result == 1472
+
+
+def test_receiver_max():
+    search = search_path(8972, receiver_max=2000)
+    assert 2000 - search.resolution < search.result <= 2000
+    assert search.receiver_max == 2000
+
+
+def test_local_interface_limit():
+    search = search_path(8972, local_size=1472)
+    assert 1472 - search.resolution < search.result <= 1472
+
+
+def test_nothing_gets_through():
+    search = search_path(BASE_DATAGRAM_SIZE - 1)
+    assert search.done
+    assert search.result is None
@@ -0,0 +1,84 @@
+from conftest import CaptureSocket
+from madpCodec import PacketEncoder
+from madpConnection import ReceiverConnection
+from madpIntegrity import CRC32
+from madpReorder import ReorderBuffer
+from utils import FileReassembler
+
+
+def drain(buffer, seq):
+    delivered = []
+    released = buffer.drain(seq, lambda *packet: delivered.append(packet))
+    return released, delivered
+
+
+def put(buffer, seq, payload=True):
+    return buffer.put(seq, 1, seq, bytes([seq]) if payload else None, 0)
+
+
+def test_drain_delivers_in_order():
+    buffer = ReorderBuffer(8)
+    for seq in (3, 1, 2, 5):
+        assert put(buffer, seq)
+    assert not put(buffer, 2) # Already buffered
+    assert len(buffer) == 4
+    assert drain(buffer, 0) == (0, []) # The expected packet is missing
+    released, delivered = drain(buffer, 1)
+    assert released == 3
+    assert delivered == [(1, seq, bytes([seq]), 0) for seq in (1, 2, 3)]
+    assert 5 in buffer and 4 not in buffer
+    assert len(buffer) == 1
+
+
+def test_ring_wraparound():
+    buffer = ReorderBuffer(8)
+    for seq in range(6): # Slots 0 to 5 are used and released once
+        put(buffer, seq)
+    drain(buffer, 0)
+    for seq in reversed(range(7, 14)): # Slots 7, 0, 1, ..., 5
+        put(buffer, seq)
+    assert drain(buffer, 6) == (0, [])
+    released, delivered = drain(buffer, 7)
+    assert released == 7
+    assert [packet[1] for packet in delivered] == list(range(7, 14))
+    assert len(buffer) == 0 and not any(buffer.present)
+
+
+def test_full_ring():
+    buffer = ReorderBuffer(8)
+    for seq in range(13, 21): # Every slot, starting in the middle of the ring
+        put(buffer, seq)
+    released, delivered = drain(buffer, 13)
+    assert released == 8
+    assert [packet[1] for packet in delivered] == list(range(13, 21))
+
+
+def test_delivered_packets_are_released_only():
+    buffer = ReorderBuffer(8)
+    put(buffer, 1)
+    put(buffer, 2, payload=False) # Delivered to its stream already, only keeps its place
+    put(buffer, 3)
+    released, delivered = drain(buffer, 1)
+    assert released == 3
+    assert [packet[1] for packet in delivered] == [1, 3]
+    assert buffer.payloads == [None] * 8 # No payload is kept alive
+
+
+def test_packets_beyond_the_window_are_dropped(tmp_path):
+    receiver = ReceiverConnection(0, FileReassembler(tmp_path), window=8, total_chunks=12, checksum=CRC32)
+    encoder = PacketEncoder(CRC32)
+    wire = CaptureSocket()
+    for seq in range(12):
+        encoder.send_data(wire, None, seq, 1, seq, 1 if seq == 11 else 0, bytes([seq]) * 10)
+    for seq in range(1, 10):
+        assert receiver.on_data(wire.packets[seq]) is not None # Every packet is acknowledged
+    assert receiver.delivered_chunks == 0
+    # Packets 1 to 7 are buffered, 8 and 9 are 8 or more ahead of the expected packet 0
+    assert len(receiver.buffer) == 7
+    assert receiver.sack_ranges.starts == [1] and receiver.sack_ranges.ends == [8]
+    receiver.on_data(wire.packets[0])
+    assert receiver.delivered_chunks == 8 and len(receiver.buffer) == 0
+    for seq in range(8, 12): # Sent again once they are within the window
+        receiver.on_data(wire.packets[seq])
+    assert receiver.complete
+    assert (tmp_path / 'reconstructed_1.obj').read_bytes() == b''.join(bytes([seq]) * 10 for seq in range(12))
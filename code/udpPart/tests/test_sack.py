@@ -0,0 +1,164 @@
+from conftest import CaptureSocket
+from madpCodec import PacketEncoder
+from madpConnection import ReceiverConnection, SenderConnection
+from madpIntegrity import CRC32
+from madpSack import SackRanges, Scoreboard
+from utils import SEQ_MODULUS, FileReassembler, seq_add, seq_diff, seq_lt, seq_unwrap
+
+
+def ranges(sack):
+    return list(zip(sack.starts, sack.ends))
+
+
+def test_ranges_merge():
+    sack = SackRanges()
+    for seq in (10, 12, 14):
+        sack.add(seq)
+    assert ranges(sack) == [(10, 11), (12, 13), (14, 15)]
+    sack.add(11) # Joins both neighbours
+    assert ranges(sack) == [(10, 13), (14, 15)]
+    sack.add(13)
+    assert ranges(sack) == [(10, 15)]
+    sack.add(12) # Already recorded
+    sack.add(9) # Joins the right neighbour
+    sack.add(15) # Joins the left neighbour
+    assert ranges(sack) == [(9, 16)]
+    sack.add(20)
+    sack.add(5)
+    assert ranges(sack) == [(5, 6), (9, 16), (20, 21)]
+    assert len(sack) == 3
+
+
+def test_ranges_discard_below():
+    sack = SackRanges()
+    for seq in (3, 4, 5, 8, 9, 12):
+        sack.add(seq)
+    sack.discard_below(4)
+    assert ranges(sack) == [(4, 6), (8, 10), (12, 13)]
+    sack.discard_below(10)
+    assert ranges(sack) == [(12, 13)]
+    sack.discard_below(13)
+    assert len(sack) == 0
+
+
+def test_blocks_report_the_recent_range_first():
+    sack = SackRanges()
+    for seq in (2, 5, 6, 9, 13):
+        sack.add(seq)
+    assert sack.blocks() == [(2, 3), (5, 7), (9, 10), (13, 14)]
+    assert sack.blocks(recent=9) == [(9, 10), (2, 3), (5, 7), (13, 14)]
+    assert sack.blocks(recent=6, limit=2) == [(5, 7), (2, 3)]
+    assert sack.blocks(recent=7) == sack.blocks() # Not buffered
+
+
+def test_serial_arithmetic_wraps():
+    last = SEQ_MODULUS - 1
+    assert seq_add(last, 1) == 0
+    assert seq_add(0, -1) == last
+    assert seq_diff(2, last) == 3
+    assert seq_diff(last, 2) == -3
+    assert seq_lt(last, 0) and not seq_lt(0, last)
+    assert seq_diff(SEQ_MODULUS // 2 - 1, 0) == SEQ_MODULUS // 2 - 1
+    assert seq_diff(SEQ_MODULUS // 2, 0) == -SEQ_MODULUS // 2
+    # Unwrapped next to an unbounded counter that already crossed the wrap, and one that did not yet
+    assert seq_unwrap(1, SEQ_MODULUS - 2) == SEQ_MODULUS + 1
+    assert seq_unwrap(last, SEQ_MODULUS + 3) == SEQ_MODULUS - 1
+    assert seq_unwrap(5, 3 * SEQ_MODULUS) == 3 * SEQ_MODULUS + 5
+
+
+def test_scoreboard_counts():
+    board = Scoreboard(20)
+    assert board.mark(4, 8) == 4
+    assert board.mark(6, 10) == 2 # 6 and 7 were SACKed already
+    assert board.sacked_in_window == 6
+    assert board.highest_sacked == 10
+    assert board.advance(5) == 4 # 0..3 and the SACKed 4
+    assert board.sacked_in_window == 5
+    assert board.mark(0, 5) == 0 # Below the base
+    assert board.advance(5) == 0
+    assert board.last_hole(12) == 11
+    assert board.holes(12) == [10, 11]
+
+
+def test_hole_is_lost_after_three_sacked_packets():
+    board = Scoreboard(20)
+    board.mark(1, 3)
+    assert board.lost(10) == [] # Two packets above the hole
+    board.mark(3, 4)
+    assert board.lost(10) == [0]
+    assert board.lost(10) == [] # Declared once
+    board.mark(5, 6)
+    assert board.lost(10) == [] # 4 has only 5 above it
+    board.mark(6, 8)
+    assert board.lost(10) == [4]
+
+
+def test_lost_retransmission_is_declared_again():
+    board = Scoreboard(30)
+    board.mark(1, 4)
+    assert board.lost(10) == [0] # Retransmitted when 10 packets were sent
+    board.mark(4, 10)
+    assert board.lost(10) == [] # Only packets sent before the retransmission were SACKed
+    board.mark(10, 13)
+    assert board.lost(13) == [0] # Three packets sent after it overtook it
+    board.mark(0, 1)
+    board.mark(13, 16)
+    assert board.lost(16) == []
+
+
+def test_early_retransmit_with_few_packets_outstanding():
+    board = Scoreboard(10)
+    board.mark(1, 3)
+    assert board.lost(3) == [0] # Threshold lowered to sent - base - 1 = 2
+    board = Scoreboard(10)
+    assert board.lost(2) == []
+    assert board.lost(2, fast_retransmit=True) == [0]
+
+
+def test_timeout_declares_every_hole():
+    board = Scoreboard(10)
+    board.mark(2, 3)
+    board.mark(5, 6)
+    assert board.lost(8) == []
+    assert board.holes(8) == [0, 1, 3, 4, 6, 7]
+
+
+def test_sack_across_the_sequence_wrap(tmp_path):
+    initial = SEQ_MODULUS - 4 # Wire sequence numbers wrap after the fourth packet
+    chunks = [(1, i, bytes([i]) * 10, 1 if i == 9 else 0) for i in range(10)]
+    sender = SenderConnection(chunks, CRC32, initial, pacing_gain=0)
+    receiver = ReceiverConnection(initial, FileReassembler(tmp_path), window=64, total_chunks=10, checksum=CRC32)
+    encoder = PacketEncoder(CRC32)
+    encoder.gso = False
+    ackEncoder = PacketEncoder(CRC32)
+    wire = CaptureSocket()
+    acks = CaptureSocket()
+    packets, _, _ = sender.next_batch(16)
+    assert [packet[0] for packet in packets] == [seq_add(initial, i) for i in range(len(packets))]
+    encoder.send_data_batch(wire, None, packets)
+    lost = [1, 5] # Wire sequence numbers initial + 1 and 1, on both sides of the wrap
+    for i, packet in enumerate(wire.packets):
+        if i in lost:
+            continue
+        ack = receiver.on_data(packet)
+        if ack is None:
+            ack = receiver.take_ack()
+        ackEncoder.send_ack(acks, None, *ack)
+    assert receiver.delivered_chunks == 1
+    assert receiver.sack_ranges.starts == [2, 6]
+    for ack in acks.packets:
+        sender.on_ack(ack)
+    # The unbounded counters of the scoreboard do not wrap
+    assert sender.scoreboard.is_sacked(4) and not sender.scoreboard.is_sacked(5)
+    assert list(sender.retransmit_queue) == lost
+    wire.packets.clear()
+    packets, _, _ = sender.next_batch(16)
+    assert [packet[0] for packet in packets] == [seq_add(initial, 1), seq_add(initial, 5)]
+    encoder.send_data_batch(wire, None, packets)
+    acks.packets.clear()
+    for packet in wire.packets:
+        ackEncoder.send_ack(acks, None, *receiver.on_data(packet))
+    assert receiver.complete
+    for ack in acks.packets:
+        sender.on_ack(ack)
+    assert sender.finished
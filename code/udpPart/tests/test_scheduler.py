@@ -0,0 +1,72 @@
+import pytest
+
+from madpScheduler import get_scheduler
+
+# Three files in the chunk list: 0 has chunks 0-4, 1 has chunks 5-6 and 2 has chunks 7-9
+FILES = [(0, 0, 5), (1, 5, 2), (2, 7, 3)]
+
+
+def schedule(name, priorities=(1.0, 1.0, 1.0), deadlines=(None, None, None), manifest=None):
+    scheduler = get_scheduler(name)
+    if manifest is not None:
+        scheduler.add_file(-1, *manifest, urgent=True)
+    for (file_id, first, count), priority, deadline in zip(FILES, priorities, deadlines):
+        scheduler.add_file(file_id, first, count, priority, deadline)
+    return scheduler
+
+
+def take_all(scheduler):
+    order = []
+    while (index := scheduler.next_chunk()) is not None:
+        order.append(index)
+    assert len(scheduler) == 0
+    return order
+
+
+def test_fifo():
+    assert take_all(schedule('fifo')) == list(range(10))
+
+
+def test_srpt():
+    assert take_all(schedule('srpt')) == [5, 6, 7, 8, 9, 0, 1, 2, 3, 4]
+    # Priority divides the remaining chunks: 5 / 5 is less than 2 / 1
+    assert take_all(schedule('srpt', priorities=(5.0, 1.0, 1.0))) == [0, 1, 2, 3, 4, 5, 6, 7, 8, 9]
+
+
+def test_srpt_set_priority():
+    scheduler = schedule('srpt')
+    assert scheduler.next_chunk() == 5
+    assert scheduler.set_priority(2, priority=10.0)
+    assert take_all(scheduler) == [7, 8, 9, 6, 0, 1, 2, 3, 4]
+
+
+def test_wrr():
+    # File 0 sends two chunks each turn, the others one
+    assert take_all(schedule('wrr', priorities=(2.0, 1.0, 1.0))) == [0, 1, 5, 7, 2, 3, 6, 8, 4, 9]
+    assert take_all(schedule('wrr')) == [0, 5, 7, 1, 6, 8, 2, 9, 3, 4]
+
+
+def test_edf():
+    # Files without a deadline come last
+    assert take_all(schedule('edf', deadlines=(3.0, None, 1.0))) == [7, 8, 9, 0, 1, 2, 3, 4, 5, 6]
+
+
+def test_edf_set_priority():
+    scheduler = schedule('edf', deadlines=(3.0, None, 1.0))
+    assert scheduler.next_chunk() == 7
+    assert scheduler.set_priority(0, deadline=0.5)
+    assert take_all(scheduler) == [0, 1, 2, 3, 4, 8, 9, 5, 6]
+    assert not scheduler.set_priority(0, deadline=0.1) # Completely taken
+
+
+@pytest.mark.parametrize('name', ['fifo', 'srpt', 'wrr', 'edf'])
+def test_urgent_first(name):
+    # The manifest at chunks 10-11 goes before every file, whatever the policy
+    order = take_all(schedule(name, manifest=(10, 2)))
+    assert order[:2] == [10, 11]
+    assert sorted(order[2:]) == list(range(10))
+
+
+def test_unknown_scheduler():
+    with pytest.raises(ValueError):
+        get_scheduler('lifo')
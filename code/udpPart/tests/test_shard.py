@@ -0,0 +1,66 @@
+import multiprocessing
+import os
+import signal
+import socket
+import threading
+import time
+
+import pytest
+
+import madpShard
+from conftest import free_port
+from madpManifest import Manifest
+
+
+def test_shard_ranges_cover_every_chunk():
+    manifest = Manifest(100, [('a', 1000), ('b', 0), ('c', 250), ('d', 5000)])
+    ranges = madpShard.shard_ranges(manifest, 3)
+    chunks = [(file_id, first + i) for shard in ranges for file_id, first, count in shard for i in range(count)]
+    assert chunks == [(file_id, chunk) for file_id in range(len(manifest)) for chunk in range(manifest.chunk_count(file_id))]
+    sizes = [sum(count for _, _, count in shard) for shard in ranges]
+    assert max(sizes) - min(sizes) <= 1
+
+
+def free_shard_port(shards):
+    """
+    A data port for which the ports DATA_PORT + 2 * i of every shard are free.
+    """
+    while True:
+        port = free_port()
+        sockets = [socket.socket(socket.AF_INET, socket.SOCK_DGRAM) for _ in range(shards)]
+        try:
+            for shard, sock in enumerate(sockets):
+                sock.bind(('0.0.0.0', port + 2 * shard))
+            return port
+        except OSError:
+            continue # Taken or beyond the last port
+        finally:
+            for sock in sockets:
+                sock.close()
+
+
+@pytest.fixture
+def poll(monkeypatch):
+    # The workers are forked, they see the patched module
+    monkeypatch.setattr(madpShard, 'WORKER_POLL', 0.1)
+    monkeypatch.setattr(madpShard, 'DATA_PORT', free_shard_port(2))
+
+
+def test_failed_worker_raises(tmp_path, poll):
+    with pytest.raises(RuntimeError, match="shard 0 exited with 1"):
+        madpShard.receive_sharded(str(tmp_path), 1400, os.urandom(32), 2, checksums=['not-a-checksum'])
+    assert not multiprocessing.active_children()
+
+
+def test_killed_worker_raises(tmp_path, poll):
+    def kill():
+        time.sleep(0.5)
+        os.kill(multiprocessing.active_children()[0].pid, signal.SIGKILL)
+    killer = threading.Thread(target=kill)
+    killer.start()
+    start = time.monotonic()
+    with pytest.raises(RuntimeError, match="exited with -9"):
+        madpShard.receive_sharded(str(tmp_path), 1400, os.urandom(32), 2)
+    killer.join()
+    assert time.monotonic() - start < 10
+    assert not multiprocessing.active_children()
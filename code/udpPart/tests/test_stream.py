@@ -0,0 +1,48 @@
+from conftest import CaptureSocket
+from madpCodec import LAST_CHUNK, PacketEncoder
+from madpConnection import ReceiverConnection
+from madpIntegrity import CRC32
+from madpManifest import MANIFEST_FILE_ID, Manifest
+from madpStream import ReceiveStreams
+from utils import StreamingReassembler
+
+
+def test_gap_in_one_stream_does_not_block_the_others():
+    delivered = []
+    streams = ReceiveStreams(lambda *chunk: delivered.append(chunk[:2]))
+    streams.add(1, 0, b'', 0)
+    streams.add(2, 0, b'', 0) # Chunk 1 of file 1 is missing
+    streams.add(1, 2, b'', LAST_CHUNK)
+    streams.add(2, 1, b'', LAST_CHUNK)
+    assert delivered == [(1, 0), (2, 0), (1, 2), (2, 1)] # Every chunk is delivered as it arrives
+    assert streams[2].complete
+    assert not streams[1].complete
+    assert streams[1].next_chunk == 1
+    assert streams.completed == [2]
+    assert not streams.add(2, 0, b'', 0) # Duplicates are dropped per stream
+    streams.add(1, 1, b'', 0)
+    assert streams[1].next_chunk == 3
+    assert streams.completed == [2, 1]
+    assert delivered[-1] == (1, 1)
+
+
+def test_file_completes_behind_a_loss_of_another_file(tmp_path):
+    manifest = Manifest(4, [('a.bin', 12), ('b.bin', 8)])
+    chunks = [(MANIFEST_FILE_ID, 0, manifest.encode(), LAST_CHUNK)]
+    chunks += [(0, i, b'aaaa', LAST_CHUNK if i == 2 else 0) for i in range(3)]
+    chunks += [(1, i, b'bbbb', LAST_CHUNK if i == 1 else 0) for i in range(2)]
+    encoder = PacketEncoder(CRC32)
+    wire = CaptureSocket()
+    for seq, (fileId, chunkNum, payload, flags) in enumerate(chunks):
+        encoder.send_data(wire, None, seq, fileId, chunkNum, flags, payload)
+    receiver = ReceiverConnection(0, StreamingReassembler(4, str(tmp_path)), window=64,
+                                  total_chunks=len(chunks), checksum=CRC32)
+    lost = wire.packets[2] # Chunk 1 of a.bin
+    for packet in wire.packets[:2] + wire.packets[3:]:
+        ack = receiver.on_data(packet)
+    assert ack[1] == 1 # The connection still waits for the lost packet
+    assert (tmp_path / 'b.bin').read_bytes() == b'bbbb' * 2
+    assert not (tmp_path / 'a.bin').exists()
+    receiver.on_data(lost)
+    assert (tmp_path / 'a.bin').read_bytes() == b'aaaa' * 3
+    assert receiver.complete
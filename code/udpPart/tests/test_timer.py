@@ -0,0 +1,109 @@
+import threading
+import time
+
+import pytest
+
+from madpTimer import TimerWheel
+
+
+@pytest.fixture
+def wheel():
+    # A small wheel, so that most deadlines below are more than one round away
+    wheel = TimerWheel(tick=0.001, slots=8)
+    yield wheel
+    wheel.stop()
+
+
+class Recorder:
+    """
+    Callbacks that record when they fired.
+    """
+    def __init__(self):
+        self.fired = []
+        self.lock = threading.Lock()
+
+    def callback(self, key):
+        def fire():
+            with self.lock:
+                self.fired.append((key, time.monotonic()))
+        return fire
+
+    def keys(self):
+        with self.lock:
+            return [key for key, _ in self.fired]
+
+    def wait(self, count, timeout=2.0):
+        deadline = time.monotonic() + timeout
+        while len(self.keys()) < count and time.monotonic() < deadline:
+            time.sleep(0.001)
+        return self.keys()
+
+
+def test_deadlines_fire_in_order(wheel):
+    recorder = Recorder()
+    start = time.monotonic()
+    delays = {'c': 0.06, 'a': 0.02, 'b': 0.04}
+    for key, delay in delays.items():
+        wheel.schedule(key, delay, recorder.callback(key))
+    assert recorder.wait(3) == ['a', 'b', 'c']
+    for key, fired in recorder.fired:
+        assert fired >= start + delays[key] # Never early, whichever round the slot comes up in
+
+
+def test_deadlines_many_rounds_away(wheel):
+    # 0.05 s is more than six rounds of an 8 ms wheel, the slot is visited six times before
+    recorder = Recorder()
+    start = time.monotonic()
+    wheel.schedule('far', 0.05, recorder.callback('far'))
+    wheel.schedule('near', 0.003, recorder.callback('near'))
+    assert recorder.wait(1) == ['near']
+    assert 'far' in wheel.timers
+    assert recorder.wait(2) == ['near', 'far']
+    assert recorder.fired[1][1] >= start + 0.05
+    assert not wheel.timers
+
+
+def test_cancel(wheel):
+    recorder = Recorder()
+    wheel.schedule('cancelled', 0.01, recorder.callback('cancelled'))
+    wheel.schedule('kept', 0.02, recorder.callback('kept'))
+    wheel.cancel('cancelled')
+    wheel.cancel('unknown') # Nothing to disarm
+    assert recorder.wait(1) == ['kept']
+    time.sleep(0.02)
+    assert recorder.keys() == ['kept']
+
+
+def test_rearming_replaces_the_deadline(wheel):
+    recorder = Recorder()
+    start = time.monotonic()
+    wheel.schedule('rto', 0.005, recorder.callback('first'))
+    for _ in range(10):
+        wheel.schedule('rto', 0.03, recorder.callback('rearmed')) # Every ACK pushes the timer back
+    assert recorder.wait(1) == ['rearmed']
+    assert recorder.fired[0][1] >= start + 0.03
+    time.sleep(0.01)
+    assert recorder.keys() == ['rearmed'] # Fired once, the superseded entries are dropped
+    assert not wheel.timers
+
+
+def test_idle_wheel_catches_up():
+    wheel = TimerWheel(tick=0.001, slots=8)
+    recorder = Recorder()
+    wheel.schedule('first', 0.001, recorder.callback('first'))
+    assert recorder.wait(1) == ['first']
+    time.sleep(0.05) # The thread sleeps without timers, the cursor falls behind
+    wheel.schedule('second', 0.005, recorder.callback('second'))
+    assert recorder.wait(2) == ['first', 'second']
+    wheel.stop()
+    assert not wheel.thread.is_alive()
+
+
+def test_stop_discards_pending_timers():
+    wheel = TimerWheel(tick=0.001, slots=8)
+    recorder = Recorder()
+    wheel.schedule('pending', 0.01, recorder.callback('pending'))
+    wheel.stop()
+    assert not wheel.thread.is_alive()
+    time.sleep(0.02)
+    assert recorder.keys() == []
@@ -0,0 +1,98 @@
+import pytest
+
+from utils import ChunkTracker, FileReassembler, StreamingReassembler
+
+
+def test_chunk_zero_arriving_last():
+    tracker = ChunkTracker()
+    for chunk in (3, 1, 2):
+        tracker.add(chunk, chunk == 3)
+    assert not tracker.is_complete()
+    assert tracker.missing() == [0]
+    assert tracker.missing_count() == 1
+    tracker.add(0, False)
+    assert tracker.is_complete()
+    assert tracker.missing() == []
+
+
+def test_last_chunk_flag_first():
+    tracker = ChunkTracker()
+    tracker.add(4, True)
+    assert tracker.missing() == [0, 1, 2, 3]
+    for chunk in range(4):
+        assert not tracker.is_complete()
+        tracker.add(chunk, False)
+    assert tracker.is_complete()
+
+
+def test_single_chunk_file():
+    tracker = ChunkTracker()
+    assert not tracker.is_complete()
+    assert tracker.add(0, True)
+    assert tracker.is_complete()
+
+
+def test_duplicates_are_counted_once():
+    tracker = ChunkTracker()
+    assert tracker.add(0, False)
+    assert not tracker.add(0, False)
+    assert tracker.add(1, True)
+    assert not tracker.add(1, True)
+    assert tracker.received == 2
+    assert tracker.is_complete()
+    # A duplicate of a chunk received before the last one does not complete the file early
+    tracker = ChunkTracker()
+    tracker.add(0, False)
+    tracker.add(0, False)
+    tracker.add(2, True)
+    assert not tracker.is_complete()
+    assert tracker.missing() == [1]
+
+
+def test_number_of_chunks_unknown():
+    tracker = ChunkTracker()
+    tracker.add(2, False)
+    tracker.add(5, False)
+    assert tracker.missing_count() is None
+    assert tracker.missing() == [0, 1, 3, 4] # Up to the highest chunk received
+    assert not tracker.is_complete()
+
+
+@pytest.mark.parametrize('total', [63, 64, 65, 129])
+def test_end_of_the_bitmap(total):
+    # The bitmap starts with 64 entries and doubles, the last entries and the growth are exact
+    tracker = ChunkTracker()
+    last = total - 1
+    tracker.add(last, True)
+    assert last in tracker
+    assert total not in tracker
+    assert tracker.missing() == list(range(last))
+    for chunk in reversed(range(last)):
+        tracker.add(chunk, False)
+    assert tracker.is_complete()
+    assert tracker.missing() == []
+    assert 10 ** 6 not in tracker
+
+
+def test_file_reassembler_with_chunk_zero_last(tmp_path):
+    reassembler = FileReassembler(str(tmp_path))
+    chunks = [b'a' * 4, b'b' * 4, b'c' * 2]
+    reassembler.add_chunk(7, 2, chunks[2], 1)
+    reassembler.add_chunk(7, 1, chunks[1], 0)
+    reassembler.add_chunk(7, 1, chunks[1], 0)
+    assert not (tmp_path / 'reconstructed_7.obj').exists()
+    assert reassembler.missing_chunks(7) == [0]
+    reassembler.add_chunk(7, 0, chunks[0], 0)
+    assert (tmp_path / 'reconstructed_7.obj').read_bytes() == b''.join(chunks)
+    reassembler.add_chunk(7, 0, chunks[0], 0) # A late duplicate does not write the file again
+    assert reassembler.missing_chunks(7) == []
+
+
+def test_streaming_reassembler_with_chunk_zero_last(tmp_path):
+    reassembler = StreamingReassembler(4, str(tmp_path))
+    reassembler.add_chunk(7, 2, b'c' * 2, 1)
+    reassembler.add_chunk(7, 1, b'b' * 4, 0)
+    assert (tmp_path / 'reconstructed_7.obj.part').exists()
+    reassembler.add_chunk(7, 0, b'a' * 4, 0)
+    assert (tmp_path / 'reconstructed_7.obj').read_bytes() == b'aaaabbbbcc'
+    assert not (tmp_path / 'reconstructed_7.obj.part').exists()
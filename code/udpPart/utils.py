@@ -1,6 +1,49 @@
 import os 
 import hashlib
 import struct
+
+# Sequence numbers are 32-bit and compared with serial number arithmetic (RFC 1982),
+# so a session may wrap around the sequence space as long as fewer than 2^31
+# packets are outstanding at once.
+SEQ_BITS = 32
+SEQ_MODULUS = 1 << SEQ_BITS
+SEQ_MASK = SEQ_MODULUS - 1
+SEQ_HALF = SEQ_MODULUS >> 1
+
+def seq_add(seq, n):
+    """
+    Add n (possibly negative) to a sequence number modulo the sequence space.
+    """
+    return (seq + n) & SEQ_MASK
+
+def seq_diff(a, b):
+    """
+    Signed distance from sequence number b to sequence number a.
+
+    Returns:
+        int: A value in [-2^31, 2^31), positive if a is after b.
+    """
+    return ((a - b + SEQ_HALF) & SEQ_MASK) - SEQ_HALF
+
+def seq_lt(a, b):
+    """
+    True if sequence number a comes before sequence number b.
+    """
+    return seq_diff(a, b) < 0
+
+def seq_unwrap(seq, reference):
+    """
+    Map a 32-bit sequence number to the unbounded counter closest to reference.
+
+    Args:
+        seq (int): Sequence number as it appears on the wire.
+        reference (int): An unbounded counter known to be near seq, e.g. the sender base.
+
+    Returns:
+        int: The unbounded counter whose low 32 bits are seq.
+    """
+    return reference + seq_diff(seq, reference & SEQ_MASK)
+
 # Read data from file
 def read_objects_from_file(path, size:str, file_id:int):
     """
@@ -20,11 +63,90 @@ def read_objects_from_file(path, size:str, file_id:int):
     # return data, size
     
 
-class FileReassembler:
+class ChunkTracker:
+    """
+    Which chunks of a file have been received, in constant time per chunk.
+
+    A bitmap holds one byte per chunk and a counter holds the number of distinct
+    chunks. The number of chunks of the file becomes known when the chunk with the
+    last chunk flag arrives, so the file is complete exactly when the counter
+    reaches it, whatever order the chunks arrived in.
+    """
     def __init__(self):
+        self.bitmap = bytearray(64) # 1 for every received chunk, grown on demand
+        self.received = 0
+        self.total_chunks = None # Known once the last chunk arrived
+
+    def add(self, chunk_number, is_last):
+        """
+        Record a chunk.
+
+        Returns:
+            bool: False if the chunk was already received.
+        """
+        bitmap = self.bitmap
+        if chunk_number >= len(bitmap):
+            bitmap.extend(bytes(max(chunk_number + 1, 2 * len(bitmap)) - len(bitmap)))
+        if bitmap[chunk_number]:
+            return False
+        bitmap[chunk_number] = 1
+        self.received += 1
+        if is_last:
+            self.total_chunks = chunk_number + 1
+        return True
+
+    def __contains__(self, chunk_number):
+        return chunk_number < len(self.bitmap) and self.bitmap[chunk_number] == 1
+
+    def is_complete(self):
+        return self.total_chunks is not None and self.received == self.total_chunks
+
+    def missing_count(self):
+        """
+        Number of chunks still missing, None while the number of chunks is unknown.
+        """
+        return None if self.total_chunks is None else self.total_chunks - self.received
+
+    def missing(self):
+        """
+        Chunk numbers that are still missing, up to the last chunk if it is known and
+        up to the highest received chunk otherwise.
+        """
+        end = self.total_chunks
+        if end is None:
+            end = self.bitmap.rfind(1) + 1
+        missing = []
+        chunk = self.bitmap.find(0, 0, end)
+        while chunk != -1:
+            missing.append(chunk)
+            chunk = self.bitmap.find(0, chunk + 1, end)
+        return missing
+
+
+def output_path(directory, manifest, file_id):
+    """
+    Path a received file is written to: its manifest path under directory, or
+    reconstructed_<id>.obj while no manifest is known.
+    """
+    if manifest is None:
+        return os.path.join(directory, f"reconstructed_{file_id}.obj")
+    return os.path.join(directory, *manifest.paths[file_id].split('/'))
+
+
+class FileReassembler:
+    def __init__(self, directory='.'):
+        self.directory = directory
+        self.manifest = None # Paths and sizes of the files, see madpManifest
         self.files = {}  # Dictionary to hold file data
+        self.trackers = {}  # Received chunks of every file, see ChunkTracker
+
+    def set_manifest(self, manifest):
+        """
+        Name the files after the manifest of the transfer, called before their first chunk.
+        """
+        self.manifest = manifest
 
-    def add_chunk(self, file_id, chunk_number, data, flags, is_large):
+    def add_chunk(self, file_id, chunk_number, data, flags):
         """
         Add a chunk to the file assembly.
 
@@ -32,20 +154,26 @@ class FileReassembler:
             file_id (int): Identifier for the file.
             chunk_number (int): Sequence number of the chunk in the file.
             data (bytes): The actual data chunk.
+            flags (int): 1 if this is the last chunk of the file.
         """
-        file_id = f"l{file_id}" if is_large else f"s{file_id}"
-        if file_id not in self.files:
+        if file_id not in self.trackers: # Kept after completion, so late duplicates are recognized
             self.files[file_id] = {}
+            self.trackers[file_id] = ChunkTracker()
 
+        if not self.trackers[file_id].add(chunk_number, flags == 1):
+            return None # Duplicate chunk
         self.files[file_id][chunk_number] = data
         # print(f"Added chunk {chunk_number} of file {file_id}")
-        # Check if file assembly is complete
-        if flags == 1 and self.is_file_complete(file_id):
+        # Check if file assembly is complete, which is a counter comparison so it is done for
+        # every chunk: the last chunk may arrive before the others
+        if self.is_file_complete(file_id):
             file = self.assemble_file(file_id)
-            # Write the file to disk
-            with open(f"reconstructed_{file_id}.obj", "wb") as f:
+            # Write the file to disk
+            path = output_path(self.directory, self.manifest, file_id)
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            with open(path, "wb") as f:
                 f.write(file)
-            # Remove the file from the dictionary
+            # Remove the file from the dictionary
             del self.files[file_id]
 
         return None
@@ -60,14 +188,21 @@ class FileReassembler:
         Returns:
             bool: True if the file is complete, False otherwise.
         """
-        if file_id not in self.files:
-            return False
+        tracker = self.trackers.get(file_id)
+        return tracker is not None and tracker.is_complete()
 
-        total_chunks = max(self.files[file_id].keys())
-        # Sort the keys
-        return all(chunk in self.files[file_id] for chunk in range(1, total_chunks + 1))
+    def missing_chunks(self, file_id):
+        """
+        Chunk numbers of a file that have not been received yet.
 
-        
+        Args:
+            file_id (int): Identifier for the file.
+
+        Returns:
+            list: The missing chunk numbers, see ChunkTracker.missing.
+        """
+        tracker = self.trackers.get(file_id)
+        return [] if tracker is None else tracker.missing()
 
     def assemble_file(self, file_id):
         """
@@ -79,10 +214,137 @@ class FileReassembler:
         Returns:
             bytes: The assembled file data.
         """
-        file_data = [self.files[file_id][chunk_number] for chunk_number in sorted(self.files[file_id])]
+        chunks = self.files[file_id]
+        file_data = [chunks[chunk_number] for chunk_number in range(self.trackers[file_id].total_chunks)]
         return b"".join(file_data)
     
 
+class StreamingReassembler:
+    """
+    Reassembles files straight to disk, chunk by chunk.
+
+    Every chunk is written at its offset (chunk_number * chunk_size) as soon as it
+    arrives, so no chunk is kept in memory. The output file is preallocated with
+    posix_fallocate once its size is known, and a ChunkTracker per file records the
+    chunks that were written. A file is complete when the chunk with the last chunk
+    flag and every chunk before it were written; it is then renamed from its .part
+    name to its final path.
+
+    Once the manifest of the transfer is set, the files are created at their manifest
+    paths under directory and preallocated to their manifest size when they are
+    opened, and the chunk size of the manifest is used for the offsets.
+    """
+    def __init__(self, chunk_size, directory='.'):
+        """
+        Args:
+            chunk_size (int): Size of every chunk but the last one of a file.
+            directory (str): Directory the reconstructed files are written to.
+        """
+        self.chunk_size = chunk_size
+        self.directory = directory
+        self.manifest = None
+        self.files = {} # Files being written: file_id -> PartialFile
+        self.completed = set()
+
+    def set_manifest(self, manifest):
+        """
+        Take the paths, sizes and chunk size of the files from the manifest of the transfer.
+        """
+        self.manifest = manifest
+        self.chunk_size = manifest.chunk_size
+
+    def add_chunk(self, file_id, chunk_number, data, flags):
+        """
+        Write a chunk to its file.
+
+        Args:
+            file_id (int): Identifier for the file.
+            chunk_number (int): Sequence number of the chunk in the file.
+            data (bytes-like): The actual data chunk.
+            flags (int): 1 if this is the last chunk of the file.
+        """
+        if file_id in self.completed:
+            return None
+        partial = self.files.get(file_id)
+        if partial is None:
+            path = self.path(file_id)
+            size = None
+            if self.manifest is not None:
+                os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+                size = self.manifest.sizes[file_id]
+            partial = self.files[file_id] = PartialFile(path + ".part", size)
+        partial.write(chunk_number, chunk_number * self.chunk_size, data, flags == 1)
+        if partial.is_complete():
+            partial.close()
+            os.replace(partial.path, self.path(file_id))
+            del self.files[file_id]
+            self.completed.add(file_id)
+        return None
+
+    def path(self, file_id):
+        return output_path(self.directory, self.manifest, file_id)
+
+    def close(self):
+        """
+        Close the files that are still incomplete, their .part files are left behind.
+        """
+        for partial in self.files.values():
+            partial.close()
+        self.files.clear()
+
+
+class PartialFile:
+    """
+    Output file of the StreamingReassembler and the tracker of its written chunks.
+    """
+    def __init__(self, path, size=None, shared=False):
+        """
+        Args:
+            path (str): The file to create.
+            size (int): Size of the file if it is known in advance, e.g. from the manifest.
+            shared (bool): Other processes write parts of the same file, so it is not
+                truncated when it is opened, only set to size.
+        """
+        self.path = path
+        flags = os.O_RDWR | os.O_CREAT | getattr(os, 'O_BINARY', 0)
+        self.fd = os.open(path, flags if shared else flags | os.O_TRUNC, 0o644)
+        self.tracker = ChunkTracker()
+        self.size = size
+        if size is not None:
+            if shared:
+                os.ftruncate(self.fd, size)
+            self.allocate(size)
+
+    def allocate(self, size):
+        # Reserve the blocks of the whole file at once
+        if hasattr(os, 'posix_fallocate') and size > 0:
+            try:
+                os.posix_fallocate(self.fd, 0, size)
+            except OSError:
+                pass # Not supported by the file system, the writes allocate the blocks
+
+    def write(self, chunk_number, offset, data, is_last):
+        if chunk_number in self.tracker:
+            return # Duplicate
+        if is_last and self.size is None:
+            # The size is known now
+            self.allocate(offset + len(data))
+        if hasattr(os, 'pwrite'):
+            os.pwrite(self.fd, data, offset)
+        else:
+            os.lseek(self.fd, offset, os.SEEK_SET)
+            os.write(self.fd, data)
+        self.tracker.add(chunk_number, is_last)
+
+    def is_complete(self):
+        return self.tracker.is_complete()
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
 class PreparePacket:
     @classmethod
     def calculate_checksum(cls, data, header_size=1024, tail_size=1024):